@@ -0,0 +1,153 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from res import MINUTES_PER_DAY, ResultsSummary, RunningStats
+from tracefiles import TraceReader
+
+# Slot layout of LogisticsHub's SlotQueue, for the per-slot breakdown
+OPENING_MINUTE = 9 * 60
+SLOT_MINUTES = 30
+
+
+class _PerReplication:
+    """
+    Sum and count of a column per replication number, accumulated chunk by chunk.
+    """
+
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+
+    def add(self, replications: np.ndarray, values: np.ndarray):
+        unique, inverse = np.unique(replications, return_inverse=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(unique))
+        counts = np.bincount(inverse, minlength=len(unique))
+        for r, total, n in zip(unique.tolist(), sums.tolist(), counts.tolist()):
+            self.sums[r] = self.sums.get(r, 0.0) + total
+            self.counts[r] = self.counts.get(r, 0) + n
+
+    def means(self) -> dict:
+        return {r: self.sums[r] / self.counts[r] for r in sorted(self.sums)}
+
+
+def summary_from_traces(reader: TraceReader) -> ResultsSummary:
+    """
+    Rebuilds the ResultsSummary of all traced replications (delay, parcels per dispatch,
+    counts and the daily delay series) by scanning the trace files, without re-simulating.
+    Time to delivery is not traced and stays empty.
+    """
+    summary = ResultsSummary()
+    summary.num_replications = len(reader.replications)
+    for chunk in reader.chunks("deliveries", columns=["time", "delay"]):
+        summary.delay.add_many(chunk["delay"])
+        summary.daily_delay.add_many((chunk["time"] // MINUTES_PER_DAY).astype(np.intp), chunk["delay"])
+        summary.num_deliveries += len(chunk["delay"])
+    for chunk in reader.chunks("dispatches", columns=["number of parcels"]):
+        summary.parcels_per_dispatch.add_many(chunk["number of parcels"])
+        summary.num_dispatches += len(chunk["number of parcels"])
+    return summary
+
+
+def replication_means(reader: TraceReader, table="deliveries", column="delay") -> dict:
+    """
+    Mean of a column per replication number.
+    """
+    per_replication = _PerReplication()
+    for chunk in reader.chunks(table, columns=["replication", column]):
+        per_replication.add(chunk["replication"], chunk[column])
+    return per_replication.means()
+
+
+def between_replication_ci(reader: TraceReader, table="deliveries", column="delay", alpha=0.05):
+    """
+    Confidence interval of the mean of a column from the per-replication means, which
+    (unlike the pooled observations) are independent.
+    """
+    stats = RunningStats()
+    stats.add_many(np.fromiter(replication_means(reader, table, column).values(), dtype=np.float64))
+    return stats.mean, stats.confint(alpha)
+
+
+def slot_delay_breakdown(reader: TraceReader, opening_minute=OPENING_MINUTE, slot_minutes=SLOT_MINUTES) -> dict:
+    """
+    Deliveries and mean delay per booked delivery slot of the day: {slot start "HH:MM": (count, mean delay)}.
+    """
+    sums = np.zeros(0)
+    counts = np.zeros(0, dtype=np.int64)
+    for chunk in reader.chunks("deliveries", columns=["delivery timeslot", "delay"]):
+        slots = ((chunk["delivery timeslot"] % MINUTES_PER_DAY - opening_minute) // slot_minutes).astype(np.intp)
+        n = max(len(sums), int(slots.max()) + 1) if len(slots) else len(sums)
+        sums = np.pad(sums, (0, n - len(sums))) + np.bincount(slots, weights=chunk["delay"], minlength=n)
+        counts = np.pad(counts, (0, n - len(counts))) + np.bincount(slots, minlength=n)
+    breakdown = {}
+    for slot in np.flatnonzero(counts).tolist():
+        start = opening_minute + slot * slot_minutes
+        breakdown[f"{start // 60:02d}:{start % 60:02d}"] = (int(counts[slot]), sums[slot] / counts[slot])
+    return breakdown
+
+
+def plot_histogram(ax, histogram, **kwargs):
+    """
+    Plots a fixed-bin res.Histogram as a density histogram. Values outside its range are
+    not drawn but count in the total, so the bars show the exact density inside the range.
+    """
+    widths = np.diff(histogram.edges)
+    density = histogram.counts / max(histogram.total, 1) / widths
+    ax.stairs(density, histogram.edges, fill=True, edgecolor='black', **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics and figures from trace files, without re-simulating")
+    parser.add_argument("trace_dir", help="directory written by tracefiles.write_replication, e.g. main.py --trace-dir")
+    parser.add_argument("--figures", default=None, help="write the figures into this directory")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    reader = TraceReader(args.trace_dir)
+    summary = summary_from_traces(reader)
+    delay = summary.delay.stats
+    print(f"{summary.num_replications} replications, {summary.num_deliveries} deliveries, {summary.num_dispatches} dispatches")
+    print(f"Mean delivery delay: {delay.mean:.2f} minutes (sd {delay.std:.2f})")
+    mean, confint = between_replication_ci(reader)
+    print(f"Between-replication 95% CI for mean delay: {confint}")
+    print(f"Median / 99th percentile delay: {summary.delay.quantiles.quantile(0.5):.2f} / {summary.delay.quantiles.quantile(0.99):.2f} minutes")
+    print(f"Mean dispatches parcel count: {summary.parcels_per_dispatch.stats.mean:.2f}")
+    breakdown = slot_delay_breakdown(reader)
+    print("Delay per delivery slot:")
+    for slot, (count, slot_mean) in breakdown.items():
+        print(f"  {slot}: {count:>8} deliveries, mean delay {slot_mean:6.2f} minutes")
+    print(f"Scanned in {time.perf_counter() - start_time:.2f} seconds")
+
+    if args.figures:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        os.makedirs(args.figures, exist_ok=True)
+        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(10, 8))
+        plot_histogram(ax[0], summary.delay.histogram, label=f"Delivery delays (n = {summary.num_deliveries})")
+        ax[0].set_title("Delivery Delays")
+        ax[0].set_xlabel("Delay (minutes)")
+        ax[0].set_ylabel("Frequency")
+        ax[0].legend(loc='upper right')
+        plot_histogram(ax[1], summary.parcels_per_dispatch.histogram)
+        ax[1].set_title("Number of Parcels Dispatched")
+        ax[1].set_xlabel("Number of Parcels")
+        ax[1].set_ylabel("Frequency")
+        fig.savefig(os.path.join(args.figures, "delay_histogram.png"))
+
+        fig, ax = plt.subplots(figsize=(10, 5))
+        ax.bar(list(breakdown), [slot_mean for _, slot_mean in breakdown.values()], edgecolor='black')
+        ax.set_title("Mean Delay per Delivery Slot")
+        ax.set_xlabel("Slot start")
+        ax.set_ylabel("Delay (minutes)")
+        ax.tick_params(axis="x", rotation=90)
+        fig.savefig(os.path.join(args.figures, "slot_delay.png"))
+        print(f"Figures written to {args.figures}/")
+
+
+if __name__ == "__main__":
+    main()
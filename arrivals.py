@@ -0,0 +1,180 @@
+import math
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class PiecewiseRate:
+    """
+    Piecewise-constant arrival rate that repeats every `period` minutes.
+    breakpoints: start (minutes into the period) of every segment, the first one must be 0.
+    rates: arrivals per minute during each segment.
+    E.g. PiecewiseRate([0, 360, 720, 1080], np.array([0.5, 1.5, 1.0, 0.5]) / 60) is
+    0.5 trucks per hour at night, 1.5 in the morning etc.
+    """
+
+    def __init__(self, breakpoints, rates, period=MINUTES_PER_DAY):
+        self.breakpoints = np.asarray(breakpoints, dtype=np.float64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        self.period = period
+        if len(self.breakpoints) != len(self.rates) or self.breakpoints[0] != 0:
+            raise ValueError("Need one rate per segment and the first segment must start at 0")
+        if np.any(np.diff(self.breakpoints) <= 0) or self.breakpoints[-1] >= period:
+            raise ValueError("Breakpoints must be increasing and inside the period")
+        if np.any(self.rates < 0):
+            raise ValueError("Rates must be non-negative")
+
+    @classmethod
+    def daily_blocks(cls, rates_per_hour, scale=1.0) -> "PiecewiseRate":
+        """
+        Equal-length blocks over a day, e.g. four rates for 0-6h, 6-12h, 12-18h and 18-24h.
+        """
+        n = len(rates_per_hour)
+        return cls(np.arange(n) * MINUTES_PER_DAY / n, np.asarray(rates_per_hour, dtype=np.float64) * scale / 60)
+
+    @property
+    def max_rate(self):
+        return self.rates.max()
+
+    def tiled(self, horizon):
+        """
+        Returns (segment starts, rates, cumulative rate at every start) covering [0, horizon).
+        """
+        periods = max(1, math.ceil(horizon / self.period))
+        starts = (self.breakpoints[None, :] + self.period * np.arange(periods)[:, None]).ravel()
+        rates = np.tile(self.rates, periods)
+        keep = starts < horizon
+        starts, rates = starts[keep], rates[keep]
+        lengths = np.diff(np.append(starts, horizon))
+        cumulative = np.concatenate(([0.0], np.cumsum(rates * lengths)))
+        return starts, rates, cumulative
+
+    def rate(self, t):
+        """
+        Rate at time(s) t (minutes since the start of the simulation).
+        """
+        segment = np.searchsorted(self.breakpoints, np.mod(t, self.period), side="right") - 1
+        return self.rates[segment]
+
+    def expected_arrivals(self, horizon):
+        return self.tiled(horizon)[2][-1]
+
+
+def _unit_rate_arrivals(total, rng):
+    """
+    Arrival times of a unit-rate Poisson process on [0, total): cumulative sums of
+    exponentials, drawn in batches sized so one batch is almost always enough.
+    """
+    times = np.empty(0)
+    last = 0.0
+    while True:
+        batch = int(total - last + 5 * math.sqrt(total - last + 1) + 10)
+        new = last + np.cumsum(rng.exponential(1.0, size=batch))
+        times = np.concatenate((times, new))
+        if new[-1] >= total:
+            return times[times < total]
+        last = new[-1]
+
+
+def nhpp_inversion(rate: PiecewiseRate, horizon, rng):
+    """
+    Arrival times of the non-homogeneous Poisson process on [0, horizon) by inversion:
+    unit-rate arrivals are mapped through the inverse of the cumulative rate.
+    Needs exactly one exponential per arrival, no draws are rejected.
+    """
+    starts, rates, cumulative = rate.tiled(horizon)
+    unit = _unit_rate_arrivals(cumulative[-1], rng)
+    # side="right" skips segments with rate 0 (their cumulative value repeats)
+    segment = np.searchsorted(cumulative, unit, side="right") - 1
+    return starts[segment] + (unit - cumulative[segment]) / rates[segment]
+
+
+def nhpp_thinning(rate: PiecewiseRate, horizon, rng, thinning_rng=None):
+    """
+    Arrival times of the non-homogeneous Poisson process on [0, horizon) by thinning:
+    candidates from a homogeneous process at the maximum rate are kept with probability
+    rate(t) / max_rate. Candidates come from rng, acceptance draws from thinning_rng.
+    """
+    thinning_rng = thinning_rng if thinning_rng is not None else rng
+    max_rate = rate.max_rate
+    if max_rate <= 0:
+        return np.empty(0)
+    candidates = _unit_rate_arrivals(horizon * max_rate, rng) / max_rate
+    keep = thinning_rng.random(len(candidates)) < rate.rate(candidates) / max_rate
+    return candidates[keep]
+
+
+def truncated_normal_counts(n, mu, sigma, rng):
+    """
+    n package counts from a normal(mu, sigma) truncated to non-negative values, rounded
+    down. Drawn by inversion on the truncated part of the CDF, one uniform per count.
+    """
+    low = ndtr(-mu / sigma)
+    u = rng.uniform(low, 1.0, size=n)
+    u = np.clip(u, 1e-12, 1 - 1e-12)
+    return np.floor(np.maximum(mu + sigma * ndtri(u), 0)).astype(np.int64)
+
+
+class ArrivalSchedule:
+    """
+    All truck arrivals of one replication: arrival time (minutes), number of packages
+    and the index of the hub the truck goes to.
+    """
+
+    def __init__(self, times, packages, hubs):
+        self.times = times
+        self.packages = packages
+        self.hubs = hubs
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def generate(cls, rate: PiecewiseRate, horizon, mu, sigma, n_hubs, streams, method="inversion",
+                 hub_weights=None) -> "ArrivalSchedule":
+        """
+        Draws the whole schedule up front from the "arrivals", "thinning", "packages"
+        and "hub_choice" streams (see streams.py).
+        method: "inversion" or "thinning".
+        hub_weights: share of the trucks going to each hub (normalized), uniform if None.
+        """
+        if method == "inversion":
+            times = nhpp_inversion(rate, horizon, streams["arrivals"])
+        elif method == "thinning":
+            times = nhpp_thinning(rate, horizon, streams["arrivals"], streams["thinning"])
+        else:
+            raise ValueError(f"Unknown arrival method: {method}")
+        packages = truncated_normal_counts(len(times), mu, sigma, streams["packages"])
+        if hub_weights is None:
+            hubs = streams["hub_choice"].integers(n_hubs, size=len(times))
+        else:
+            p = np.asarray(hub_weights, dtype=np.float64)
+            hubs = streams["hub_choice"].choice(n_hubs, size=len(times), p=p / p.sum())
+        return cls(times, packages, hubs)
+
+    def for_hub(self, h) -> "ArrivalSchedule":
+        """
+        The trucks of hub index h only (hub index 0 in the result), so a hub can be simulated on its own.
+        """
+        mask = self.hubs == h
+        return ArrivalSchedule(self.times[mask], self.packages[mask], np.zeros(int(mask.sum()), dtype=np.int64))
+
+    def after(self, t) -> "ArrivalSchedule":
+        """
+        The trucks arriving at or after minute t, e.g. those still to come at a checkpoint.
+        """
+        mask = self.times >= t
+        return ArrivalSchedule(self.times[mask], self.packages[mask], self.hubs[mask])
+
+    def replay(self, env, hubs, logging=False):
+        """
+        SimPy process that hands every truckload to its hub at its arrival time.
+        """
+        for t, n, h in zip(self.times.tolist(), self.packages.tolist(), self.hubs.tolist()):
+            yield env.timeout(t - env.now)
+            hub = hubs[h]
+            if logging:
+                print(f"Trucked arrived at {env.now} with {n} packages at Hub {hub.id}")
+            hub.add_parcels(n)
@@ -0,0 +1,90 @@
+"""
+Events per second of SimPy and the minimal engine in kernel.py on a full simulated day.
+Run from the repository root: python benchmarks/kernel_benchmark.py [replications]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simpy
+
+import instrumentation
+import kernel
+import main
+
+
+class CountingSimpyEnvironment(instrumentation.CountingSimpyEnvironment):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        ENVIRONMENTS.append(self)
+
+
+class TrackedEnvironment(kernel.Environment):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        ENVIRONMENTS.append(self)
+
+
+ENVIRONMENTS = []
+
+
+def benchmark(environment_class, seeds, **params):
+    """
+    Runs one simulated day per seed. Returns (events, seconds, summaries).
+    """
+    ENVIRONMENTS.clear()
+    summaries = []
+    start_time = time.perf_counter()
+    for seed in seeds:
+        summaries.append(main.simulation_run(seed, kernel=environment_class, **params).summary)
+    seconds = time.perf_counter() - start_time
+    return sum(env.events_processed for env in ENVIRONMENTS), seconds, summaries
+
+
+def engine_only(environment_class, bikes=50, trips=200, legs=30):
+    """
+    Engine overhead alone: bikes that repeatedly take a resource and ride `legs` timeouts.
+    Returns (events, seconds).
+    """
+    ENVIRONMENTS.clear()
+    env = environment_class()
+    resource = (kernel.Resource if isinstance(env, kernel.Environment) else simpy.Resource)(env, capacity=bikes // 2)
+
+    def bike(i):
+        for _ in range(trips):
+            with resource.request() as req:
+                yield req
+                for leg in range(legs):
+                    yield env.timeout(1 + (i + leg) % 7)
+
+    for i in range(bikes):
+        env.process(bike(i))
+    start_time = time.perf_counter()
+    env.run()
+    return env.events_processed, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    replications = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    seeds = range(replications)
+    # Route tours are cached per process, warm the cache so both engines do the same TSP work
+    benchmark(TrackedEnvironment, seeds)
+
+    rows = {}
+    for name, environment_class in (("simpy", CountingSimpyEnvironment), ("kernel", TrackedEnvironment)):
+        rows[name] = benchmark(environment_class, seeds)
+        events, seconds, _ = rows[name]
+        print(f"{name:>6}: {events} events in {seconds:.2f} seconds, {events / seconds:,.0f} events/second")
+
+    same = all(
+        a.num_deliveries == b.num_deliveries and a.delay.stats.mean == b.delay.stats.mean
+        for a, b in zip(rows["simpy"][2], rows["kernel"][2])
+    )
+    print(f"Speed-up: {rows['simpy'][1] / rows['kernel'][1]:.2f}x, identical results: {same}")
+
+    print("Engine only (no clustering or routing):")
+    for name, environment_class in (("simpy", CountingSimpyEnvironment), ("kernel", TrackedEnvironment)):
+        events, seconds = engine_only(environment_class)
+        print(f"{name:>6}: {events} events in {seconds:.2f} seconds, {events / seconds:,.0f} events/second")
@@ -0,0 +1,123 @@
+"""
+Load generator for service.py: replays one hub's truck arrival process (the NHPP and
+package counts of run_replication) as manifests, with a tick at every slot start, and
+reports planning throughput and latency percentiles.
+Run from the repository root:
+    python benchmarks/service_load.py --synthetic 5000                      # starts the service on a pipe
+    python benchmarks/service_load.py --socket /tmp/plan.sock --synthetic 5000 --speedup 600
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from arrivals import ArrivalSchedule, PiecewiseRate
+from service import load_area
+from simulation import PLANNED_HUBS
+from slotqueue import SlotQueue
+from streams import RandomStreams
+
+
+def messages(nodes, days=1, lambdas=(0.5, 1.5, 1.0, 0.5), mu=300, sigma=150, seed=0):
+    """
+    Manifests of one hub's trucks (a 1 / PLANNED_HUBS share of the city's arrival rate,
+    uniform destinations, windows left to the service) and a tick at every slot start
+    until the end of the booking horizon, so every parcel gets planned, in time order.
+    """
+    streams = RandomStreams(seed)
+    end_time = days * 24 * 60
+    schedule = ArrivalSchedule.generate(PiecewiseRate.daily_blocks(lambdas, scale=1 / PLANNED_HUBS), end_time, mu, sigma, 1, streams)
+    rng = streams["destinations"]
+    timeline = [(float(t), {"type": "manifest", "time": float(t),
+                            "parcels": [{"destination": int(node)} for node in rng.choice(nodes, size=int(n))]})
+                for t, n in zip(schedule.times.tolist(), schedule.packages.tolist())]
+    slots = SlotQueue()
+    # Parcels of the last day can be booked into slots up to the end of the booking horizon
+    starts = slots.slot_start(np.arange((days + slots.booking_days - 1) * slots.slots_per_day))
+    timeline += [(float(t), {"type": "tick", "time": float(t)}) for t in starts.tolist()]
+    timeline.sort(key=lambda item: item[0])
+    return [message for _, message in timeline]
+
+
+async def run(reader, writer, timeline, speedup=0.0):
+    """
+    Sends the timeline (paced at speedup simulated minutes per second, 0 for as fast as
+    possible), closes the sending side and collects the replies until the service is done.
+    """
+    plans = []
+    errors = []
+
+    async def receive():
+        while line := await reader.readline():
+            reply = json.loads(line)
+            if reply["type"] == "plan":
+                plans.append(reply)
+            elif reply["type"] == "error":
+                errors.append(reply)
+
+    receiver = asyncio.create_task(receive())
+    start_time = time.perf_counter()
+    for message in timeline:
+        if speedup > 0:
+            delay = message["time"] / speedup - (time.perf_counter() - start_time)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+    writer.write_eof()
+    await receiver
+    return plans, errors, time.perf_counter() - start_time
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay the truck arrival process against the planning service")
+    parser.add_argument("--socket", default=None, help="connect to a running service instead of starting one")
+    parser.add_argument("--synthetic", type=int, default=None, help="synthetic grid with this many nodes (as the service)")
+    parser.add_argument("--hub", default="A")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--speedup", type=float, default=0.0, help="simulated minutes per second, 0 for no pacing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tsp-seconds", type=float, default=None, help="passed on to the service it starts")
+    args = parser.parse_args()
+
+    area = load_area(args.hub, args.synthetic)
+    timeline = messages(area.nodes, days=args.days, seed=args.seed)
+    parcels = sum(len(m.get("parcels", ())) for m in timeline)
+    print(f"{len(timeline)} messages, {parcels} parcels over {args.days} day(s)")
+
+    process = None
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        command = [sys.executable, os.path.join(ROOT, "service.py"), "--hub", args.hub]
+        if args.synthetic:
+            command += ["--synthetic", str(args.synthetic)]
+        if args.tsp_seconds is not None:
+            command += ["--tsp-seconds", str(args.tsp_seconds)]
+        process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        reader, writer = process.stdout, process.stdin
+    plans, errors, seconds = await run(reader, writer, timeline, args.speedup)
+    if process is not None:
+        await process.wait()
+
+    latencies = np.array([plan["latency_ms"] for plan in plans])
+    planning = np.array([plan["planning_ms"] for plan in plans])
+    planned = sum(len(bulk["parcels"]) for plan in plans for bulk in plan["bulks"])
+    print(f"{len(plans)} rounds, {planned} of {parcels} parcels planned in {seconds:.2f} seconds "
+          f"({planned / seconds:.0f} parcels/s), {len(errors)} errors")
+    if planned != parcels:
+        print(f"Warning: {parcels - planned} parcels were sent but not planned")
+    if len(plans):
+        print(f"Round latency p50 / p99 / max: {np.percentile(latencies, 50):.1f} / {np.percentile(latencies, 99):.1f} / {latencies.max():.1f} ms")
+        print(f"Planning time per round p50 / p99: {np.percentile(planning, 50):.1f} / {np.percentile(planning, 99):.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
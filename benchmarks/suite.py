@@ -0,0 +1,201 @@
+"""
+Benchmark suite on synthetic street grids, no Eindhoven data needed.
+Run from the repository root:
+    python benchmarks/suite.py                      # compare with benchmarks/baselines.json
+    python benchmarks/suite.py --save-baseline      # store this machine's numbers as the baseline
+    python benchmarks/suite.py --sizes 1000 50000 --only simulation_run
+Every benchmark reports throughput (simulated parcels, routes, samples or rows per
+second) and the tracemalloc peak of one call. Exits with 1 if a throughput dropped or a
+peak grew by more than --tolerance compared to the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import simpy
+from scipy.sparse.csgraph import dijkstra
+
+import routecache
+from cargobike import CargoBike
+from hub import LogisticsHub
+from nodeindex import NodeIndex
+from parcel import ParcelBatch
+from res import Results
+from routecache import RouteCache
+from simulation import run_replication
+from synthetic import StreetGrid
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+SIZES = (1000, 5000, 20000, 50000)
+TSP_SECONDS = 0.05 # fast_tsp time limit during the benchmarks, the default 2 s would dominate everything
+
+
+def _hub(grid: StreetGrid, env=None):
+    return LogisticsHub(env or simpy.Environment(), "A", grid.hub_node, None, grid.nodes, grid.distance_matrix, Results(),
+                        clustering_seed=0, rng=np.random.default_rng(0))
+
+
+def _parcels(grid: StreetGrid, n, seed=0):
+    batch = ParcelBatch.generate(n, grid.nodes, [600.0, 630.0], np.random.default_rng(seed))
+    return batch.parcels(np.arange(n))
+
+
+def bench_bulk_parcels(grid, parcels=1000):
+    hub = _hub(grid)
+    bulk = _parcels(grid, parcels)
+    return lambda: hub.bulk_parcels(bulk, hub.available_bikes), parcels
+
+
+def bench_cluster_destinations(grid, destinations=500):
+    hub = _hub(grid)
+    rng = np.random.default_rng(1)
+    dest_nodes = rng.choice(grid.nodes, size=min(destinations, grid.n_nodes), replace=False).tolist()
+    return lambda: hub._cluster_destinations_kmedoids(dest_nodes, hub.available_bikes), len(dest_nodes)
+
+
+def bench_construct_route(grid, stops=40):
+    env = simpy.Environment()
+    bulk = _parcels(grid, stops, seed=2)
+    node_index = NodeIndex(grid.nodes) # Built once per run by the simulation, not per bike
+
+    def construct():
+        # A fresh cache every call, so the TSP is actually solved
+        bike = CargoBike(env, grid.hub_node, bulk, None, grid.nodes, grid.distance_matrix, Results(), node_index=node_index,
+                          route_cache=RouteCache())
+        bike.construct_route()
+    return construct, stops
+
+
+def bench_sample_link_travel_time(grid, samples=20000):
+    env = simpy.Environment()
+    bike = CargoBike(env, grid.hub_node, [], None, grid.nodes, grid.distance_matrix, Results(), node_index=NodeIndex(grid.nodes),
+                     rng=np.random.default_rng(3))
+    rng = np.random.default_rng(4)
+    pairs = rng.choice(grid.nodes, size=(samples, 2)).tolist()
+
+    def sample():
+        for a, b in pairs:
+            bike.sampleLinkTravelTime(a, b, bike.max_speed)
+    return sample, samples
+
+
+def bench_matrix_generation(grid, sources=64):
+    csr = grid.csr()
+    indices = np.linspace(0, grid.n_nodes - 1, sources).astype(np.intp)
+    return lambda: dijkstra(csr, indices=indices), sources
+
+
+def bench_simulation_run(grid, seed=0):
+    city = grid.city()
+    parcels = []
+
+    def simulate():
+        routecache.ROUTE_CACHE.clear()
+        results = run_replication(seed, city, verbose=False)
+        parcels.append(results.summary.num_deliveries)
+    # Parcels delivered are only known after the run, see run()
+    return simulate, parcels
+
+
+BENCHMARKS = {
+    "bulk_parcels": (bench_bulk_parcels, "parcels/s"),
+    "cluster_destinations_kmedoids": (bench_cluster_destinations, "destinations/s"),
+    "construct_route": (bench_construct_route, "stops/s"),
+    "sample_link_travel_time": (bench_sample_link_travel_time, "samples/s"),
+    "matrix_generation": (bench_matrix_generation, "rows/s"),
+    "simulation_run": (bench_simulation_run, "parcels/s"),
+}
+
+
+def run(name, grid, repeat=3):
+    """
+    Best-of-repeat seconds of one call, its throughput and the tracemalloc peak (MB).
+    """
+    setup, unit = BENCHMARKS[name]
+    call, work = setup(grid)
+    call() # Warm-up (imports, caches outside the measured code)
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    amount = work[-1] if isinstance(work, list) else work
+    return {"seconds": best, "throughput": amount / best, "unit": unit, "peak_mb": peak / 2**20}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of regression messages (slower or more memory than the baseline allows).
+    """
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: {result['throughput']:,.0f} {result['unit']} vs baseline {reference['throughput']:,.0f}")
+        if result["peak_mb"] > reference["peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{key}: peak {result['peak_mb']:.1f} MB vs baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmarks on synthetic street grids")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="grid sizes in nodes")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative throughput loss / memory growth")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    routecache.TSP_SECONDS = TSP_SECONDS
+    results = {}
+    for n in args.sizes:
+        grid = StreetGrid(n)
+        for name in args.only:
+            result = run(name, grid, args.repeat)
+            results[f"{name}[{n}]"] = result
+            print(f"{name:>30} {n:>6} nodes: {result['throughput']:>12,.0f} {result['unit']:<15} "
+                  f"{result['seconds'] * 1000:>9.1f} ms  peak {result['peak_mb']:7.1f} MB", flush=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "numpy": np.__version__,
+                       "tsp_seconds": TSP_SECONDS, "results": baseline}, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print(f"{len(regressions)} regressions against the baseline from {baseline['machine']}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import math
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+from simulation import City
+
+
+class GridDistanceMatrix:
+    """
+    Shortest-path lengths (metres) between the nodes of a StreetGrid, computed on access.
+    On a grid with equally long blocks the shortest path is the Manhattan distance, so
+    the matrix never has to be stored: 50k nodes would take 10 GB as float32.
+    Supports the indexing the simulation uses: scalars, index arrays and np.ix_ blocks.
+    """
+
+    def __init__(self, rows: np.ndarray, cols: np.ndarray, block_metres):
+        self.rows = rows
+        self.cols = cols
+        self.block_metres = block_metres
+        self.shape = (len(rows), len(rows))
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        a, b = key
+        distance = (np.abs(self.rows[a] - self.rows[b]) + np.abs(self.cols[a] - self.cols[b])) * self.block_metres
+        return float(distance) if np.ndim(distance) == 0 else distance.astype(np.float64)
+
+    def dense(self, dtype=np.float32) -> np.ndarray:
+        n = self.shape[0]
+        idx = np.arange(n)
+        return self[np.ix_(idx, idx)].astype(dtype)
+
+
+class StreetGrid:
+    """
+    Deterministic synthetic street grid with n_nodes intersections, filled row by row
+    into a square of ceil(sqrt(n_nodes)) columns, with two-way streets of block_metres
+    between neighbours. Node IDs are sorted like the OSM IDs in the real data.
+    """
+
+    def __init__(self, n_nodes, block_metres=80.0, speed_kmh=15.0):
+        self.n_nodes = n_nodes
+        self.width = math.ceil(math.sqrt(n_nodes))
+        self.block_metres = block_metres
+        self.speed_kmh = speed_kmh
+        position = np.arange(n_nodes)
+        self.rows, self.cols = np.divmod(position, self.width)
+        self.nodes = (1_000_000 + 7 * position).astype(np.int64)
+        self.distance_matrix = GridDistanceMatrix(self.rows, self.cols, block_metres)
+
+    @property
+    def hub_node(self) -> int:
+        """
+        The intersection closest to the centre of the grid.
+        """
+        centre = np.abs(self.rows - self.rows.max() / 2) + np.abs(self.cols - (self.width - 1) / 2)
+        return int(self.nodes[centre.argmin()])
+
+    def edges(self):
+        """
+        Returns (tail positions, head positions) of every directed street segment.
+        """
+        position = np.arange(self.n_nodes)
+        right = position[(self.cols < self.width - 1) & (position + 1 < self.n_nodes)]
+        down = position[position + self.width < self.n_nodes]
+        tails = np.concatenate((right, right + 1, down, down + self.width))
+        heads = np.concatenate((right + 1, right, down + self.width, down))
+        return tails, heads
+
+    def csr(self) -> sparse.csr_matrix:
+        """
+        Street lengths as a sparse adjacency matrix, the input of csgraph.dijkstra.
+        """
+        tails, heads = self.edges()
+        lengths = np.full(len(tails), self.block_metres)
+        return sparse.csr_matrix((lengths, (tails, heads)), shape=(self.n_nodes, self.n_nodes))
+
+    def graph(self) -> nx.DiGraph:
+        """
+        The grid as an osmnx-like DiGraph with "length" and "travel_time" edge attributes.
+        """
+        tails, heads = self.edges()
+        travel_time = self.block_metres / (self.speed_kmh / 3.6)
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes.tolist())
+        G.add_edges_from(
+            (u, v, {"length": self.block_metres, "travel_time": travel_time})
+            for u, v in zip(self.nodes[tails].tolist(), self.nodes[heads].tolist())
+        )
+        return G
+
+    def city(self, hubs=1) -> City:
+        """
+        City with hubs A, B, ... sharing the grid: one hub at the centre, or several spread
+        evenly over the node positions.
+        """
+        if hubs == 1:
+            hub_nodes = {"A": self.hub_node}
+        else:
+            positions = ((np.arange(hubs) + 0.5) * self.n_nodes / hubs).astype(np.intp)
+            hub_nodes = {chr(ord("A") + h): int(self.nodes[p]) for h, p in enumerate(positions)}
+        return City.shared(self.nodes, self.distance_matrix, hub_nodes=hub_nodes)
@@ -1,16 +1,37 @@
 # import streamlit as st
-import scipy.stats as stats
-
 from res import Results
 # from utils import absolute_time, log
 import networkx as nx
-import fast_tsp
 import numpy as np
 
+from nodeindex import NodeIndex
+from routecache import ROUTE_CACHE, RouteCache
+from travel import ConstantSpeed, sample_route_travel_times
+
 LOGGING = False
 
+
+class TripState:
+    """
+    Where a bike is on its trip, see checkpoint.py: the route (node IDs), the parcels of
+    every stop, the sampled leg times, the leg it is riding and the time that leg ends.
+    registered: the deliveries and the route were registered at dispatch (fast-forward trips).
+    """
+    __slots__ = ("route", "stop_parcels", "travel_times", "leg", "leg_end", "registered")
+
+    def __init__(self, route, stop_parcels, travel_times, leg=0, leg_end=None, registered=False):
+        self.route = route
+        self.stop_parcels = stop_parcels
+        self.travel_times = travel_times
+        self.leg = leg
+        self.leg_end = leg_end
+        self.registered = registered
+
+
 class CargoBike:
-    def __init__(self, env, source, parcels: list, city_network, serviced_nodes: np.ndarray, distance_matrix: np.ndarray, results: Results):
+    def __init__(self, env, source, parcels: list, city_network, serviced_nodes: np.ndarray, distance_matrix: np.ndarray, results: Results, node_index: NodeIndex = None,
+                 rng: np.random.Generator = None, speed_model=None, route_cache: RouteCache = None, fast_forward=False,
+                 neighbours=None, trip_state: TripState = None):
         self.env = env
         self.source = source
         self.load_left = 200
@@ -20,73 +41,123 @@ class CargoBike:
         self.city_network = city_network
         self.nodes = serviced_nodes
         self.dist_matrix = distance_matrix
+        self.node_index = node_index if node_index is not None else NodeIndex(serviced_nodes)
         self.current_location = source
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.speed_model = speed_model if speed_model is not None else ConstantSpeed(self.max_speed)
+        self.route_cache = route_cache if route_cache is not None else ROUTE_CACHE
+        self.neighbours = neighbours # knn.NeighbourIndex for large tours, see RouteCache.tour
+        self.fast_forward = fast_forward # One timeout per trip instead of one per leg, see deliver_fast_forward
 
         self.battery_capacity = 100
         self.parcels = parcels
-        self.env.process(self.deliver())
+        self.state = trip_state # TripState once the trip has started
+        # Succeeds when the bike is back at the source; a trip_state continues a checkpointed trip
+        if trip_state is not None:
+            self.trip = self.env.process(self.resume_trip(trip_state))
+        else:
+            self.trip = self.env.process(self.deliver_fast_forward() if fast_forward else self.deliver())
         self.results = results
 
     def construct_route(self):
         """
         Construct a route based on the parcels to be delivered.
         The route starts at the source, visits each parcel's destination, and returns to the source.
+        Returns: list of node IDs.
         """
-        
-        node_id_to_matrix_idx_map = {node_id: i for i, node_id in enumerate(self.nodes)}
-        
-        # Create a list of parcel destination nodes
-        ids = [parcel.destination for parcel in self.parcels]
-        ids.append(self.source)
-        local_dist_matrix = [[0] * len(ids) for _ in range(len(ids))]
-
-        # Populate the sub-distance matrix
-        for i, node_id_i in enumerate(ids):
-            for j, node_id_j in enumerate(ids):
-                if i == j: continue
-                matrix_idx_i = node_id_to_matrix_idx_map[node_id_i]
-                matrix_idx_j = node_id_to_matrix_idx_map[node_id_j]
-                local_dist_matrix[i][j] = int(self.dist_matrix[matrix_idx_i, matrix_idx_j])
-        
-        tour = [ids[i] for i in fast_tsp.find_tour(local_dist_matrix)] # compute the tour, then replace IDs of indices with original IDs
-        while tour[0] != self.source:
-            tour.append(tour.pop(0))
-        tour.append(self.source)  # Ensure the route ends at the source
-        return tour
-    
+        return self.node_index.node(self.construct_route_indices()).tolist()
+
+    def construct_route_indices(self) -> np.ndarray:
+        """
+        Same as construct_route, but returns the distance matrix indices of the route.
+        """
+        return self.plan_route()[0]
+
+    def plan_route(self):
+        """
+        Solves (or looks up) the tour over the unique parcel destinations.
+        Returns: (route matrix indices, list with the parcels to drop at every stop of the
+                  route between the source at both ends).
+        """
+        parcel_idx = self.node_index.parcel_indices(self.parcels)
+        # Several parcels for one address are a single stop
+        stops, stop_of_parcel = np.unique(parcel_idx, return_inverse=True)
+        route_idx = self.route_cache.tour(self.dist_matrix, stops, self.node_index.index(self.source), self.neighbours)
+
+        # Group the parcels by stop in one pass, then put the groups in route order
+        parcels_at = [[] for _ in range(len(stops))]
+        for parcel, stop in zip(self.parcels, stop_of_parcel.tolist()):
+            parcels_at[stop].append(parcel)
+        return route_idx, [parcels_at[stop] for stop in np.searchsorted(stops, route_idx[1:-1]).tolist()]
+
     def deliver(self):
         """
         Find route
         Check battery
         Dispatch
         """
-        route = self.construct_route()
-        # Create a list of parcels in the order they will be delivered
-        ordered_parcels = []
-        for node in route[1:-1]:
-            for parcel in self.parcels:
-                if parcel.destination == node:
-                    ordered_parcels.append(parcel)
-                    break
-                
-        # print(route, len(self.parcels), len(ordered_parcels))
-        
-        for i in range(len(route) - 1):
+        route_idx, stop_parcels = self.plan_route()
+        route = self.node_index.node(route_idx).tolist()
+
+        # Sample all leg times at once instead of one scipy draw per leg
+        travel_times = sample_route_travel_times(self.dist_matrix, route_idx, self.rng, self.speed_model, self.env.now).tolist()
+        self.state = TripState(route, stop_parcels, travel_times)
+        yield from self._ride(travel_times[0])
+
+    def resume_trip(self, state: TripState):
+        """
+        Continues a trip from a checkpoint: the rest of the current leg, then the remaining
+        legs with the travel times sampled at dispatch.
+        """
+        self.current_location = state.route[state.leg]
+        yield from self._ride(max(0.0, state.leg_end - self.env.now))
+
+    def _ride(self, first_leg_minutes):
+        """
+        Rides self.state from its current leg (first_leg_minutes from now) back to the source.
+        """
+        state = self.state
+        route, stop_parcels = state.route, state.stop_parcels
+        minutes = first_leg_minutes
+        for i in range(state.leg, len(route) - 1):
             if LOGGING:
                 print(f"Traveling from {route[i]} to {route[i+1]} at time {self.env.now}")
-            travel_time = self.sampleLinkTravelTime(route[i], route[i+1], self.max_speed)
-            yield self.env.timeout(travel_time)
-            if(len(ordered_parcels) > 0):
-                self.results.register_delivery(
-                    self.env.now,
-                    ordered_parcels.pop(0),
-                    # f"Delivering parcel {parcel.id} from {self.source} at {absolute_time(self.env.now)}. Time taken: {time_delivered:.2f} minutes."
-                )
+            state.leg, state.leg_end = i, self.env.now + minutes
+            yield self.env.timeout(minutes)
+            if i < len(stop_parcels) and not state.registered:
+                delivered = stop_parcels[i]
+                self.results.register_deliveries([self.env.now] * len(delivered), delivered)
             self.current_location = route[i+1]
             if LOGGING:
                 print(f"Arrived at {self.current_location} at time {self.env.now}")
-        
+            if i + 2 < len(route):
+                minutes = state.travel_times[i + 1]
+
+        if not state.registered:
+            self.results.register_bike_route(route)
+
+    def deliver_fast_forward(self):
+        """
+        Same trip as deliver, but the whole timeline is computed at dispatch: the arrival
+        time at every stop comes from one cumulative sum over the sampled leg times, all
+        deliveries are registered in one call and the bike waits a single timeout until
+        it is back. Uses the same random draws as deliver, so both modes give the same
+        results (except for deliveries deliver would not reach before the run ends).
+        """
+        route_idx, stop_parcels = self.plan_route()
+        route = self.node_index.node(route_idx).tolist()
+        travel_times = sample_route_travel_times(self.dist_matrix, route_idx, self.rng, self.speed_model, self.env.now)
+
+        # Adding the legs one by one from env.now gives exactly the clock values of deliver
+        arrivals = np.cumsum(np.concatenate(([self.env.now], travel_times)))
+        counts = [len(parcels) for parcels in stop_parcels]
+        delivered = [parcel for parcels in stop_parcels for parcel in parcels]
+        self.results.register_deliveries(np.repeat(arrivals[1:len(stop_parcels) + 1], counts), delivered)
         self.results.register_bike_route(route)
+
+        self.state = TripState(route, stop_parcels, travel_times, leg=len(route) - 2, leg_end=arrivals[-1], registered=True)
+        yield self.env.timeout(arrivals[-1] - self.env.now)
+        self.current_location = route[-1]
         
         # while self.parcels:
         #     parcel_to_deliver = self.parcels.pop(0)
@@ -104,17 +175,17 @@ class CargoBike:
         Given indices of 2 nodes on the map and a maximum speed (km/h), 
         sample a travel time between them.
         Travel time is modeled as normally distributed with:
-          mu = (length in km) / v_max, and sigma = mu/20.
+          mu = (length in km) / v_max, and sigma = mu/20, clipped at zero.
         Returns: travel time in minutes.
+        deliver() samples whole routes with travel.sample_route_travel_times instead.
         """
-        index_a = np.where(self.nodes == node_a)[0][0]
-        index_b = np.where(self.nodes == node_b)[0][0]
+        index_a = self.node_index.index(node_a)
+        index_b = self.node_index.index(node_b)
         link_length = self.dist_matrix[index_a, index_b]  # length in meters
         length_km = link_length / 1000.0
         mu = length_km / v_max  # travel time in hours
         sigma = mu / 20.0
-        dist = stats.norm(mu, sigma)
-        t = dist.rvs()
+        t = max(0.0, self.rng.normal(mu, sigma))
         return t * 60 
 
     # def travel(self, time):
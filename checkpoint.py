@@ -0,0 +1,103 @@
+import copy
+import os
+import pickle
+import random
+
+import numpy as np
+
+from arrivals import ArrivalSchedule
+from hub import LogisticsHub
+from parcel import parcel_ids
+
+
+class HubState:
+    """
+    One hub at a checkpoint: its parcel queue, the trips of the bikes that are out (see
+    cargobike.TripState), the bulks waiting for a bike (event mode), the trucks still to
+    come, its random streams, its Results so far and the LogisticsHub parameters it ran with.
+    """
+
+    def __init__(self, name, parcel_queue, trips, ready_bulks, clustering_calls, trucks: ArrivalSchedule, streams, results, hub_params: dict):
+        self.name = name
+        self.parcel_queue = parcel_queue
+        self.trips = trips
+        self.ready_bulks = ready_bulks
+        self.clustering_calls = clustering_calls
+        self.trucks = trucks
+        self.streams = streams
+        self.results = results
+        self.hub_params = hub_params
+
+    def copy(self) -> "HubState":
+        """
+        Independent copy (parcels shared by the queue, the trips and the bulks stay shared
+        within the copy), so the same state can be restored any number of times.
+        """
+        return copy.deepcopy(self)
+
+
+class Checkpoint:
+    """
+    State of a replication at minute `time` (events at exactly `time` have not happened
+    yet): one HubState per hub, the replication parameters and the process-wide random
+    state and parcel ids. Made by simulation.run_replication(checkpoint_at=...), continued
+    any number of times, with other parameters, by simulation.resume_replication. Pickles
+    to tens to a few hundred KB per hub (queued parcels and statistics so far, nothing of
+    the street network), so branches can run in pool workers or from a file (save / load).
+    """
+
+    def __init__(self, time, hubs: dict, params: dict, global_state=None):
+        self.time = time
+        self.hubs = hubs
+        self.params = params
+        self.global_state = global_state if global_state is not None else capture_global_state()
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path) -> "Checkpoint":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def capture_global_state() -> dict:
+    """
+    The process-wide random states and the next parcel id.
+    """
+    return {"random": random.getstate(), "numpy": np.random.get_state(), "next_parcel_id": parcel_ids.next_id}
+
+
+def restore_global_state(state: dict):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    parcel_ids.next_id = state["next_parcel_id"]
+
+
+def capture_hub(hub: LogisticsHub, trucks: ArrivalSchedule, hub_params: dict) -> HubState:
+    """
+    Copies the state of a hub whose environment was run until the checkpoint time;
+    trucks are its arrivals from that time on (ArrivalSchedule.after).
+    """
+    state = HubState(hub.id, hub.parcel_queue, hub.in_flight(), list(hub.ready_bulks), hub.clustering_calls,
+                     trucks, hub.streams, hub.results, dict(hub_params))
+    return state.copy()
+
+
+def restore_hub(state: HubState, area, time, environment_class, city_network=None, logging=False, **hub_params):
+    """
+    Builds the hub of `state` on a new environment starting at `time`, with hub_params
+    overriding the checkpointed ones (e.g. available_bikes), and starts its remaining
+    trucks and trips. Uses state itself, pass state.copy() to restore it again later.
+    Returns (environment, Results, LogisticsHub).
+    """
+    env = environment_class(initial_time=time)
+    hub = LogisticsHub(env, state.name, area.location, city_network, area.nodes, area.distance_matrix, state.results,
+                       node_index=area.node_index, neighbours=area.neighbours, streams=state.streams,
+                       **dict(state.hub_params, **hub_params))
+    hub.restore(state.parcel_queue, state.trips, state.ready_bulks, state.clustering_calls)
+    env.process(state.trucks.replay(env, [hub], logging=logging))
+    return env, state.results, hub
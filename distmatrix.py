@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+
+MAGIC = b"DMX1"
+ALIGNMENT = 64
+UINT32_SENTINEL = np.iinfo(np.uint32).max # Unreachable pair
+DECIMETRES_PER_METRE = 10
+
+
+def file_sha256(path, chunk_size=1 << 20) -> str:
+    """
+    Returns the hex sha256 of a file, used to tie a matrix to the graphml it came from.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode(block: np.ndarray, dtype) -> np.ndarray:
+    """
+    Converts a block of distances in metres (inf = unreachable) to the on-disk dtype.
+    """
+    if dtype == "float32":
+        return block.astype(np.float32)
+    encoded = np.rint(np.where(np.isfinite(block), block, 0) * DECIMETRES_PER_METRE)
+    if encoded.max(initial=0) >= UINT32_SENTINEL:
+        raise ValueError("Distance too large for uint32 decimetres")
+    encoded = encoded.astype(np.uint32)
+    encoded[~np.isfinite(block)] = UINT32_SENTINEL
+    return encoded
+
+
+def create_compact(path, nodes: np.ndarray, hub_id=None, graph_sha256=None, dtype="uint32") -> np.memmap:
+    """
+    Creates a compact matrix file: magic, header length, JSON header (node count, dtype,
+    hub id, graph checksum, offsets), the int64 node list and room for the n x n matrix,
+    both 64-byte aligned so they can be memory-mapped. dtype is "uint32" (decimetres,
+    UINT32_SENTINEL = unreachable) or "float32" (metres, inf = unreachable).
+    Returns a writable memmap of the raw matrix, to be filled with encode().
+    """
+    if dtype not in ("uint32", "float32"):
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    nodes = np.asarray(nodes, dtype=np.int64)
+    n = len(nodes)
+
+    header = {
+        "n": n,
+        "dtype": dtype,
+        "unit": "dm" if dtype == "uint32" else "m",
+        "hub_id": None if hub_id is None else int(hub_id),
+        "graph_sha256": graph_sha256,
+    }
+    # The offsets depend on the header length, so reserve room for them first
+    header["nodes_offset"] = header["matrix_offset"] = 0
+    header_len = len(json.dumps(header)) + 64
+    nodes_offset = -(-(len(MAGIC) + 4 + header_len) // ALIGNMENT) * ALIGNMENT
+    header["nodes_offset"] = nodes_offset
+    header["matrix_offset"] = -(-(nodes_offset + nodes.nbytes) // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode().ljust(header_len)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint32(header_len).tobytes())
+        f.write(header_bytes)
+        f.seek(nodes_offset)
+        f.write(nodes.tobytes())
+        f.truncate(header["matrix_offset"] + n * n * np.dtype(dtype).itemsize)
+    return np.memmap(path, dtype=dtype, mode="r+", offset=header["matrix_offset"], shape=(n, n))
+
+
+def save_compact(path, nodes: np.ndarray, distance_matrix: np.ndarray, hub_id=None, graph_sha256=None, dtype="uint32", chunk_rows=1024):
+    """
+    Writes a distance matrix (metres, inf for unreachable pairs) in the compact format,
+    see create_compact. Rows are converted in chunks, so the source may itself be a
+    memory-mapped .npy.
+    """
+    n = len(nodes)
+    if distance_matrix.shape != (n, n):
+        raise ValueError(f"Matrix shape {distance_matrix.shape} does not match {n} nodes")
+    raw = create_compact(path, nodes, hub_id=hub_id, graph_sha256=graph_sha256, dtype=dtype)
+    for start in range(0, n, chunk_rows):
+        block = np.asarray(distance_matrix[start:start + chunk_rows], dtype=np.float64)
+        raw[start:start + chunk_rows] = encode(block, dtype)
+    raw.flush()
+
+
+def read_header(path) -> dict:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compact distance matrix")
+        header_len = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        return json.loads(f.read(header_len))
+
+
+class CompactDistanceMatrix:
+    """
+    Read-only view of a compact distance matrix file. Indexing works like on the dense
+    float64 matrix (scalars, slices, fancy indices, np.ix_) and returns metres with inf
+    for unreachable pairs; only the accessed entries are read and decoded.
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.header = read_header(path)
+        self.hub_id = self.header["hub_id"]
+        self.graph_sha256 = self.header["graph_sha256"]
+        n = self.header["n"]
+        self.shape = (n, n)
+        self.ndim = 2
+
+        if mmap_mode is None:
+            data = np.fromfile(path, dtype=np.uint8)
+            self.nodes = data[self.header["nodes_offset"]:self.header["nodes_offset"] + 8 * n].view(np.int64)
+            self.raw = data[self.header["matrix_offset"]:].view(self.header["dtype"])[:n * n].reshape(n, n)
+        else:
+            self.nodes = np.memmap(path, dtype=np.int64, mode=mmap_mode, offset=self.header["nodes_offset"], shape=(n,))
+            self.raw = np.memmap(path, dtype=self.header["dtype"], mode=mmap_mode, offset=self.header["matrix_offset"], shape=(n, n))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def decode(self, raw):
+        """
+        Converts raw on-disk values to metres.
+        """
+        if self.header["dtype"] == "float32":
+            return np.asarray(raw, dtype=np.float64)
+        metres = np.asarray(raw, dtype=np.float64) / DECIMETRES_PER_METRE
+        return np.where(raw == UINT32_SENTINEL, np.inf, metres)
+
+    def __getitem__(self, key):
+        decoded = self.decode(self.raw[key])
+        return float(decoded) if decoded.ndim == 0 else decoded
+
+    def __array__(self, dtype=None, copy=None):
+        return self.decode(self.raw) if dtype is None else self.decode(self.raw).astype(dtype)
+
+    def is_stale(self, graphml_path) -> bool:
+        """
+        True if the matrix was not built from this graphml file (or has no checksum).
+        """
+        return self.graph_sha256 != file_sha256(graphml_path)
+
+
+def load_compact(path, mmap_mode="r") -> CompactDistanceMatrix:
+    """
+    Opens a compact distance matrix; with mmap_mode="r" nothing is read until accessed.
+    """
+    return CompactDistanceMatrix(path, mmap_mode=mmap_mode)
+
+
+def load_distance_matrix(path, mmap_mode="r"):
+    """
+    Loads a distance matrix in either format: a compact file or a dense .npy.
+    Returns (nodes or None, matrix).
+    """
+    if str(path).endswith(".npy"):
+        return None, np.load(path, mmap_mode=mmap_mode)
+    matrix = load_compact(path, mmap_mode=mmap_mode)
+    return matrix.nodes, matrix
+
+
+def warn_if_stale(matrix, graphml_path):
+    """
+    Warns if a compact matrix does not match the graphml it is used with.
+    """
+    if isinstance(matrix, CompactDistanceMatrix) and os.path.exists(graphml_path) and matrix.is_stale(graphml_path):
+        warnings.warn(f"{matrix.path} was not generated from {graphml_path}, regenerate it")
@@ -0,0 +1,232 @@
+import math
+import os
+import threading
+import time
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+import numpy as np
+
+from res import ResultsSummary, RunningStats
+
+
+def replication_seeds(base_seed=None):
+    """
+    Endless stream of independent replication seeds spawned from one SeedSequence.
+    The same base_seed always gives the same sequence of replications.
+    """
+    root = np.random.SeedSequence(base_seed)
+    while True:
+        yield from root.spawn(64)
+
+
+def as_int_seed(seed) -> int:
+    """
+    Turns a SeedSequence (or int) into a 32-bit int for `random.seed` / `np.random.seed`.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return int(seed.generate_state(1)[0])
+    return seed
+
+
+class SequentialEstimate:
+    """
+    Between-replication estimate of one output: each replication contributes its own mean,
+    so the confidence interval is valid even though deliveries within a day are correlated.
+    """
+
+    def __init__(self, name, alpha=0.05):
+        self.name = name
+        self.alpha = alpha
+        self.replication_means = RunningStats()
+
+    def add(self, value):
+        if not math.isnan(value):
+            self.replication_means.add(value)
+
+    @property
+    def mean(self):
+        return self.replication_means.mean
+
+    def confint(self):
+        return self.replication_means.confint(self.alpha)
+
+    def relative_half_width(self):
+        low, high = self.confint()
+        if math.isnan(low) or self.mean == 0:
+            return math.inf
+        return (high - low) / 2 / abs(self.mean)
+
+
+def run_adaptive(simulate, base_seed=None, target_rel_half_width=0.05, alpha=0.05, min_replications=5,
+                 max_replications=200, time_budget=None, chunk_size=None, processes=None, keep_results=False, verbose=True,
+                 pool=None):
+    """
+    Runs replications of `simulate(seed)` until the confidence intervals of the mean delay
+    and mean parcels per dispatch are narrow enough, or a budget runs out.
+    Seeds are SeedSequence children of base_seed. Replications are streamed through
+    imap_unordered with at most chunk_size of them in flight (default: one per process);
+    after every finished replication the CIs are updated and the run stops once, for both
+    outputs, the CI half-width is at most target_rel_half_width times the mean (and at
+    least min_replications ran), or max_replications / time_budget (seconds) is reached.
+    No new replications are submitted after that; the ones still running are waited for
+    and discarded, so the count and stop_reason are exact.
+    simulate must return a ResultsSummary or a Results (whose summary is used).
+    pool: a running workerpool.WorkerPool (or multiprocessing Pool) to use instead of a new one.
+    Returns: (combined ResultsSummary, info dict with the estimates and stopping reason,
+              list of raw results if keep_results).
+    """
+    estimates = {"delay": SequentialEstimate("delay", alpha), "parcels_per_dispatch": SequentialEstimate("parcels_per_dispatch", alpha)}
+    total = ResultsSummary()
+    total.num_replications = 0
+    results = []
+    seeds = replication_seeds(base_seed)
+    start_time = time.perf_counter()
+    stop_reason = "max_replications"
+
+    def precise_enough():
+        return total.num_replications >= min_replications and all(
+            e.relative_half_width() <= target_rel_half_width for e in estimates.values()
+        )
+
+    chunk_size = chunk_size or processes or getattr(pool, "processes", None) or os.cpu_count()
+    in_flight = threading.Semaphore(chunk_size)
+    stopped = threading.Event()
+
+    def submitted_seeds():
+        # Runs in the pool's task feeder thread: blocks until a replication has finished
+        for _ in range(max_replications):
+            in_flight.acquire()
+            if stopped.is_set():
+                return
+            yield next(seeds)
+
+    with nullcontext(pool) if pool is not None else Pool(processes) as pool:
+        try:
+            for result in pool.imap_unordered(simulate, submitted_seeds()):
+                in_flight.release()
+                if stopped.is_set():
+                    continue # Already running when the run stopped
+                summary = getattr(result, "summary", result)
+                total.merge(summary)
+                estimates["delay"].add(summary.delay.stats.mean if summary.delay.stats.n else math.nan)
+                estimates["parcels_per_dispatch"].add(summary.parcels_per_dispatch.stats.mean if summary.parcels_per_dispatch.stats.n else math.nan)
+                if keep_results:
+                    results.append(result)
+                if verbose:
+                    print(f"Replication {total.num_replications}: " + ", ".join(
+                        f"{e.name} {e.mean:.2f} (±{e.relative_half_width():.1%})" for e in estimates.values()))
+                if precise_enough():
+                    stop_reason = "precision"
+                elif time_budget is not None and time.perf_counter() - start_time > time_budget:
+                    stop_reason = "time_budget"
+                else:
+                    continue
+                stopped.set()
+                in_flight.release() # Lets the feeder see the stop instead of waiting for a slot
+        finally:
+            # Also on an error from a worker: the feeder thread must not stay blocked, or closing the pool hangs
+            stopped.set()
+            in_flight.release()
+
+    info = {
+        "replications": total.num_replications,
+        "stop_reason": stop_reason,
+        "elapsed": time.perf_counter() - start_time,
+        "estimates": {name: {"mean": e.mean, "confint": e.confint(), "relative_half_width": e.relative_half_width()} for name, e in estimates.items()},
+    }
+    return total, info, results
+
+
+def _replication_means(summary):
+    summary = getattr(summary, "summary", summary)
+    return {
+        "delay": summary.delay.stats.mean if summary.delay.stats.n else math.nan,
+        "parcels_per_dispatch": summary.parcels_per_dispatch.stats.mean if summary.parcels_per_dispatch.stats.n else math.nan,
+    }
+
+
+def _run_compare_cell(cell):
+    simulate, params, seed, antithetic = cell
+    if antithetic is not None:
+        params = dict(params, antithetic=antithetic)
+    return _replication_means(simulate(seed, **params))
+
+
+def compare_scenarios(simulate, params_a: dict, params_b: dict, replications=20, base_seed=None, crn=True, antithetic=False,
+                      alpha=0.05, processes=None, pool=None):
+    """
+    Estimates the difference (b - a) of the mean delay and mean parcels per dispatch
+    between two scenarios of simulate(seed, **params), e.g. main.simulation_summary.
+    crn: both scenarios use the same replication seeds (common random numbers), so the
+         per-replication differences have a much smaller variance. Otherwise scenario b
+         gets its own independent seeds.
+    antithetic: every replication is an antithetic pair (simulate is called with
+         antithetic=False and antithetic=True, the pair average is one observation).
+    pool: a running workerpool.WorkerPool (or multiprocessing Pool) to use instead of a new one.
+    Returns: {output: {"mean", "confint", "std", "replications"}} of the paired differences.
+    """
+    seeds = replication_seeds(base_seed)
+    seeds_a = [next(seeds) for _ in range(replications)]
+    seeds_b = seeds_a if crn else [next(seeds) for _ in range(replications)]
+    halves = (False, True) if antithetic else (None,)
+
+    cells = [(simulate, params, seed, half)
+             for params, scenario_seeds in ((params_a, seeds_a), (params_b, seeds_b))
+             for seed in scenario_seeds for half in halves]
+    with nullcontext(pool) if pool is not None else Pool(processes) as pool:
+        means = pool.map(_run_compare_cell, cells)
+
+    # means is ordered scenario a then b, replication by replication, halves innermost
+    differences = {}
+    for name in ("delay", "parcels_per_dispatch"):
+        values = np.array([m[name] for m in means]).reshape(2, replications, len(halves)).mean(axis=2)
+        diff = RunningStats()
+        paired = values[1] - values[0]
+        diff.add_many(paired[~np.isnan(paired)]) # Replications without deliveries have no mean
+        differences[name] = {"mean": diff.mean, "confint": diff.confint(alpha), "std": diff.std, "replications": diff.n}
+    return differences
+
+
+def _run_branch(task):
+    branch, checkpoint, overrides = task
+    return branch(checkpoint, **overrides)
+
+
+def run_branches(branch, checkpoints, variants: dict, processes=None, pool=None) -> dict:
+    """
+    What-if analysis from checkpoints (simulation.run_replication(checkpoint_at=...), one
+    per replication): every variant (name -> parameter overrides, e.g. {"two more bikes":
+    {"available_bikes": 9}}) continues every checkpoint with branch(checkpoint, **overrides),
+    e.g. main.simulation_branch. The prefix up to the checkpoint is simulated once per
+    replication instead of once per variant, and all branches run in parallel.
+    pool: a running workerpool.WorkerPool (or multiprocessing Pool) to use instead of a new one.
+    Returns: {variant name: [result of every checkpoint, in order]}.
+    """
+    names = list(variants)
+    tasks = [(branch, checkpoint, variants[name]) for name in names for checkpoint in checkpoints]
+    with nullcontext(pool) if pool is not None else Pool(processes) as pool:
+        results = pool.map(_run_branch, tasks)
+    return {name: results[i * len(checkpoints):(i + 1) * len(checkpoints)] for i, name in enumerate(names)}
+
+
+def mser(series, batch_size=5) -> int:
+    """
+    MSER-m warm-up detection (MSER-5 by default) on a series of observations, e.g. the mean
+    delay per simulated day. The series is averaged in batches of batch_size, then the
+    truncation point d minimizing sum((Y_i - mean(Y_d..))^2) / (n - d)^2 over the batch
+    means is chosen, searching only the first half so the estimate keeps enough data.
+    Returns the number of observations to discard (a multiple of batch_size).
+    """
+    values = np.asarray(series, dtype=np.float64)
+    n = len(values) // batch_size
+    if n < 2:
+        return 0
+    batches = values[:n * batch_size].reshape(n, batch_size).mean(axis=1)
+    best_d, best = 0, math.inf
+    for d in range(n // 2 + 1):
+        tail = batches[d:]
+        statistic = ((tail - tail.mean()) ** 2).sum() / len(tail) ** 2
+        if statistic < best:
+            best_d, best = d, statistic
+    return best_d * batch_size
@@ -1,71 +1,120 @@
+import heapq
+import itertools
+
 import simpy
 import numpy as np
 import networkx as nx
 from datetime import timedelta
 import random
 
-from parcel import Parcel
-from cargobike import CargoBike
+from parcel import Parcel, ParcelBatch
+from cargobike import CargoBike, TripState
 from res import Results
+from slotqueue import SlotQueue
+from knn import NeighbourIndex
+from streams import RandomStreams
+from kmedoids import kmedoids
+from nodeindex import NodeIndex
+import kernel
+import instrumentation
 
 LOGGING = False
 
 class LogisticsHub:
-    def __init__(self, env, hub_id, location_node, city_network: nx.DiGraph, serviced_nodes: np.ndarray, distance_matrix: np.ndarray, results: Results):
+    def __init__(self, env, hub_id, location_node, city_network: nx.DiGraph, serviced_nodes: np.ndarray, distance_matrix: np.ndarray, results: Results,
+                 clustering_method="alternate", clustering_init="random", clustering_seed=None,
+                 node_index: NodeIndex = None, rng: np.random.Generator = None, speed_model=None,
+                 horizon_days=1, available_bikes=7, vehicle_pool_capacity=5, charging_stations=2,
+                 streams: RandomStreams = None, dispatch_mode="polling", fast_forward=False, neighbours: NeighbourIndex = None):
         self.env = env
         self.id = hub_id
         self.location = location_node
         self.city_network = city_network
         self.serviced_nodes = serviced_nodes
         self.distance_matrix = distance_matrix
-        self.parcel_queue = {str(timedelta(hours=float(key))): [] for key in np.arange(9, 19, 0.5)}
-        self.vehicle_pool = simpy.Resource(env, capacity=5)
+        # Resources of whichever engine runs the simulation (SimPy or kernel.Environment)
+        Resource = kernel.Resource if isinstance(env, kernel.Environment) else simpy.Resource
+        self.vehicle_pool = Resource(env, capacity=vehicle_pool_capacity)
         self.starting_time = 9 # 9 AM
         self.closing_time = 19 # 7 PM
-        self.available_bikes = 7
-        self.bikes_resource = simpy.Resource(self.env, capacity=self.available_bikes)
+        self.horizon_days = horizon_days # Number of days the hub dispatches bikes
+        self.parcel_queue = SlotQueue(self.starting_time * 60, self.closing_time * 60, slot_minutes=30)
+        self.available_bikes = available_bikes
+        self.bikes_resource = Resource(self.env, capacity=self.available_bikes)
         self.batteries = [Battery() for _ in range(5)]
-        self.charging_stations = simpy.Resource(self.env, capacity=2)
-        self.env.process(self.monitor_parcels())
+        self.charging_stations = Resource(self.env, capacity=charging_stations)
+
+        # "polling": cluster and dispatch every slot at its start (bikes are not held during trips)
+        # "event": bikes are held until they return, see dispatch_events
+        self.dispatch_mode = dispatch_mode
+        self.fast_forward = fast_forward # Bikes compute their whole trip at dispatch, see CargoBike.deliver_fast_forward
+        self.idle_bikes = self.available_bikes
+        self.ready_bulks = [] # Heap of (earliest window, sequence number, ReadyBulk) waiting for a bike
+        self.trips = {} # Trip process -> CargoBike of every bike that is out, see checkpoint.py
+        self._bulk_sequence = itertools.count()
+        self.clustering_calls = 0
+        if dispatch_mode == "polling":
+            self.env.process(self.monitor_parcels())
+        elif dispatch_mode == "event":
+            self.env.process(self.dispatch_events())
+        else:
+            raise ValueError(f"Unknown dispatch mode: {dispatch_mode}")
         # self.serviced_nodes = self._get_reachable_nodes()
         self.dummy_hub_parcel = Parcel(destination=self.location, delivery_window=timedelta(hours=0))  # Dummy parcel for bulk delivery
-        self.timeslots = [timedelta(hours=float(key)) for key in np.arange(9, 19, 0.5)] + [timedelta(days=1, hours=float(key)) for key in np.arange(9, 19, 0.5)]
 
-        self._node_id_to_matrix_idx = {node_id: i for i, node_id in enumerate(self.serviced_nodes)}
+        self.node_index = node_index if node_index is not None else NodeIndex(serviced_nodes)
+        # Per-purpose random streams of this replication; a single rng is shared by all purposes
+        if streams is None:
+            streams = RandomStreams.single(rng if rng is not None else np.random.default_rng())
+            self.clustering_stream = None # Initial medoids from the global random state, as before
+        else:
+            self.clustering_stream = streams["clustering"]
+        self.streams = streams
+        self.speed_model = speed_model # None means bikes ride at their max speed all day
 
         self.results = results
 
+        # K-medoids backend settings, see kmedoids.kmedoids
+        self.clustering_method = clustering_method
+        self.clustering_init = clustering_init
+        self.clustering_seed = clustering_seed
+        # Nearest nodes of every serviced node, for clustering_method="knn" and large tours
+        self.neighbours = neighbours
+
     # def _get_reachable_nodes(self):
     #     travel_times = nx.single_source_dijkstra_path_length(self.city_network, self.location, cutoff=900, weight='travel_time')
     #     return list(travel_times.keys())
 
     def add_parcels(self, n):
-        for _ in range(n):
-            delivery_window = self.choose_delivery_window()
-            destination = random.choice(self.serviced_nodes)
-            parcel = Parcel(destination=destination, delivery_window=delivery_window)
-            if str(parcel.delivery_window) not in self.parcel_queue:
-                self.parcel_queue[str(parcel.delivery_window)] = []
-            self.parcel_queue[str(parcel.delivery_window)].append(parcel)
+        """
+        Creates a truckload of n parcels in one vectorized batch and queues them by delivery slot.
+        """
+        if n <= 0:
+            return # Sampled truckloads can be negative
+        with instrumentation.phase("parcel generation"):
+            windows = self.parcel_queue.slot_start(self.parcel_queue.available_slots(self.env.now))
+            batch = ParcelBatch.generate(n, self.serviced_nodes, windows, self.streams["destinations"], arrival_minutes=self.env.now,
+                                         window_rng=self.streams["windows"], weight_rng=self.streams["weights"])
+            self.parcel_queue.push_batch(self.parcel_queue.slot_of(batch.window_minutes), batch)
 
     def choose_delivery_window(self):
         choices = self.available_timeslots(self.env.now)
-        return random.choice(choices)
+        return choices[int(self.streams["windows"].integers(len(choices)))]
 
     def available_timeslots(self, current_time):
-        i = 0
-        while True:
-            if current_time < 9 * 60 + i * 30:
-                return self.timeslots[i:]  # Return all slots from the first available one
-            i+=1
+        """
+        Returns the start of every slot that can still be booked at current_time.
+        """
+        slots = self.parcel_queue.available_slots(current_time)
+        return [timedelta(minutes=int(start)) for start in self.parcel_queue.slot_start(slots)]
 
     def monitor_parcels(self):
-        yield self.env.timeout(self.starting_time * 60) # Wait until 9 AM
-        while True:
-            if self.env.now >= self.closing_time * 60:
-                break
-            parcels = self.parcel_queue[str(timedelta(minutes=self.env.now))].copy()
-            self.parcel_queue[str(timedelta(minutes=self.env.now))] = []
+        slots_per_day = self.parcel_queue.slots_per_day
+        # From the queue's head: 0, or the first slot not dispatched before a checkpoint
+        for slot in range(self.parcel_queue.head, self.horizon_days * slots_per_day):
+            # Wait until the slot starts (9 AM for the first slot of a day)
+            yield self.env.timeout(max(0, self.parcel_queue.slot_start(slot) - self.env.now))
+            parcels = self.parcel_queue.pop(slot)
             # print(len(parcels))
             available_bikes = self.available_bikes - self.bikes_resource.count # Count active bikes
             bulks = self.bulk_parcels(parcels, available_bikes)
@@ -75,19 +124,169 @@ class LogisticsHub:
                 if bulk:
                     with self.bikes_resource.request() as req:
                         yield req
-                        if LOGGING:
-                            print(f"Hub {self.id}: Dispatching bike with {len(bulk)} parcels at {self.env.now:.2f} minutes.")
-                        CargoBike(self.env, self.location, bulk, self.city_network, self.serviced_nodes, self.distance_matrix, self.results)
-                        self.results.register_dispatch(self.env.now, len(bulk))
+                        self._dispatch_bike(bulk)
 
                 # self.available_bikes -= 1
                 # self.available_bikes += 1
 
-            yield self.env.timeout(30) # Check every 30 minutes
+    def dispatch_events(self):
+        """
+        Event-driven dispatch: slot starts make parcels due, a free bike takes the most
+        urgent ready bulk right away and a returning bike takes the next one.
+        Due parcels are only clustered when no bulks are waiting; while all bikes are out
+        they join the waiting bulk with the closest medoid instead, so the bulks that
+        already exist are never clustered again.
+        """
+        slots_per_day = self.parcel_queue.slots_per_day
+        for slot in range(self.parcel_queue.head, self.horizon_days * slots_per_day):
+            yield self.env.timeout(max(0, self.parcel_queue.slot_start(slot) - self.env.now))
+            parcels = self.parcel_queue.pop(slot)
+            if parcels:
+                self._add_due_parcels(parcels)
+                self._dispatch_ready()
+
+    def backlog(self) -> int:
+        """
+        Parcels at the hub that no bike has taken yet: booked into later slots (e.g. the
+        next day) or, in event mode, waiting in a ready bulk for a free bike.
+        """
+        return self.parcel_queue.pending() + sum(len(bulk.parcels) for _, _, bulk in self.ready_bulks)
+
+    def _add_due_parcels(self, parcels: list[Parcel]):
+        dest_idx = self.node_index.parcel_indices(parcels)
+        unique_dest_idx, parcel_to_dest = np.unique(dest_idx, return_inverse=True)
+        if self.ready_bulks:
+            # Only the new destinations are assigned, to the nearest waiting medoid
+            waiting = [bulk for _, _, bulk in self.ready_bulks]
+            medoids = np.array([bulk.medoid for bulk in waiting], dtype=np.intp)
+            if self.neighbours is None:
+                labels = np.asarray(self.distance_matrix[np.ix_(unique_dest_idx, medoids)]).argmin(axis=1)
+            else:
+                # Only destinations without a waiting medoid among their nearest nodes read matrix rows
+                labels = self.neighbours.nearest_in(unique_dest_idx, medoids)
+                rest = np.flatnonzero(labels < 0)
+                if rest.size:
+                    labels[rest] = np.asarray(self.distance_matrix[np.ix_(unique_dest_idx[rest], medoids)]).argmin(axis=1)
+            for parcel, label in zip(parcels, labels[parcel_to_dest].tolist()):
+                waiting[label].parcels.append(parcel)
+            return
+
+        num_clusters = min(self.available_bikes, len(unique_dest_idx))
+        instrumentation.record("parcels per cluster call", len(parcels))
+        labels, medoids = self._kmedoids(unique_dest_idx, num_clusters)
+        bulks = [ReadyBulk(unique_dest_idx[m]) for m in medoids.tolist()]
+        for parcel, label in zip(parcels, labels[parcel_to_dest].tolist()):
+            bulks[label].parcels.append(parcel)
+        for bulk in bulks:
+            if bulk.parcels:
+                earliest = min(p.window_minutes for p in bulk.parcels)
+                heapq.heappush(self.ready_bulks, (earliest, next(self._bulk_sequence), bulk))
+
+    def _dispatch_ready(self):
+        while self.idle_bikes > 0 and self.ready_bulks:
+            _, _, bulk = heapq.heappop(self.ready_bulks)
+            self.idle_bikes -= 1
+            bike = self._dispatch_bike(bulk.parcels)
+            bike.trip.callbacks.append(self._bike_returned)
+
+    def _bike_returned(self, _event):
+        self.idle_bikes += 1
+        self._dispatch_ready()
+
+    def _dispatch_bike(self, bulk: list[Parcel]) -> CargoBike:
+        if LOGGING:
+            print(f"Hub {self.id}: Dispatching bike with {len(bulk)} parcels at {self.env.now:.2f} minutes.")
+        bike = self._start_bike(bulk)
+        self.results.register_dispatch(self.env.now, len(bulk))
+        return bike
+
+    def _start_bike(self, bulk: list[Parcel], trip_state: TripState = None) -> CargoBike:
+        bike = CargoBike(self.env, self.location, bulk, self.city_network, self.serviced_nodes, self.distance_matrix, self.results,
+                         node_index=self.node_index, rng=self.streams["travel"], speed_model=self.speed_model,
+                         fast_forward=self.fast_forward, neighbours=self.neighbours, trip_state=trip_state)
+        self.trips[bike.trip] = bike
+        bike.trip.callbacks.append(self._trip_ended)
+        return bike
+
+    def _trip_ended(self, trip):
+        del self.trips[trip]
+
+    def in_flight(self) -> list[TripState]:
+        """
+        The trips of the bikes that are out, see CargoBike.state.
+        """
+        return [bike.state for bike in self.trips.values()]
+
+    def restore(self, parcel_queue: SlotQueue, trips: list[TripState], ready_bulks=(), clustering_calls=0):
+        """
+        Continues from a checkpoint (see checkpoint.py): the queued parcels, the bikes that
+        were out (each resumes the leg it was riding) and, in event mode, the bulks waiting
+        for a bike. Call right after construction, before the environment runs; the hub's
+        available_bikes may differ from the checkpointed run, but not be less than len(trips).
+        """
+        self.parcel_queue = parcel_queue
+        self.clustering_calls = clustering_calls
+        self.ready_bulks = list(ready_bulks)
+        heapq.heapify(self.ready_bulks)
+        self._bulk_sequence = itertools.count(max((sequence for _, sequence, _ in self.ready_bulks), default=-1) + 1)
+        for trip in trips:
+            bike = self._start_bike([parcel for parcels in trip.stop_parcels for parcel in parcels], trip)
+            if self.dispatch_mode == "event":
+                bike.trip.callbacks.append(self._bike_returned)
+        self.idle_bikes = self.available_bikes - len(trips)
+        if self.dispatch_mode == "event":
+            self._dispatch_ready() # Bikes added by the branch take waiting bulks right away
+
+    def _kmedoids(self, matrix_idx: np.ndarray, num_clusters: int, max_iter=50):
+        """
+        K-medoids of distance-matrix indices with this hub's settings, see _cluster_matrix_indices.
+        Returns: (cluster label of every entry of matrix_idx, medoid positions into matrix_idx).
+        """
+        self.clustering_calls += 1
+        with instrumentation.phase("k-medoids"):
+            labels, medoids, n_iter = kmedoids(
+                self.distance_matrix, matrix_idx, num_clusters,
+                method=self.clustering_method, init=self.clustering_init,
+                seed=self.clustering_seed if self.clustering_seed is not None else self.clustering_stream, max_iter=max_iter,
+                neighbours=self.neighbours,
+            )
+        instrumentation.record("cluster iterations", n_iter)
+        instrumentation.record("destinations per cluster call", len(matrix_idx))
+        return labels, medoids
+
+    def _cluster_matrix_indices(self, matrix_idx: np.ndarray, num_clusters: int, max_iter=50) -> np.ndarray:
+        """
+        K-medoids clustering of distance-matrix indices.
+        The destination submatrix is gathered once and clustered by the numpy engine in
+        kmedoids.py using this hub's clustering_method / clustering_init / clustering_seed
+        (or the clustering stream when no seed is set).
+        Returns: cluster label of every entry of matrix_idx.
+        """
+        return self._kmedoids(matrix_idx, num_clusters, max_iter)[0]
 
     def _cluster_destinations_kmedoids(self, dest_nodes: list, num_clusters: int, max_iter=50) -> list[list[int]]:
         """
-        K-medoids clustering using Lloyd's algorithm with a distance matrix.
+        K-medoids clustering of destination node IDs, see _cluster_matrix_indices.
+        dest_nodes: List of unique destination node IDs to cluster.
+        num_clusters: Target number of clusters.
+        Returns: List of k lists, each containing node IDs for a cluster.
+        """
+        if not dest_nodes or num_clusters <= 0:
+            return [[] for _ in range(num_clusters)]
+
+        num_clusters = min(num_clusters, len(dest_nodes)) # Cannot have more clusters than unique nodes
+        labels = self._cluster_matrix_indices(self.node_index.indices(dest_nodes), num_clusters, max_iter)
+
+        final_cluster_assignments = [[] for _ in range(num_clusters)]
+        for node_id, label in zip(dest_nodes, labels.tolist()):
+            final_cluster_assignments[label].append(node_id)
+        return final_cluster_assignments
+
+    def _cluster_destinations_kmedoids_reference(self, dest_nodes: list, num_clusters: int, max_iter=50) -> list[list[int]]:
+        """
+        Original pure-Python K-medoids (Lloyd's algorithm), kept as a reference to check
+        the numpy engine against: with method="alternate", init="random" and
+        clustering_seed=None both return the same clusters for the same random.seed.
         dest_nodes: List of unique destination node IDs to cluster.
         k: Target number of clusters.
         Returns: List of k lists, each containing node IDs for a cluster.
@@ -102,7 +301,7 @@ class LogisticsHub:
             return [[] for _ in range(num_clusters)]
 
         # Initialize medoids: random sample of unique node IDs
-        # Ensure medoids are part of the dest_nodes that are in _node_id_to_matrix_idx
+        # Ensure medoids are part of the dest_nodes that are in the node index
         medoids = random.sample(dest_nodes, num_clusters)
         if not medoids and num_clusters > 0 : # Fallback if sampling failed (e.g. no nodes in map)
             return [[] for _ in range(num_clusters)]
@@ -115,12 +314,12 @@ class LogisticsHub:
             
             # Assignment step: assign each node to the closest medoid
             for node_id in dest_nodes:
-                node_matrix_idx = self._node_id_to_matrix_idx[node_id]
+                node_matrix_idx = self.node_index.lookup[node_id]
                 min_sq_dist = float('inf')
                 closest_medoid_cluster_idx = 0 # Default assignment
                 
                 for i, medoid_node_id in enumerate(medoids):
-                    medoid_matrix_idx = self._node_id_to_matrix_idx[medoid_node_id]
+                    medoid_matrix_idx = self.node_index.lookup[medoid_node_id]
                     dist = self.distance_matrix[node_matrix_idx, medoid_matrix_idx]
                     sq_dist = dist * dist 
                     
@@ -145,11 +344,11 @@ class LogisticsHub:
                 best_new_medoid_for_cluster = nodes_in_cluster_i[0] # Default
                 
                 for potential_medoid_node_id in nodes_in_cluster_i:
-                    # potential_medoid_node_id must be in _node_id_to_matrix_idx as it came from dest_nodes
-                    potential_medoid_matrix_idx = self._node_id_to_matrix_idx[potential_medoid_node_id]
+                    # potential_medoid_node_id must be in the node index as it came from dest_nodes
+                    potential_medoid_matrix_idx = self.node_index.lookup[potential_medoid_node_id]
                     current_sum_sq_dist = 0
                     for member_node_id in nodes_in_cluster_i:
-                        member_matrix_idx = self._node_id_to_matrix_idx[member_node_id]
+                        member_matrix_idx = self.node_index.lookup[member_node_id]
                         dist = self.distance_matrix[member_matrix_idx, potential_medoid_matrix_idx]
                         current_sum_sq_dist += (dist * dist)
                     
@@ -179,41 +378,38 @@ class LogisticsHub:
         if not parcels:
             return [[] for _ in range(available_bikes)]
 
-        dest_node_ids_to_cluster = set([p.destination for p in parcels])  # Unique destination node IDs
-        
-        if not dest_node_ids_to_cluster:
-            return [[] for _ in range(available_bikes)]
-
-        # 2. Perform K-medoids clustering on the unique destination node IDs
-        # This helper returns list of lists of node IDs
-        clustered_node_id_groups = self._cluster_destinations_kmedoids(
-            list(dest_node_ids_to_cluster), 
-            min(available_bikes, len(dest_node_ids_to_cluster)) # Use the calculated target
-        ) # max_iter default is 50
-
-        # 3. Map clustered node IDs back to Parcel objects
-        parcels_by_dest_map = {} # Quick lookup: dest_id -> list of parcels
-        for p in parcels:
-            parcels_by_dest_map.setdefault(p.destination, []).append(p)
+        # Parcels carry their matrix index, so no node ID translation is needed here
+        dest_idx = self.node_index.parcel_indices(parcels)
+        unique_dest_idx, parcel_to_dest = np.unique(dest_idx, return_inverse=True)
 
+        num_clusters = min(available_bikes, len(unique_dest_idx))
         # Initialize for all available bikes, some might remain empty
-        final_parcel_clusters = [[] for _ in range(self.available_bikes)] 
-
-        for i, node_id_group in enumerate(clustered_node_id_groups):
-            # clustered_node_id_groups has num_clusters_target lists.
-            # Populate the first num_clusters_target slots in final_parcel_clusters.
-            if i < self.available_bikes: # Ensure we don't exceed bike list (shouldn't due to num_clusters_target)
-                for node_id in node_id_group:
-                    if node_id in parcels_by_dest_map:
-                        final_parcel_clusters[i].extend(parcels_by_dest_map[node_id])
-            else: # Should not be reached if num_clusters_target <= self.available_bikes
-                break
+        final_parcel_clusters = [[] for _ in range(self.available_bikes)]
+        if num_clusters <= 0:
+            return final_parcel_clusters
+
+        # Cluster the unique destinations, then give every parcel its destination's label
+        instrumentation.record("parcels per cluster call", len(parcels))
+        labels = self._cluster_matrix_indices(unique_dest_idx, num_clusters)
+        for parcel, label in zip(parcels, labels[parcel_to_dest].tolist()):
+            final_parcel_clusters[label].append(parcel)
         
         if LOGGING:
             print(f"Hub {self.id}: Clustered {len(parcels)} parcels into {len(final_parcel_clusters)} bulks (bikes). Sizes: {[len(b) for b in final_parcel_clusters]}")
         return final_parcel_clusters
 
 
+class ReadyBulk:
+    """
+    Parcels clustered around one medoid (matrix index), waiting for a bike.
+    """
+    __slots__ = ("medoid", "parcels")
+
+    def __init__(self, medoid):
+        self.medoid = medoid
+        self.parcels = []
+
+
 class Battery:
     def __init__(self):
         self.charge = 100  # Battery starts fully charged
@@ -0,0 +1,172 @@
+import cProfile
+import json
+import math
+import os
+import time
+from contextlib import nullcontext
+
+import simpy
+
+# Off by default: phase() then returns a shared no-op context and record() returns at once
+ENABLED = False
+
+_NO_OP = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        timer = _timers.get(self.name)
+        if timer is None:
+            timer = _timers[self.name] = [0.0, 0]
+        timer[0] += time.perf_counter() - self.start
+        timer[1] += 1
+
+
+_timers = {} # phase -> [seconds, calls]
+_counters = {} # counter -> [n, sum, min, max]
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+
+
+def phase(name):
+    """
+    Times a block: `with instrumentation.phase("tsp"): ...`. Nested phases are
+    counted in both, e.g. "event loop" includes everything the simulation does.
+    """
+    return _Phase(name) if ENABLED else _NO_OP
+
+
+def record(name, value):
+    """
+    Adds one observation to a counter, e.g. record("tsp size", 42).
+    """
+    if not ENABLED:
+        return
+    counter = _counters.get(name)
+    if counter is None:
+        _counters[name] = [1, value, value, value]
+    else:
+        counter[0] += 1
+        counter[1] += value
+        counter[2] = min(counter[2], value)
+        counter[3] = max(counter[3], value)
+
+
+def report() -> dict:
+    """
+    JSON-serializable snapshot of the timers and counters of this process.
+    """
+    return {
+        "replications": 1,
+        "phases": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in _timers.items()},
+        "counters": {name: {"n": n, "sum": total, "min": low, "max": high} for name, (n, total, low, high) in _counters.items()},
+    }
+
+
+def merge_reports(a: dict, b: dict) -> dict:
+    """
+    Combines two reports (e.g. from different replications or pool workers) into a new one.
+    """
+    if a is None or b is None:
+        return a if b is None else b
+    merged = {"replications": a["replications"] + b["replications"], "phases": {}, "counters": {}}
+    for name in a["phases"].keys() | b["phases"].keys():
+        x = a["phases"].get(name, {"seconds": 0.0, "calls": 0})
+        y = b["phases"].get(name, {"seconds": 0.0, "calls": 0})
+        merged["phases"][name] = {"seconds": x["seconds"] + y["seconds"], "calls": x["calls"] + y["calls"]}
+    for name in a["counters"].keys() | b["counters"].keys():
+        x = a["counters"].get(name, {"n": 0, "sum": 0, "min": math.inf, "max": -math.inf})
+        y = b["counters"].get(name, {"n": 0, "sum": 0, "min": math.inf, "max": -math.inf})
+        merged["counters"][name] = {"n": x["n"] + y["n"], "sum": x["sum"] + y["sum"],
+                                    "min": min(x["min"], y["min"]), "max": max(x["max"], y["max"])}
+    return merged
+
+
+def write_json(path, aggregated: dict):
+    """
+    Writes a (merged) report with per-replication averages and per-call means added.
+    """
+    replications = max(aggregated["replications"], 1)
+    output = {
+        "replications": aggregated["replications"],
+        "phases": {
+            name: dict(timer, seconds_per_replication=timer["seconds"] / replications,
+                       seconds_per_call=timer["seconds"] / timer["calls"] if timer["calls"] else 0.0)
+            for name, timer in sorted(aggregated["phases"].items())
+        },
+        "counters": {
+            name: dict(counter, mean=counter["sum"] / counter["n"] if counter["n"] else math.nan,
+                       per_replication=counter["sum"] / replications)
+            for name, counter in sorted(aggregated["counters"].items())
+        },
+    }
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+
+
+class WorkerProfiler:
+    """
+    cProfile of everything one process runs inside `with profiler:` blocks, dumped to
+    <directory>/worker-<pid>.prof after every block so the file is complete even when
+    the pool is torn down. Open the dumps with pstats or snakeviz.
+    """
+
+    def __init__(self, directory="profiles"):
+        self.directory = directory
+        self.profile = None
+
+    def __enter__(self):
+        if self.profile is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self.profile.dump_stats(os.path.join(self.directory, f"worker-{os.getpid()}.prof"))
+
+
+_profilers = {}
+
+
+def worker_profiler(directory):
+    """
+    This process's WorkerProfiler for the directory, or a no-op context if directory is None.
+    """
+    if directory is None:
+        return _NO_OP
+    if directory not in _profilers:
+        _profilers[directory] = WorkerProfiler(directory)
+    return _profilers[directory]
+
+
+class CountingSimpyEnvironment(simpy.Environment):
+    """
+    simpy.Environment that counts processed events like kernel.Environment does.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events_processed = 0
+
+    def step(self):
+        self.events_processed += 1
+        super().step()
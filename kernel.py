@@ -0,0 +1,192 @@
+import itertools
+from collections import deque
+from heapq import heappop, heappush
+
+# Same priorities as SimPy: process starts go before other events at the same time
+URGENT = 0
+NORMAL = 1
+
+
+class Event:
+    """
+    Event record. callbacks is None once the event has been processed.
+    """
+    __slots__ = ("env", "callbacks", "value", "triggered")
+
+    def __init__(self, env):
+        self.env = env
+        self.callbacks = []
+        self.value = None
+        self.triggered = False
+
+    @property
+    def processed(self):
+        return self.callbacks is None
+
+    def succeed(self, value=None):
+        if self.triggered:
+            raise RuntimeError(f"{self} has already been triggered")
+        self.triggered = True
+        self.value = value
+        self.env.schedule(self)
+        return self
+
+
+class Timeout(Event):
+    __slots__ = ()
+
+    def __init__(self, env, delay, value=None):
+        if delay < 0:
+            raise ValueError(f"Negative delay {delay}")
+        self.env = env
+        self.callbacks = []
+        self.value = value
+        self.triggered = True
+        heappush(env._queue, (env.now + delay, NORMAL, next(env._keys), self)) # env.schedule inlined
+
+
+class Process(Event):
+    """
+    Runs a generator that yields events; the process itself is an event that is
+    triggered with the generator's return value when it finishes.
+    """
+    __slots__ = ("generator", "target", "resume")
+
+    def __init__(self, env, generator):
+        super().__init__(env)
+        self.generator = generator
+        self.target = None # Event the process is waiting for
+        self.resume = self._resume # Bound once instead of on every yield
+        start = Event(env)
+        start.triggered = True
+        start.callbacks.append(self.resume)
+        env.schedule(start, URGENT)
+
+    def _resume(self, event):
+        value = event.value
+        send = self.generator.send
+        while True:
+            try:
+                event = send(value)
+            except StopIteration as stop:
+                self.target = None
+                self.triggered = True
+                self.value = stop.value
+                self.env.schedule(self)
+                return
+            if event.callbacks is not None:
+                event.callbacks.append(self.resume)
+                self.target = event
+                return
+            value = event.value # Already processed, continue right away
+
+
+class Request(Event):
+    """
+    Resource request, use as `with resource.request() as req: yield req`.
+    """
+    __slots__ = ("resource",)
+
+    def __init__(self, resource):
+        super().__init__(resource.env)
+        self.resource = resource
+        if len(resource.users) < resource.capacity:
+            resource.users.append(self)
+            self.succeed()
+        else:
+            resource.queue.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.resource.release(self)
+
+
+class Resource:
+    """
+    FIFO resource with a fixed capacity, like simpy.Resource.
+    """
+
+    def __init__(self, env, capacity=1):
+        if capacity <= 0:
+            raise ValueError("Capacity must be positive")
+        self.env = env
+        self.capacity = capacity
+        self.users = []
+        self.queue = deque()
+
+    @property
+    def count(self):
+        return len(self.users)
+
+    def request(self) -> Request:
+        return Request(self)
+
+    def release(self, request: Request):
+        if request in self.users:
+            self.users.remove(request)
+        elif request in self.queue:
+            self.queue.remove(request) # Left the `with` block before it was granted
+        while self.queue and len(self.users) < self.capacity:
+            granted = self.queue.popleft()
+            self.users.append(granted)
+            granted.succeed()
+
+
+class Environment:
+    """
+    Minimal discrete-event engine covering what the hub, bikes and arrival process
+    use from simpy.Environment: now, timeout, process, event, run(until) and Resource.
+    The queue is a heap of (time, priority, insertion key, event), so events at the
+    same time are processed in the same order as in SimPy.
+    """
+
+    def __init__(self, initial_time=0.0):
+        self.now = initial_time
+        self.events_processed = 0
+        self._queue = []
+        self._keys = itertools.count()
+
+    def schedule(self, event, priority=NORMAL, delay=0.0):
+        heappush(self._queue, (self.now + delay, priority, next(self._keys), event))
+
+    def timeout(self, delay, value=None) -> Timeout:
+        return Timeout(self, delay, value)
+
+    def process(self, generator) -> Process:
+        return Process(self, generator)
+
+    def event(self) -> Event:
+        return Event(self)
+
+    def peek(self):
+        return self._queue[0][0] if self._queue else float("inf")
+
+    def step(self):
+        self.now, _, _, event = heappop(self._queue)
+        callbacks, event.callbacks = event.callbacks, None
+        self.events_processed += 1
+        for callback in callbacks:
+            callback(event)
+
+    def run(self, until=None):
+        """
+        Processes events until none are left, or until the clock would reach `until`
+        (events at exactly `until` are not processed, as in SimPy).
+        """
+        if until is not None and until <= self.now:
+            raise ValueError(f"until ({until}) must be greater than the current simulation time")
+        queue = self._queue
+        processed = 0
+        stop = until if until is not None else float("inf")
+        # step() inlined, this loop is the whole simulation
+        while queue and queue[0][0] < stop:
+            self.now, _, _, event = heappop(queue)
+            callbacks, event.callbacks = event.callbacks, None
+            processed += 1
+            for callback in callbacks:
+                callback(event)
+        self.events_processed += processed
+        if until is not None:
+            self.now = until
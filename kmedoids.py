@@ -0,0 +1,304 @@
+import random
+
+import numpy as np
+
+# Above this many destinations "auto" switches from FasterPAM to CLARA
+CLARA_THRESHOLD = 2500
+
+
+def _as_rng(seed):
+    """
+    Returns a numpy Generator for the given seed, or None if the caller wants the
+    global `random` module to drive initialization (matches the original hub code).
+    """
+    if seed is None:
+        return None
+    if hasattr(seed, "integers"): # A numpy Generator or streams.InverseTransformGenerator
+        return seed
+    return np.random.default_rng(seed)
+
+
+def _dissimilarity(distance_matrix, idx_a, idx_b, squared):
+    """
+    Gathers the (idx_a x idx_b) block of the distance matrix in one fancy-indexed read.
+    Unreachable pairs (inf) are replaced by a large finite value so sums stay finite.
+    """
+    block = np.asarray(distance_matrix[np.ix_(idx_a, idx_b)], dtype=np.float64)
+    if not np.isfinite(block).all():
+        finite = block[np.isfinite(block)]
+        big = (finite.max() if finite.size else 1.0) * 10.0 + 1.0
+        block = np.where(np.isfinite(block), block, big)
+    if squared:
+        block = block * block
+    return block
+
+
+def init_random(D, k, rng=None):
+    """
+    Picks k distinct medoids uniformly at random.
+    With rng=None the global `random` module is used, which reproduces the medoids the
+    original pure-Python implementation picked for the same `random.seed`.
+    """
+    n = D.shape[0]
+    if rng is None:
+        return np.array(random.sample(range(n), k), dtype=np.intp)
+    return rng.choice(n, size=k, replace=False).astype(np.intp)
+
+
+def init_kmedoids_plusplus(D, k, rng=None):
+    """
+    k-medoids++ seeding: the first medoid is uniform, every next one is drawn with
+    probability proportional to its dissimilarity to the closest medoid chosen so far.
+    """
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    n = D.shape[0]
+    medoids = np.empty(k, dtype=np.intp)
+    medoids[0] = rng.integers(n)
+    nearest = D[:, medoids[0]].copy()
+    for i in range(1, k):
+        total = nearest.sum()
+        if total <= 0:
+            # All remaining points coincide with a medoid, fall back to uniform
+            candidates = np.setdiff1d(np.arange(n), medoids[:i])
+            medoids[i] = rng.choice(candidates)
+        else:
+            medoids[i] = rng.choice(n, p=nearest / total)
+        np.minimum(nearest, D[:, medoids[i]], out=nearest)
+    return medoids
+
+
+INITIALIZERS = {
+    "random": init_random,
+    "k-medoids++": init_kmedoids_plusplus,
+}
+
+
+def assign(D, medoids):
+    """
+    Assigns every point to its closest medoid (ties go to the first medoid).
+    Returns (labels, total cost).
+    """
+    to_medoids = D[:, medoids]
+    labels = to_medoids.argmin(axis=1)
+    cost = to_medoids[np.arange(D.shape[0]), labels].sum()
+    return labels, cost
+
+
+def alternate(D, medoids, max_iter=50):
+    """
+    Lloyd-style alternating k-medoids on a dissimilarity matrix.
+    Mirrors the original hub implementation step for step (assignment, then per-cluster
+    medoid update, convergence only checked after the first iteration), so with the
+    same initial medoids it returns the same clusters.
+    """
+    medoids = np.array(medoids, dtype=np.intp)
+    k = len(medoids)
+    labels = np.zeros(D.shape[0], dtype=np.intp)
+    n_iter = 0
+    for iteration in range(max_iter):
+        n_iter = iteration + 1
+        labels = D[:, medoids].argmin(axis=1)
+
+        new_medoids = medoids.copy()
+        for i in range(k):
+            members = np.flatnonzero(labels == i)
+            if members.size == 0:
+                continue  # Empty cluster keeps its old medoid
+            # Column sums: total dissimilarity of the members to each candidate medoid
+            costs = D[np.ix_(members, members)].sum(axis=0)
+            new_medoids[i] = members[costs.argmin()]
+
+        changed = not np.array_equal(new_medoids, medoids)
+        if not changed and iteration > 0:
+            break
+        medoids = new_medoids
+    return labels, medoids, n_iter
+
+
+def _nearest_two(D, medoids):
+    """
+    Returns the index (into medoids) of the nearest medoid and the distances to the
+    nearest and second nearest medoid for every point.
+    """
+    to_medoids = D[:, medoids]
+    rows = np.arange(D.shape[0])
+    if len(medoids) == 1:
+        return np.zeros(D.shape[0], dtype=np.intp), to_medoids[:, 0], np.full(D.shape[0], np.inf)
+    order = np.argpartition(to_medoids, 1, axis=1)[:, :2]
+    n1 = order[:, 0]
+    d1 = to_medoids[rows, n1]
+    d2 = to_medoids[rows, order[:, 1]]
+    # argpartition does not promise the smallest one comes first
+    swap = d2 < d1
+    n1 = np.where(swap, order[:, 1], n1)
+    d1, d2 = np.where(swap, d2, d1), np.where(swap, d1, d2)
+    return n1, d1, d2
+
+
+def fasterpam(D, medoids, max_iter=50):
+    """
+    FasterPAM (Schubert & Rousseeuw, 2021): eager best-swap search where every
+    non-medoid is tried once per pass and the first improving swap is applied.
+    Each candidate costs O(n) array work instead of O(n*k) Python operations.
+    """
+    medoids = np.array(medoids, dtype=np.intp)
+    n, k = D.shape[0], len(medoids)
+    if k == 1:
+        # The single best medoid is the point with the smallest column sum
+        medoids[0] = D.sum(axis=0).argmin()
+        return np.zeros(n, dtype=np.intp), medoids, 1
+
+    n1, d1, d2 = _nearest_two(D, medoids)
+    removal_loss = np.bincount(n1, weights=d2 - d1, minlength=k)
+    is_medoid = np.zeros(n, dtype=bool)
+    is_medoid[medoids] = True
+
+    n_iter = 0
+    last_swap = -1
+    for iteration in range(max_iter):
+        n_iter = iteration + 1
+        swapped = False
+        for candidate in range(n):
+            if candidate == last_swap:
+                # A full pass since the last swap found nothing better
+                return n1, medoids, n_iter
+            if is_medoid[candidate]:
+                continue
+            d_c = D[:, candidate]
+            closer = d_c < d1
+            second = ~closer & (d_c < d2)
+            delta = removal_loss.copy()
+            delta += np.bincount(n1[closer], weights=(d1 - d2)[closer], minlength=k)
+            delta += np.bincount(n1[second], weights=(d_c - d2)[second], minlength=k)
+            best = delta.argmin()
+            gain = delta[best] + (d_c[closer] - d1[closer]).sum()
+            if gain < 0:
+                is_medoid[medoids[best]] = False
+                is_medoid[candidate] = True
+                medoids[best] = candidate
+                n1, d1, d2 = _nearest_two(D, medoids)
+                removal_loss = np.bincount(n1, weights=d2 - d1, minlength=k)
+                last_swap = candidate
+                swapped = True
+        if not swapped:
+            break
+    return n1, medoids, n_iter
+
+
+def neighbour_pruned(distance_matrix, idx, medoids, neighbours, squared=True, max_iter=50):
+    """
+    Alternating k-medoids that never gathers the n x n block: every point is assigned
+    through its neighbour list (knn.NeighbourIndex), only points without a medoid in
+    their list read their row of distances to the medoids, and a cluster's new medoid is
+    chosen among the members nearest to the current medoid. Every iteration costs
+    O(n * neighbours) instead of O(n^2); medoids move step by step, so it may need more
+    iterations than "alternate".
+    medoids: initial medoids as positions into idx.
+    """
+    medoids = np.array(medoids, dtype=np.intp)
+    n, k = len(idx), len(medoids)
+    position_of = np.full(len(neighbours), -1, dtype=np.intp)
+    position_of[idx] = np.arange(n)
+    labels = np.zeros(n, dtype=np.intp)
+    n_iter = 0
+    for iteration in range(max_iter):
+        n_iter = iteration + 1
+        labels = neighbours.nearest_in(idx, idx[medoids])
+        rest = np.flatnonzero(labels < 0)
+        if rest.size:
+            labels[rest] = _dissimilarity(distance_matrix, idx[rest], idx[medoids], squared).argmin(axis=1)
+
+        new_medoids = medoids.copy()
+        for i in range(k):
+            members = np.flatnonzero(labels == i)
+            if members.size == 0:
+                continue  # Empty cluster keeps its old medoid
+            # Candidates: the current medoid and its nearest members (from the neighbour
+            # list if enough members are in it, else from one row over the members)
+            nearby = position_of[neighbours.neighbours[idx[medoids[i]]]]
+            nearby = nearby[nearby >= 0]
+            nearby = nearby[labels[nearby] == i]
+            if len(nearby) < min(neighbours.k, members.size - 1) // 4:
+                row = _dissimilarity(distance_matrix, idx[medoids[i:i + 1]], idx[members], squared)[0]
+                nearby = members[np.argsort(row, kind="stable")[:neighbours.k]]
+            candidates = np.union1d(medoids[i:i + 1], nearby)
+            costs = _dissimilarity(distance_matrix, idx[members], idx[candidates], squared).sum(axis=0)
+            new_medoids[i] = candidates[costs.argmin()]
+
+        changed = not np.array_equal(new_medoids, medoids)
+        if not changed and iteration > 0:
+            break
+        medoids = new_medoids
+    return labels, medoids, n_iter
+
+
+def clara(distance_matrix, idx, k, squared=True, sample_size=None, n_samples=5, init="k-medoids++", rng=None, max_iter=50):
+    """
+    CLARA: runs FasterPAM on random samples of the destinations and keeps the medoids
+    with the lowest cost over the full set. Only the sample blocks and an (n x k)
+    column block are ever read from the distance matrix.
+    """
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    n = len(idx)
+    if sample_size is None:
+        sample_size = 40 + 2 * k
+    sample_size = min(n, max(sample_size, k))
+
+    best_cost, best_medoids, best_labels = np.inf, None, None
+    n_iter = 0
+    for _ in range(n_samples):
+        sample = np.sort(rng.choice(n, size=sample_size, replace=False))
+        D_sample = _dissimilarity(distance_matrix, idx[sample], idx[sample], squared)
+        start = INITIALIZERS[init](D_sample, k, rng)
+        _, sample_medoids, it = fasterpam(D_sample, start, max_iter)
+        n_iter += it
+        medoids = sample[sample_medoids]
+        to_medoids = _dissimilarity(distance_matrix, idx, idx[medoids], squared)
+        labels = to_medoids.argmin(axis=1)
+        cost = to_medoids[np.arange(n), labels].sum()
+        if cost < best_cost:
+            best_cost, best_medoids, best_labels = cost, medoids, labels
+    return best_labels, best_medoids, n_iter
+
+
+def kmedoids(distance_matrix, idx, k, method="alternate", init="random", squared=True, seed=None, max_iter=50, neighbours=None,
+             **kwargs):
+    """
+    Clusters the points `idx` (row indices into distance_matrix) into k groups.
+    method: "alternate" (same algorithm as the original hub code), "fasterpam", "clara",
+            "knn" (alternate pruned with the neighbours index, see neighbour_pruned),
+            or "auto" (FasterPAM for small sets, CLARA above CLARA_THRESHOLD points).
+    neighbours: knn.NeighbourIndex of distance_matrix, needed for "knn".
+    init: "random" or "k-medoids++".
+    seed: None draws from the global `random` state (reproduces the original code for
+          the same `random.seed`), anything else seeds a private numpy Generator.
+    Returns: (labels, medoids, n_iter) where labels[i] is the cluster of idx[i] and
+             medoids are positions into idx.
+    """
+    idx = np.asarray(idx, dtype=np.intp)
+    n = len(idx)
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(n, dtype=np.intp), np.zeros(0, dtype=np.intp), 0
+
+    rng = _as_rng(seed)
+    if method == "auto":
+        method = "clara" if n > CLARA_THRESHOLD else "fasterpam"
+    if method == "clara":
+        return clara(distance_matrix, idx, k, squared=squared, init=init, rng=rng, max_iter=max_iter, **kwargs)
+    if method == "knn":
+        if neighbours is None:
+            raise ValueError("k-medoids method 'knn' needs a NeighbourIndex")
+        # Random initial medoids, without the n x n block k-medoids++ would need
+        start = init_random(np.empty((n, 0)), k, rng)
+        return neighbour_pruned(distance_matrix, idx, start, neighbours, squared, max_iter)
+
+    D = _dissimilarity(distance_matrix, idx, idx, squared)
+    start = INITIALIZERS[init](D, k, rng)
+    if method == "alternate":
+        return alternate(D, start, max_iter)
+    if method == "fasterpam":
+        return fasterpam(D, start, max_iter)
+    raise ValueError(f"Unknown k-medoids method: {method}")
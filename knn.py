@@ -0,0 +1,245 @@
+import os
+
+import numpy as np
+
+# Neighbours kept per node; 32 int32 + 32 float32 is 256 bytes per node
+DEFAULT_K = 32
+# Matrix entries gathered per chunk while building (128 MB as float64)
+CHUNK_ENTRIES = 1 << 24
+
+
+class NeighbourIndex:
+    """
+    The k nearest other serviced nodes of every node of a distance matrix, sorted by
+    distance: neighbours[i] are matrix indices (int32), distances[i] metres (float32,
+    inf if fewer than k nodes are reachable). Built once per hub matrix in row chunks
+    and stored as two .npy files next to the node list, loaded memory-mapped.
+    """
+
+    def __init__(self, neighbours: np.ndarray, distances: np.ndarray):
+        self.neighbours = neighbours
+        self.distances = distances
+
+    def __len__(self):
+        return self.neighbours.shape[0]
+
+    @property
+    def k(self) -> int:
+        return self.neighbours.shape[1]
+
+    @classmethod
+    def build(cls, distance_matrix, k=DEFAULT_K, chunk_entries=CHUNK_ENTRIES) -> "NeighbourIndex":
+        n = distance_matrix.shape[0]
+        k = min(k, n - 1)
+        neighbours = np.empty((n, k), dtype=np.int32)
+        distances = np.empty((n, k), dtype=np.float32)
+        columns = np.arange(n)
+        chunk_rows = max(1, chunk_entries // n)
+        for start in range(0, n, chunk_rows):
+            rows = np.arange(start, min(start + chunk_rows, n))
+            block = np.asarray(distance_matrix[np.ix_(rows, columns)], dtype=np.float64)
+            block[np.arange(len(rows)), rows] = np.inf # A node is not its own neighbour
+            nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(block, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind="stable")
+            neighbours[rows] = np.take_along_axis(nearest, order, axis=1)
+            distances[rows] = np.take_along_axis(nearest_distances, order, axis=1)
+        return cls(neighbours, distances)
+
+    @staticmethod
+    def paths(prefix):
+        return f"{prefix}_neighbours.npy", f"{prefix}_distances.npy"
+
+    def save(self, prefix):
+        neighbours_path, distances_path = self.paths(prefix)
+        np.save(neighbours_path, self.neighbours)
+        np.save(distances_path, self.distances)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode="r") -> "NeighbourIndex":
+        neighbours_path, distances_path = cls.paths(prefix)
+        return cls(np.load(neighbours_path, mmap_mode=mmap_mode), np.load(distances_path, mmap_mode=mmap_mode))
+
+    @classmethod
+    def load_or_build(cls, prefix, distance_matrix, k=DEFAULT_K) -> "NeighbourIndex":
+        """
+        Loads the index stored under prefix (e.g. "utils/knnA"), or builds and stores it
+        if it is missing, was built for a matrix of another size or keeps fewer neighbours.
+        """
+        if all(os.path.exists(path) for path in cls.paths(prefix)):
+            index = cls.load(prefix)
+            if len(index) == distance_matrix.shape[0] and index.k >= min(k, len(index) - 1):
+                return index
+        index = cls.build(distance_matrix, k)
+        index.save(prefix)
+        return cls.load(prefix)
+
+    def nearest_in(self, points: np.ndarray, targets: np.ndarray):
+        """
+        For every point, the position (into targets) of the nearest target found in the
+        point's neighbour list, or -1 if none of its k neighbours is a target. Exact: the
+        list is sorted, so the first target in it is the nearest one, unless the point
+        is a target itself (then it is its own nearest, position returned as well).
+        """
+        lookup = np.full(len(self), -1, dtype=np.intp)
+        lookup[targets] = np.arange(len(targets))
+        candidates = lookup[self.neighbours[points]]
+        found = (candidates >= 0) & np.isfinite(self.distances[points])
+        first = found.argmax(axis=1)
+        nearest = np.where(found.any(axis=1), candidates[np.arange(len(points)), first], -1)
+        return np.where(lookup[points] >= 0, lookup[points], nearest)
+
+
+def stop_neighbours(distance_matrix, matrix_idx: np.ndarray, neighbours: NeighbourIndex, chunk_entries=CHUNK_ENTRIES) -> list:
+    """
+    For every stop (position into matrix_idx), the positions of its nearest other stops,
+    sorted by distance, at most neighbours.k of them. Taken from the neighbour index where
+    the stops are dense enough; stops with fewer than k / 4 stops in their list read
+    their row of distances to the other stops instead (in chunks, argpartition per row).
+    """
+    m = len(matrix_idx)
+    k = min(neighbours.k, m - 1)
+    position_of = np.full(len(neighbours), -1, dtype=np.intp)
+    position_of[matrix_idx] = np.arange(m)
+    listed = position_of[neighbours.neighbours[matrix_idx]]
+    lists = [row[row >= 0].tolist() for row in listed]
+    sparse = np.flatnonzero(np.array([len(l) for l in lists]) < k // 4)
+    chunk_rows = max(1, chunk_entries // m)
+    for start in range(0, len(sparse), chunk_rows):
+        rows = sparse[start:start + chunk_rows]
+        block = np.asarray(distance_matrix[np.ix_(matrix_idx[rows], matrix_idx)], dtype=np.float64)
+        block[np.arange(len(rows)), rows] = np.inf
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(block, nearest, axis=1), axis=1, kind="stable")
+        for row, stops in zip(rows.tolist(), np.take_along_axis(nearest, order, axis=1).tolist()):
+            lists[row] = stops
+    return lists
+
+
+def neighbour_tour(distance_matrix, matrix_idx: np.ndarray, neighbours: NeighbourIndex, start_pos: int, max_passes=50) -> list:
+    """
+    Closed tour over matrix_idx (positions, starting at start_pos) without fast_tsp's
+    m x m integer matrix: nearest-neighbour construction, then 2-opt and or-opt moves
+    that only try the stops in each stop's neighbour list (stop_neighbours, with
+    don't-look bits), so the search grows with m * k instead of m^2.
+    """
+    m = len(matrix_idx)
+    candidates = stop_neighbours(distance_matrix, matrix_idx, neighbours)
+
+    def dist(a, b):
+        return float(distance_matrix[matrix_idx[a], matrix_idx[b]])
+
+    def reversal_cost(segment):
+        # Length change of the edges inside segment when it is traversed backwards (0 if symmetric)
+        stops = matrix_idx[segment]
+        forward = np.asarray(distance_matrix[stops[:-1], stops[1:]], dtype=np.float64)
+        backward = np.asarray(distance_matrix[stops[1:], stops[:-1]], dtype=np.float64)
+        return float(backward.sum() - forward.sum())
+
+    # Nearest-neighbour construction; falls back to one row over the unvisited stops
+    visited = np.zeros(m, dtype=bool)
+    tour = [start_pos]
+    visited[start_pos] = True
+    current = start_pos
+    for _ in range(m - 1):
+        nxt = next((c for c in candidates[current] if not visited[c]), None)
+        if nxt is None:
+            remaining = np.flatnonzero(~visited)
+            row = np.asarray(distance_matrix[matrix_idx[current], matrix_idx[remaining]], dtype=np.float64)
+            nxt = int(remaining[row.argmin()])
+        tour.append(nxt)
+        visited[nxt] = True
+        current = nxt
+
+    # 2-opt and or-opt, trying only the stops in each stop's neighbour list
+    place = np.empty(m, dtype=np.intp)
+    place[tour] = np.arange(m)
+    active = set(range(m)) # Don't-look bits: only stops next to a change are searched again
+    moves = 0
+    while active and moves < max_passes * m:
+        a = active.pop()
+        moves += 1
+        changed = (_two_opt(tour, place, a, candidates, dist, reversal_cost)
+                   or _or_opt(tour, place, a, candidates, dist, reversal_cost))
+        if changed:
+            active.update(changed)
+    start = tour.index(start_pos)
+    return tour[start:] + tour[:start]
+
+
+def _reverse(tour, place, lo, hi):
+    tour[lo:hi + 1] = tour[lo:hi + 1][::-1]
+    place[tour[lo:hi + 1]] = np.arange(lo, hi + 1)
+
+
+def _two_opt(tour, place, a, candidates, dist, reversal_cost):
+    """
+    First improving 2-opt move at stop a, in both tour directions. The gain includes the
+    reversed part of the tour, so moves stay improving on directed (asymmetric) distances.
+    Returns the stops whose edges changed, or None.
+    """
+    m = len(tour)
+    i = place[a]
+    for step in (1, -1):
+        other_a = tour[(i + step) % m] # Successor, then predecessor of a
+        d_a = dist(a, other_a) if step == 1 else dist(other_a, a)
+        for c in candidates[a]:
+            if dist(a, c) >= d_a:
+                break # Sorted lists: no later candidate can give a gain
+            j = place[c]
+            other_c = tour[(j + step) % m]
+            if c == other_a or other_c == a:
+                continue
+            if step == 1:
+                # (a, succ a), (c, succ c) -> a, c .. succ a, succ c
+                lo, hi = (i + 1, j) if i < j else (j + 1, i)
+            else:
+                # (pred a, a), (pred c, c) -> pred a, pred c .. a, c
+                lo, hi = (i, j - 1) if i < j else (j, i - 1)
+            before, first, last, after = tour[lo - 1], tour[lo], tour[hi], tour[(hi + 1) % m]
+            gain = dist(before, first) + dist(last, after) - dist(before, last) - dist(first, after)
+            if gain > 1e-9:
+                gain -= reversal_cost(tour[lo:hi + 1]) # Only paid for moves about to be made
+            if gain > 1e-9:
+                _reverse(tour, place, lo, hi)
+                return (a, other_a, c, other_c)
+    return None
+
+
+def _or_opt(tour, place, a, candidates, dist, reversal_cost, max_segment=3):
+    """
+    First improving move of the segment of 1..max_segment stops starting at a to
+    between a neighbour c of a and its successor (in either orientation, the reversed one
+    paying for its reversed edges on directed distances). Returns the stops whose edges
+    changed, or None.
+    """
+    m = len(tour)
+    i = place[a]
+    for length in range(1, min(max_segment, m - 3) + 1):
+        if i + length >= m or i == 0:
+            break # Segments never wrap around the end of the list
+        segment = tour[i:i + length]
+        prev, nxt, last = tour[i - 1], tour[i + length], segment[-1]
+        removed = dist(prev, a) + dist(last, nxt) - dist(prev, nxt)
+        flipped = None # Extra length of the segment in reverse orientation, read once needed
+        for c in candidates[a]:
+            if dist(c, a) >= removed:
+                break
+            j = place[c]
+            if i - 1 <= j < i + length:
+                continue # c is in the segment or right before it
+            succ_c = tour[(j + 1) % m]
+            if flipped is None:
+                flipped = reversal_cost(segment) if length > 1 else 0.0
+            base = dist(c, succ_c)
+            forward = dist(c, a) + dist(last, succ_c) - base # c, a .. last, succ c
+            backward = dist(c, last) + dist(a, succ_c) - base + flipped # c, last .. a, succ c
+            added = min(forward, backward)
+            if removed - added > 1e-9:
+                moved = segment if forward <= backward else segment[::-1]
+                rest = tour[:i] + tour[i + length:]
+                k = rest.index(c) + 1
+                tour[:] = rest[:k] + moved + rest[k:]
+                place[tour] = np.arange(m)
+                return (a, last, prev, nxt, c, succ_c)
+    return None
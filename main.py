@@ -1,95 +1,183 @@
-import simpy
-import osmnx as ox
+import time
+_import_start = time.perf_counter()
+
 import numpy as np
-import scipy.stats as stats
-import matplotlib.pyplot as plt
-from statsmodels.stats.weightstats import DescrStatsW
 
-import random
+import json
+import os
+import sys
 
-from hub import LogisticsHub
-from res import Results
-from multiprocessing import Pool
+from nodeindex import NodeIndex
+from distmatrix import load_distance_matrix, warn_if_stale
+from network import LazyCityNetwork
+from experiment import mser, run_adaptive
+from simulation import City, HubArea, resume_replication, run_replication
+from knn import NeighbourIndex
+from workerpool import ColumnBuffer, WorkerPool, share
+from tracefiles import replication_number, write_replication
+import instrumentation
 
 LOGGING = False
+TRACE = False # Keep every delivery/dispatch/route instead of only the online statistics
+
+# Replications stop once both 95% CIs are within this fraction of the mean, or a budget runs out
+TARGET_REL_HALF_WIDTH = 0.05
+MAX_REPLICATIONS = 200
+TIME_BUDGET = None # seconds
+BASE_SEED = None # None draws fresh entropy, printed so the run can be repeated
+
+# Hubs to simulate (override with --hubs A B C) and their share of the city's trucks; hubs
+# missing from SPLIT get an equal part of the rest, see simulation.City
+HUBS = ("A",)
+SPLIT = None
+DAYS = 1 # Warm-up days are detected with MSER-5 once the run is long enough
+
+PROCESSES = None # Pool workers, one per CPU if None
+# With TRACE, workers write their delivery rows into shared buffers of this many rows each
+TRACE_ROWS_PER_WORKER = 2_000_000
+TRACE_BUFFER = None
+# With --trace-dir DIR every worker writes its replications' traces there (Parquet or NPZ),
+# analyse them later with `python analysis.py DIR` instead of re-simulating
+TRACE_DIR = None
+
+# Phase timers and counters (see instrumentation.py), enabled with --instrument
+INSTRUMENTATION_PATH = "instrumentation.json"
+# Per-worker cProfile dumps go here when run with --profile
+PROFILE_DIR = None
+
+# Seconds spent per startup phase, see print_startup_report
+STARTUP_TIMES = {"imports": time.perf_counter() - _import_start}
+
+GRAPHML_PATH = "eindhoven_bike_scc_simplified.graphml"
+# Per-hub matrices and node lists written by utils/build_distance_matrices.py
+MATRIX_MANIFEST = "utils/matrices.json"
+# Nearest nodes kept per node in utils/knn<name>_*.npy (built once per matrix), None to skip
+KNN_NEIGHBOURS = 32
+# Hub nodes of matrices without a manifest entry or hub id in their header (the original dense matrix of hub A)
+HUB_NODES = {"A": 12102009949}
+
+# Only parsed (from a cached CSR bundle) if something actually uses the graph
+city_network = LazyCityNetwork(GRAPHML_PATH)
+
+def load_hub_areas(names) -> dict:
+    """
+    Loads the service area of every hub in names from the manifest, falling back to
+    utils/distance_matrix<name>.dmx (compact, from utils/convert_distance_matrix.py) or .npy
+    with utils/nodes<name>.npy. Matrices are memory-mapped, so every worker only pages
+    in the rows it actually reads, and hubs never hold each other's matrices.
+    """
+    manifest = {}
+    if os.path.exists(MATRIX_MANIFEST):
+        with open(MATRIX_MANIFEST) as f:
+            manifest = json.load(f)
+    areas = {}
+    for name in names:
+        entry = manifest.get(name, {})
+        matrix_path = entry.get("matrix", f"utils/distance_matrix{name}.dmx")
+        if not os.path.exists(matrix_path):
+            matrix_path = f"utils/distance_matrix{name}.npy"
+        matrix_nodes, matrix = load_distance_matrix(matrix_path, mmap_mode="r")
+        # Node lists of dense matrices are copied into shared memory, compact ones are memory-mapped already
+        nodes = matrix_nodes if matrix_nodes is not None else share(np.load(entry.get("nodes", f"utils/nodes{name}.npy")))
+        location = entry.get("hub_id") or getattr(matrix, "hub_id", None) or HUB_NODES[name]
+        neighbours = None
+        if KNN_NEIGHBOURS:
+            neighbours = NeighbourIndex.load_or_build(os.path.join(os.path.dirname(matrix_path), f"knn{name}"), matrix, KNN_NEIGHBOURS)
+        areas[name] = HubArea(location, nodes, matrix, NodeIndex(nodes), neighbours) # One NodeIndex per hub, shared by its bikes
+    return areas
+
+start_time = time.perf_counter()
+CITY = City(load_hub_areas(HUBS), city_network=city_network, split=SPLIT)
+STARTUP_TIMES["nodes and distance matrix"] = time.perf_counter() - start_time
+
+def print_startup_report():
+    """
+    Prints where startup time went. Run `python -X importtime main.py` for a per-module breakdown.
+    """
+    if city_network._graph is None:
+        start_time = time.perf_counter()
+        city_network.graph
+        STARTUP_TIMES["city network (not needed by the simulation)"] = time.perf_counter() - start_time
+    print("Startup times:")
+    for phase, seconds in STARTUP_TIMES.items():
+        print(f"  {phase}: {seconds:.2f} seconds")
+
+def simulation_run(seed, **params):
+    """
+    Runs one replication on the Eindhoven data, see simulation.run_replication for the
+    parameters (lambdas, mu, sigma, available_bikes, days, dispatch_mode, kernel, ...).
+    seed is an int or a numpy SeedSequence.
+    """
+    params = dict(dict(days=DAYS), **params)
+    return run_replication(seed, CITY, trace=TRACE or TRACE_DIR is not None, logging=LOGGING, profile_dir=PROFILE_DIR, **params)
+
+def simulation_summary(seed, **params):
+    """
+    Pool worker: runs one replication and only sends its summary back to the parent.
+    """
+    return simulation_run(seed, **params).summary
+
+def simulation_checkpoint(seed, at, **params):
+    """
+    Pool worker: runs one replication on the Eindhoven data until minute `at` and returns
+    its checkpoint.Checkpoint, to branch from with simulation_branch (experiment.run_branches).
+    """
+    return simulation_run(seed, checkpoint_at=at, **params)
+
+def simulation_branch(checkpoint, **overrides):
+    """
+    Pool worker: continues a checkpoint with some parameters changed, see
+    simulation.resume_replication, and only sends the summary back.
+    """
+    return resume_replication(checkpoint, CITY, logging=LOGGING, **overrides).summary
+
+def _configure_worker(hubs, instrument, profile_dir, trace_buffer, trace_dir):
+    """
+    WorkerPool setup: hands the settings made in __main__ (--hubs, --instrument, --profile,
+    the trace buffer and --trace-dir) to every worker, which only inherits them by fork,
+    not under the spawn or forkserver start methods.
+    """
+    global HUBS, CITY, PROFILE_DIR, TRACE_BUFFER, TRACE_DIR
+    if hubs != HUBS: # Forked workers already have the parent's CITY
+        HUBS = hubs
+        CITY = City(load_hub_areas(HUBS), city_network=city_network, split=SPLIT)
+    instrumentation.enable(instrument)
+    PROFILE_DIR = profile_dir
+    TRACE_BUFFER = trace_buffer
+    TRACE_DIR = trace_dir
+
+def simulation_traced(seed, **params):
+    """
+    Pool worker with TRACE or TRACE_DIR: writes the trace into TRACE_BUFFER and/or the
+    trace files instead of pickling the Results back to the parent.
+    """
+    results = simulation_run(seed, **params)
+    if TRACE_DIR is not None:
+        write_replication(TRACE_DIR, replication_number(seed), results)
+    if TRACE_BUFFER is None:
+        return results.summary
+    return TRACE_BUFFER.store(results.summary, results.delivery_times)
 
-import time
-start_time = time.time()
-G = ox.load_graphml("eindhoven_bike_scc_simplified.graphml")
-city_network = ox.convert.to_digraph(G, weight='length')
-print(f"Graph loaded in {time.time() - start_time:.2f} seconds")
-
-start_time = time.time()
-nodes = np.load("utils/nodesA.npy")
-dist_matrix = np.load("utils/distance_matrixA.npy")
-print(f"Nodes and distance matrix loaded in {time.time() - start_time:.2f} seconds")
-
-def simulation_run(seed):
-    random.seed(seed)
-    np.random.seed(seed)
-    lambdas = [0.5,1.5,1.0,0.5]
-
-    max_lambda = max(lambdas) / 60 / 3
-    dist_arrival = stats.expon(scale=1/max_lambda)
-
-    # lb, ub = 100, 200
-    # loc, scale = lb, ub - lb
-    # dist_packages = stats.uniform(loc, scale)
-
-    mu, sigma = 300, 150
-    dist_packages = stats.norm(mu, sigma)
-
-    def lambda_t(t):
-        """
-        Returns the lambda value for the given time t.
-        """
-        if t < 6 * 60:
-            return lambdas[0] / 3
-        elif t < 12 * 60:
-            return lambdas[1] / 3
-        elif t < 18 * 60:
-            return lambdas[2] / 3 
-        else:
-            return lambdas[3] / 3
-
-    end_time = 24 * 60
-
-
-    env = simpy.Environment()
-    results = Results()
-    hubs = [
-        LogisticsHub(env, "A", 12102009949, city_network, nodes, dist_matrix, results),
-        # LogisticsHub(env, "B", 42622874, city_network),
-        # LogisticsHub(env, "C", 42656333, city_network),
-        # "A","B","C"
-]
-
-    def source(env):
-        while True:
-            interarrival_time = dist_arrival.rvs()
-            next_time = env.now + interarrival_time
-            if next_time > end_time:
-                break
-            yield env.timeout(interarrival_time)
-            if random.random() < lambda_t(next_time) / max_lambda:
-                num_packages = int(dist_packages.rvs())
-                hub = random.choice(hubs)
-
-                if LOGGING:
-                    print(f"Trucked arrived at {env.now} with {num_packages} packages at Hub {hub.id}")
-                hub.add_parcels(num_packages)
-
-    start_time = time.time()
-    env.process(source(env))
-    env.run(until=end_time)
-    print(f"Simulation ran in {time.time() - start_time:.2f} seconds")
-
-    # Print results
-    if LOGGING:
-        results.print()
-
-    return results
 if __name__ == "__main__":
+    # Analysis-only imports, pool workers never need them
+    import matplotlib.pyplot as plt
+    from analysis import plot_histogram
+
+    if "--hubs" in sys.argv:
+        # e.g. --hubs A B C; reloaded before the pool starts, see _configure_worker
+        position = sys.argv.index("--hubs") + 1
+        HUBS = tuple(arg for arg in sys.argv[position:] if not arg.startswith("--"))
+        CITY = City(load_hub_areas(HUBS), city_network=city_network, split=SPLIT)
+    for area in CITY.hub_areas.values():
+        warn_if_stale(area.distance_matrix, GRAPHML_PATH)
+    if "--startup-report" in sys.argv:
+        print_startup_report()
+    if "--instrument" in sys.argv:
+        instrumentation.enable() # Every worker records, see _configure_worker
+    if "--profile" in sys.argv:
+        PROFILE_DIR = "profiles"
+    if "--trace-dir" in sys.argv:
+        TRACE_DIR = sys.argv[sys.argv.index("--trace-dir") + 1]
     # res = simulation_run(0)
     #
     # fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(10, 8))
@@ -109,53 +197,70 @@ if __name__ == "__main__":
     #
     # plt.show()
 
-    with Pool() as pool:
-        num_runs = 10
-        seeds = [random.SystemRandom().randint(0, 2**32-1) for _ in range(num_runs)]
-        all_results = pool.map(simulation_run, seeds)
+    base_seed = BASE_SEED if BASE_SEED is not None else np.random.SeedSequence().entropy
+    print(f"Base seed: {base_seed}")
+    processes = PROCESSES or os.cpu_count()
+    if TRACE:
+        TRACE_BUFFER = ColumnBuffer({"time": np.float64, "parcel_id": np.int64, "delay": np.float64, "delivery timeslot": np.float64},
+                                    workers=processes, capacity=TRACE_ROWS_PER_WORKER)
+    # Forked after CITY exists, so the workers map the same pages; the settings (and the
+    # trace buffer, which pickles as its file paths) reach the workers whatever the start method
+    with WorkerPool(processes, _configure_worker, (HUBS, instrumentation.ENABLED, PROFILE_DIR, TRACE_BUFFER, TRACE_DIR)) as pool:
+        summary, info, all_results = run_adaptive(
+            simulation_traced if TRACE or TRACE_DIR is not None else simulation_summary, base_seed=base_seed,
+            target_rel_half_width=TARGET_REL_HALF_WIDTH, max_replications=MAX_REPLICATIONS,
+            time_budget=TIME_BUDGET, keep_results=TRACE, pool=pool,
+        )
+    print("Memory per worker:")
+    print(pool.memory_report())
+    if TRACE:
+        traced_rows = sum(len(TRACE_BUFFER.load(ref)["time"]) for ref in all_results)
+        print(f"Delivery trace: {traced_rows} rows written to shared buffers by the workers")
+        TRACE_BUFFER.unlink()
+    print(f"Stopped after {info['replications']} replications ({info['stop_reason']}, {info['elapsed']:.0f} seconds)")
+    for name, estimate in info["estimates"].items():
+        print(f"Between-replication 95% CI for mean {name}: {estimate['confint']}")
 
-    all_delays = [delay for res in all_results for delay in res.delivery_times["delay"]]
-    num_deliveries = [len(res.delivery_times["delay"]) for res in all_results]
-    mean_num_deliveries = sum(num_deliveries) / len(num_deliveries)
+    mean_num_deliveries = summary.num_deliveries / summary.num_replications
     # Create subplots for delivery times and dispatches
     fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(10, 8))
 
     # ax[0].boxplot(Results.delivery_times["delay"])
-    ax[0].hist(all_delays, bins=30, edgecolor='black', label=f"Delivery times (n = {mean_num_deliveries})", density=True)
+    plot_histogram(ax[0], summary.delay.histogram, label=f"Delivery times (n = {mean_num_deliveries})")
     ax[0].set_title("Time Until Delivery")
     ax[0].set_xlabel("Time (minutes)")
     ax[0].set_ylabel("Frequency")
     ax[0].legend(loc='upper right')
 
-    all_dispatches = [num for res in all_results for num in res.dispatches["number of parcels"]]
-    ax[1].hist(all_dispatches, bins=30, edgecolor='black', density=True)
+    plot_histogram(ax[1], summary.parcels_per_dispatch.histogram)
     ax[1].set_title("Number of Parcels Dispatched")
     ax[1].set_xlabel("Number of Parcels")
     ax[1].set_ylabel("Frequency")
 
     plt.show()
 
-    mean_delivery_delay = np.mean(all_delays)
-    std = np.std(all_delays)
-    ci = DescrStatsW(all_delays).tconfint_mean(alpha=0.05)
-    print(f"Mean delivery delay: {mean_delivery_delay:.2f} minutes")
-    print(f"Standard deviation: {std:.2f} minutes")
-    print(f"95% Confidence interval: {ci}")
-
-    mean_dispatches_parcel_count = np.mean(all_dispatches)
-    std_dispatches = np.std(all_dispatches)
-    ci_dispatches = DescrStatsW(all_dispatches).tconfint_mean(alpha=0.05)
-    print(f"Mean dispatches parcel count: {mean_dispatches_parcel_count:.2f}")
-    print(f"Standard deviation: {std_dispatches:.2f}")
-    print(f"95% Confidence interval for dispatches: {ci_dispatches}")
-
-    # import cProfile
-    # import pstats
-    #
-    # cProfile.run('env.run(until=600)', 'hub_simulation.prof')
-    #
-    # # Print profiling results
-    # with open('hub_simulation_stats.txt', 'w') as f:
-    #     stats = pstats.Stats('hub_simulation.prof', stream=f)
-    #     stats.sort_stats('cumulative').print_stats()
-    #
+    delay = summary.delay.stats
+    print(f"Mean delivery delay: {delay.mean:.2f} minutes")
+    print(f"Standard deviation: {delay.std:.2f} minutes")
+    print(f"95% Confidence interval: {delay.confint(alpha=0.05)}")
+    print(f"Median / 99th percentile delay: {summary.delay.quantiles.quantile(0.5):.2f} / {summary.delay.quantiles.quantile(0.99):.2f} minutes")
+
+    print(f"Parcels still waiting at the end of the horizon: {summary.num_backlog / summary.num_replications:.1f} per replication")
+    if DAYS > 1:
+        warmup_days = mser(summary.daily_delay.means)
+        print(f"Warm-up detected by MSER-5: {warmup_days} days; steady-state mean delay: "
+              f"{summary.daily_delay.mean(from_day=warmup_days):.2f} minutes")
+
+    dispatches = summary.parcels_per_dispatch.stats
+    print(f"Mean dispatches parcel count: {dispatches.mean:.2f}")
+    print(f"Standard deviation: {dispatches.std:.2f}")
+    print(f"95% Confidence interval for dispatches: {dispatches.confint(alpha=0.05)}")
+
+    if summary.instrumentation is not None:
+        instrumentation.write_json(INSTRUMENTATION_PATH, summary.instrumentation)
+        print(f"Phase timers and counters written to {INSTRUMENTATION_PATH}")
+    if TRACE_DIR is not None:
+        print(f"Traces written to {TRACE_DIR}/, analyse them with `python analysis.py {TRACE_DIR} --figures figures`")
+    if PROFILE_DIR is not None:
+        # e.g. python -c "import pstats; pstats.Stats('profiles/worker-123.prof').sort_stats('cumulative').print_stats(30)"
+        print(f"cProfile dumps per worker written to {PROFILE_DIR}/")
@@ -0,0 +1,109 @@
+import os
+import pickle
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def graph_to_csr(G, weights=("length", "travel_time")):
+    """
+    Converts a (Multi)DiGraph to CSR adjacency matrices for scipy.sparse.csgraph.
+    Nodes are numbered in sorted node ID order (the order the distance matrices use) and
+    of parallel edges only the cheapest one per weight is kept, like nx.dijkstra does.
+    Returns: (nodes, {weight: csr_array}).
+    """
+    nodes = np.array(sorted(G.nodes()), dtype=np.int64)
+    index = {node_id: i for i, node_id in enumerate(nodes.tolist())}
+    edges = list(G.edges(data=True))
+    u = np.fromiter((index[a] for a, _, _ in edges), dtype=np.int64, count=len(edges))
+    v = np.fromiter((index[b] for _, b, _ in edges), dtype=np.int64, count=len(edges))
+
+    matrices = {}
+    for weight in weights:
+        data = np.fromiter((float(d.get(weight, np.inf)) for _, _, d in edges), dtype=np.float64, count=len(edges))
+        # Cheapest edge per (u, v): sort by u, v, weight and keep the first of every pair
+        order = np.lexsort((data, v, u))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (u[order][1:] != u[order][:-1]) | (v[order][1:] != v[order][:-1])
+        keep = order[first & np.isfinite(data[order])]
+        # csgraph treats stored zeros as missing edges, so keep zero-length edges just above zero
+        matrices[weight] = sp.csr_array((np.maximum(data[keep], 1e-9), (u[keep], v[keep])), shape=(len(nodes), len(nodes)))
+    return nodes, matrices
+
+
+def load_graph_csr(graphml_path, cache_dir=".cache"):
+    """
+    Returns (nodes, {weight: csr_array}) for a graphml file.
+    The first call parses the graphml with osmnx and pickles the CSR arrays to
+    cache_dir, keyed by the graphml's sha256; later calls (and pool workers) only
+    unpickle a few megabytes of arrays.
+    """
+    from distmatrix import file_sha256
+    cache_path = os.path.join(cache_dir, f"graph_{file_sha256(graphml_path)[:16]}.pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    import osmnx as ox
+    bundle = graph_to_csr(ox.load_graphml(graphml_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path + ".tmp", "wb") as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + ".tmp", cache_path)
+    return bundle
+
+
+def csr_to_digraph(nodes, matrices):
+    """
+    Builds a networkx DiGraph with the CSR weights as edge attributes (e.g. length,
+    travel_time), keyed by the original node IDs.
+    """
+    import networkx as nx
+    G = nx.DiGraph()
+    G.add_nodes_from(nodes.tolist())
+    for weight, matrix in matrices.items():
+        coo = matrix.tocoo()
+        G.add_edges_from(
+            (u, v, {weight: w}) for u, v, w in zip(nodes[coo.row].tolist(), nodes[coo.col].tolist(), coo.data.tolist())
+        )
+    return G
+
+
+class LazyCityNetwork:
+    """
+    Stand-in for the city DiGraph that is only built when something actually uses it.
+    The simulation hot path only needs the nodes and the distance matrix, so most runs
+    never pay for the graph at all.
+    """
+
+    def __init__(self, graphml_path, cache_dir=".cache"):
+        self.graphml_path = graphml_path
+        self.cache_dir = cache_dir
+        self._graph = None
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = csr_to_digraph(*load_graph_csr(self.graphml_path, self.cache_dir))
+        return self._graph
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.graph, name)
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def __contains__(self, node):
+        return node in self.graph
+
+    def __getitem__(self, node):
+        return self.graph[node]
+
+    def __getstate__(self):
+        # Workers rebuild the graph themselves if they need it
+        return {"graphml_path": self.graphml_path, "cache_dir": self.cache_dir, "_graph": None}
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class NodeIndex:
+    """
+    Translates OSM node IDs to row/column indices of a distance matrix.
+    Built once per matrix and shared by the hub and all of its bikes.
+    Scalar lookups go through a dict, vectorized lookups through searchsorted on a
+    sorted copy of the node array (OSM IDs are too large for a dense remap table).
+    """
+
+    def __init__(self, nodes: np.ndarray):
+        self.nodes = np.asarray(nodes)
+        self.lookup = {node_id: i for i, node_id in enumerate(self.nodes.tolist())}
+
+        self._order = np.argsort(self.nodes, kind="stable")
+        self._sorted_nodes = self.nodes[self._order]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.lookup
+
+    def index(self, node_id) -> int:
+        """
+        Returns the matrix index of a single node ID.
+        """
+        return self.lookup[node_id]
+
+    def indices(self, node_ids) -> np.ndarray:
+        """
+        Returns the matrix indices of an array of node IDs.
+        Raises KeyError if any of the IDs is not serviced by this matrix.
+        """
+        node_ids = np.asarray(node_ids, dtype=self.nodes.dtype)
+        pos = np.searchsorted(self._sorted_nodes, node_ids)
+        pos = np.minimum(pos, len(self._sorted_nodes) - 1)
+        found = self._sorted_nodes[pos] == node_ids
+        if not found.all():
+            raise KeyError(f"Nodes not in matrix: {node_ids[~found][:5].tolist()}")
+        return self._order[pos]
+
+    def node(self, idx):
+        """
+        Returns the node ID(s) at the given matrix index/indices.
+        """
+        return self.nodes[idx]
+
+    def parcel_indices(self, parcels) -> np.ndarray:
+        """
+        Returns the destination matrix index of every parcel, using the index the parcel
+        was created with where available.
+        """
+        return np.fromiter(
+            (p.dest_idx if p.dest_idx is not None else self.lookup[p.destination] for p in parcels),
+            dtype=np.intp, count=len(parcels),
+        )
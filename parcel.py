@@ -1,14 +1,114 @@
-import uuid
-import scipy.stats as stats
+import math
+import random
+from datetime import timedelta
+
+import numpy as np
+
+
+class _IdSequence:
+    """
+    Process-wide integer parcel ids, handed out one at a time or in blocks.
+    """
+
+    def __init__(self):
+        self.next_id = 0
+
+    def take(self, n=1) -> int:
+        """
+        Reserves n consecutive ids and returns the first one.
+        """
+        first = self.next_id
+        self.next_id += n
+        return first
+
+
+parcel_ids = _IdSequence()
+
 
 class Parcel:
-    def __init__(self, destination, delivery_window):
-        self.id = uuid.uuid1()
+    """
+    A single parcel. Uses __slots__ so thousands of them stay small; parcels created by
+    ParcelBatch are thin views over one row of the batch's columns.
+    """
+    __slots__ = ("id", "destination", "dest_idx", "weight", "window_minutes", "arrival_minutes", "urgent")
+    dimesions = (10, 10, 10)
+
+    def __init__(self, destination, delivery_window, dest_idx=None, weight=None, parcel_id=None, arrival_minutes=math.nan):
+        self.id = parcel_ids.take() if parcel_id is None else parcel_id
         self.destination = destination
-        self.weight = stats.uniform(1,10).rvs()
-        self.dimesions = (10,10,10)
+        self.dest_idx = dest_idx # Row of the destination in the hub's distance matrix
+        self.weight = random.uniform(1, 11) if weight is None else weight
         self.urgent = False
-        self.delivery_window = delivery_window
+        # Windows are stored as minutes since the start of the simulation
+        if isinstance(delivery_window, timedelta):
+            delivery_window = delivery_window.total_seconds() / 60
+        self.window_minutes = delivery_window
+        self.arrival_minutes = arrival_minutes # Time the parcel arrived at the hub
+
+    @property
+    def delivery_window(self) -> timedelta:
+        return timedelta(minutes=self.window_minutes)
 
     def __str__(self):
         return f"Parcel(id={self.id}, destination={self.destination}, weight={self.weight}, dimensions={self.dimesions}, urgent={self.urgent}, delivery_window={self.delivery_window})"
+
+
+class ParcelBatch:
+    """
+    Struct-of-arrays storage for many parcels created at once (e.g. one truckload).
+    Columns: id, destination (node ID), dest_idx (matrix index), window_minutes, weight,
+    arrival_minutes.
+    """
+
+    def __init__(self, ids, destination, dest_idx, window_minutes, weight, arrival_minutes):
+        self.id = ids
+        self.destination = destination
+        self.dest_idx = dest_idx
+        self.window_minutes = window_minutes
+        self.weight = weight
+        self.arrival_minutes = arrival_minutes
+
+    @classmethod
+    def generate(cls, n, serviced_nodes: np.ndarray, window_choices, rng: np.random.Generator, arrival_minutes=math.nan,
+                 window_rng: np.random.Generator = None, weight_rng: np.random.Generator = None):
+        """
+        Creates n parcels with uniform destinations over serviced_nodes, a delivery window
+        drawn uniformly from window_choices (minutes) and a U(1, 11) kg weight, all in
+        one vectorized draw per column. Destinations are drawn from rng, windows and weights
+        from window_rng and weight_rng if given (rng otherwise).
+        """
+        window_rng = window_rng if window_rng is not None else rng
+        weight_rng = weight_rng if weight_rng is not None else rng
+        first_id = parcel_ids.take(n)
+        dest_idx = rng.integers(len(serviced_nodes), size=n)
+        return cls(
+            ids=np.arange(first_id, first_id + n, dtype=np.int64),
+            destination=np.asarray(serviced_nodes)[dest_idx],
+            dest_idx=dest_idx,
+            window_minutes=np.asarray(window_choices, dtype=np.float64)[window_rng.integers(len(window_choices), size=n)],
+            weight=weight_rng.uniform(1, 11, size=n),
+            arrival_minutes=np.full(n, arrival_minutes, dtype=np.float64),
+        )
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, i) -> Parcel:
+        return Parcel(
+            destination=self.destination[i], delivery_window=float(self.window_minutes[i]),
+            dest_idx=int(self.dest_idx[i]), weight=float(self.weight[i]), parcel_id=int(self.id[i]),
+            arrival_minutes=float(self.arrival_minutes[i]),
+        )
+
+    def parcels(self, rows=None) -> list[Parcel]:
+        """
+        Returns Parcel views of the given rows (all rows by default).
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        ids, dest, dest_idx = self.id[rows].tolist(), self.destination[rows].tolist(), self.dest_idx[rows].tolist()
+        windows, weights, arrivals = self.window_minutes[rows].tolist(), self.weight[rows].tolist(), self.arrival_minutes[rows].tolist()
+        return [
+            Parcel(destination=dest[j], delivery_window=windows[j], dest_idx=dest_idx[j], weight=weights[j], parcel_id=ids[j], arrival_minutes=arrivals[j])
+            for j in range(len(ids))
+        ]
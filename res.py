@@ -1,56 +1,457 @@
+import math
+
+import numpy as np
+
+from instrumentation import merge_reports
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class GrowableArray:
+    """
+    Typed numpy column that grows by doubling, for appending one value at a time.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, n):
+        if self._size + n > len(self._data):
+            new_capacity = max(2 * len(self._data), self._size + n)
+            data = np.empty(new_capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, value):
+        self._reserve(1)
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        self._reserve(len(values))
+        self._data[self._size:self._size + len(values)] = values
+        self._size += len(values)
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        View of the filled part of the column.
+        """
+        return self._data[:self._size]
+
+    def __getstate__(self):
+        # Only pickle the filled part, workers send these back through the pool pipe
+        return {"values": self.values.copy()}
+
+    def __setstate__(self, state):
+        self._data = state["values"]
+        self._size = len(self._data)
+
+
+class RunningStats:
+    """
+    Welford mean/variance accumulator with min/max. Two accumulators can be merged
+    (Chan et al.), so per-worker statistics combine exactly into pooled ones.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        other = RunningStats()
+        other.n = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other: "RunningStats"):
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def var(self):
+        """
+        Population variance (same as np.var).
+        """
+        return self.m2 / self.n if self.n else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    def confint(self, alpha=0.05):
+        """
+        Student t confidence interval for the mean (same as DescrStatsW.tconfint_mean).
+        """
+        from scipy.stats import t
+        if self.n < 2:
+            return (math.nan, math.nan)
+        half_width = t.ppf(1 - alpha / 2, self.n - 1) * math.sqrt(self.m2 / (self.n - 1) / self.n)
+        return (self.mean - half_width, self.mean + half_width)
+
+
+class Histogram:
+    """
+    Fixed-bin histogram over [low, high). Values outside are only counted (underflow,
+    overflow; -inf and inf included), so they do not pile up in the edge bins; NaN is skipped.
+    """
+
+    def __init__(self, low, high, bins):
+        self.edges = np.linspace(low, high, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+    def add(self, x):
+        if math.isnan(x):
+            return
+        if x < self.edges[0]:
+            self.underflow += 1
+        elif x >= self.edges[-1]:
+            self.overflow += 1
+        else:
+            i = int((x - self.edges[0]) // (self.edges[1] - self.edges[0]))
+            self.counts[min(i, len(self.counts) - 1)] += 1 # Rounding just below high
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        below = values < self.edges[0]
+        above = values >= self.edges[-1]
+        self.underflow += int(below.sum())
+        self.overflow += int(above.sum())
+        bins = np.searchsorted(self.edges, values[~(below | above)], side="right") - 1
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    def merge(self, other: "Histogram"):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (DDSketch): values are counted in
+    logarithmic buckets, so any quantile is within `relative_accuracy` of the true value.
+    Values <= min_value (e.g. zero delay) are counted separately.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.min_value = min_value
+        self.zero_count = 0
+        self.buckets = {}
+
+    def add(self, x):
+        if x <= self.min_value:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(x) / math.log(self.gamma))
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        small = values <= self.min_value
+        self.zero_count += int(small.sum())
+        keys, counts = np.unique(np.ceil(np.log(values[~small]) / math.log(self.gamma)).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other: "QuantileSketch"):
+        self.zero_count += other.zero_count
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q):
+        total = self.zero_count + sum(self.buckets.values())
+        if total == 0:
+            return math.nan
+        rank = q * (total - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class Metric:
+    """
+    Online accumulators for one simulation output: moments, histogram and quantiles.
+    """
+
+    def __init__(self, low, high, bins):
+        self.stats = RunningStats()
+        self.histogram = Histogram(low, high, bins)
+        self.quantiles = QuantileSketch()
+
+    def add(self, x):
+        if math.isnan(x):
+            return
+        self.stats.add(x)
+        self.histogram.add(x)
+        self.quantiles.add(x)
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)] # e.g. time to delivery of parcels without an arrival time
+        self.stats.add_many(values)
+        self.histogram.add_many(values)
+        self.quantiles.add_many(values)
+
+    def merge(self, other: "Metric"):
+        self.stats.merge(other.stats)
+        self.histogram.merge(other.histogram)
+        self.quantiles.merge(other.quantiles)
+
+
+class DailySeries:
+    """
+    Sum and count of a value per simulated day (e.g. the delay of the deliveries made
+    that day), for warm-up detection and day-by-day analysis of multi-day runs.
+    """
+
+    def __init__(self):
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _grow(self, days):
+        if days > len(self.sums):
+            self.sums = np.concatenate((self.sums, np.zeros(days - len(self.sums))))
+            self.counts = np.concatenate((self.counts, np.zeros(days - len(self.counts), dtype=np.int64)))
+
+    def add(self, day, value):
+        self._grow(day + 1)
+        self.sums[day] += value
+        self.counts[day] += 1
+
+    def add_many(self, days, values):
+        if len(days) == 0:
+            return
+        self._grow(int(days.max()) + 1)
+        self.sums[:days.max() + 1] += np.bincount(days, weights=values)
+        self.counts[:days.max() + 1] += np.bincount(days)
+
+    def merge(self, other: "DailySeries"):
+        self._grow(len(other.sums))
+        self.sums[:len(other.sums)] += other.sums
+        self.counts[:len(other.counts)] += other.counts
+
+    @property
+    def means(self) -> np.ndarray:
+        """
+        Mean per day, nan for days without observations.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sums / self.counts
+
+    def mean(self, from_day=0) -> float:
+        """
+        Mean over all observations from day from_day on, e.g. after the warm-up.
+        """
+        count = self.counts[from_day:].sum()
+        return float(self.sums[from_day:].sum() / count) if count else math.nan
+
+
+class ResultsSummary:
+    """
+    The few kilobytes of a replication that are needed for the analysis: online
+    statistics for delivery delay, time to delivery and parcels per dispatch.
+    Summaries of several replications are combined with merge.
+    """
+
+    def __init__(self):
+        self.delay = Metric(0, 600, 120)
+        self.time_to_delivery = Metric(0, 48 * 60, 192)
+        self.parcels_per_dispatch = Metric(0, 1000, 100)
+        self.num_deliveries = 0
+        self.num_dispatches = 0
+        self.num_replications = 1
+        self.instrumentation = None # instrumentation.report() of the replication, if enabled
+        self.daily_delay = DailySeries() # Delay by day of delivery
+        self.num_backlog = 0 # Parcels still waiting at the hubs when the horizon ended
+
+    def merge(self, other: "ResultsSummary"):
+        self.delay.merge(other.delay)
+        self.time_to_delivery.merge(other.time_to_delivery)
+        self.parcels_per_dispatch.merge(other.parcels_per_dispatch)
+        self.num_deliveries += other.num_deliveries
+        self.num_dispatches += other.num_dispatches
+        self.num_replications += other.num_replications
+        self.daily_delay.merge(other.daily_delay)
+        self.num_backlog += other.num_backlog
+        self.instrumentation = merge_reports(self.instrumentation, other.instrumentation)
+        return self
+
+    @staticmethod
+    def combine(summaries) -> "ResultsSummary":
+        """
+        Merges a list of summaries into a new one.
+        """
+        total = ResultsSummary()
+        total.num_replications = 0
+        for summary in summaries:
+            total.merge(summary)
+        return total
+
+
 class Results:
     """
     A class to handle the results of the simulation.
+    Deliveries always update the online statistics in `summary`. With trace=True every
+    delivery, dispatch and bike route is also kept in typed numpy columns.
     """
 
-    def __init__(self):
-        self.delivery_times = {
-            "time": [],
-            "parcel_id": [],
-            "delay": [],
-            "delivery timeslot": []
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.summary = ResultsSummary()
+
+        self._delivery_columns = {
+            "time": GrowableArray(np.float64),
+            "parcel_id": GrowableArray(np.int64),
+            "delay": GrowableArray(np.float64),
+            "delivery timeslot": GrowableArray(np.float64), # Window start in minutes
         }
 
-        self.dispatches = {
-            "time": [],
-            "number of parcels": []
+        self._dispatch_columns = {
+            "time": GrowableArray(np.float64),
+            "number of parcels": GrowableArray(np.int64),
         }
 
         self.bike_routes = [
 
         ]
+
+    @staticmethod
+    def combine(parts) -> "Results":
+        """
+        Results of one replication from the Results of its parts (e.g. one per hub):
+        summaries are merged, traces concatenated in the order of parts.
+        """
+        parts = list(parts)
+        combined = Results(trace=any(part.trace for part in parts))
+        combined.summary = ResultsSummary.combine(part.summary for part in parts)
+        combined.summary.num_replications = 1
+        for part in parts:
+            for name, column in part._delivery_columns.items():
+                combined._delivery_columns[name].extend(column.values)
+            for name, column in part._dispatch_columns.items():
+                combined._dispatch_columns[name].extend(column.values)
+            combined.bike_routes.extend(part.bike_routes)
+        return combined
+
+    @property
+    def delivery_times(self) -> dict:
+        """
+        Columns of the delivery trace (empty unless trace=True).
+        """
+        return {name: column.values for name, column in self._delivery_columns.items()}
+
+    @property
+    def dispatches(self) -> dict:
+        """
+        Columns of the dispatch trace (empty unless trace=True).
+        """
+        return {name: column.values for name, column in self._dispatch_columns.items()}
+
     # @staticmethod
     def register_delivery(self, time, parcel):
         """
         Register the delivery of a parcel.
         """
-        self.delivery_times["time"].append(time)
-        self.delivery_times["parcel_id"].append(parcel.id)
-        self.delivery_times["delivery timeslot"].append(parcel.delivery_window)
-        self.delivery_times["delay"].append(max(0, time - (parcel.delivery_window.total_seconds() / 60)))  # Delay in minutes
+        delay = max(0, time - parcel.window_minutes)  # Delay in minutes
+        self.summary.delay.add(delay)
+        self.summary.daily_delay.add(int(time // MINUTES_PER_DAY), delay)
+        self.summary.time_to_delivery.add(time - parcel.arrival_minutes)
+        self.summary.num_deliveries += 1
+
+        if self.trace:
+            self._delivery_columns["time"].append(time)
+            self._delivery_columns["parcel_id"].append(parcel.id)
+            self._delivery_columns["delivery timeslot"].append(parcel.window_minutes)
+            self._delivery_columns["delay"].append(delay)
+
+    def register_deliveries(self, times, parcels):
+        """
+        Register the delivery of several parcels at once, times[i] belongs to parcels[i].
+        """
+        times = np.asarray(times, dtype=np.float64)
+        windows = np.fromiter((p.window_minutes for p in parcels), dtype=np.float64, count=len(parcels))
+        arrivals = np.fromiter((p.arrival_minutes for p in parcels), dtype=np.float64, count=len(parcels))
+        delays = np.maximum(0, times - windows)  # Delay in minutes
+
+        self.summary.delay.add_many(delays)
+        self.summary.daily_delay.add_many((times // MINUTES_PER_DAY).astype(np.intp), delays)
+        self.summary.time_to_delivery.add_many(times - arrivals)
+        self.summary.num_deliveries += len(parcels)
+
+        if self.trace:
+            self._delivery_columns["time"].extend(times)
+            self._delivery_columns["parcel_id"].extend([p.id for p in parcels])
+            self._delivery_columns["delivery timeslot"].extend(windows)
+            self._delivery_columns["delay"].extend(delays)
 
     def register_dispatch(self,time, n):
         """
         Register the number of parcels dispatched at a given time.
         """
-        self.dispatches["time"].append(time)
-        self.dispatches["number of parcels"].append(n)
+        self.summary.parcels_per_dispatch.add(n)
+        self.summary.num_dispatches += 1
+        if self.trace:
+            self._dispatch_columns["time"].append(time)
+            self._dispatch_columns["number of parcels"].append(n)
 
     def register_bike_route(self,route):
         """
         Register the route taken by a bike.
         """
-        self.bike_routes.append(route)
-    
+        if self.trace:
+            self.bike_routes.append(route)
+
     def print(self):
         """
         Print the results of the simulation.
         """
+        delivery_times = self.delivery_times
         print("Delivery Times:")
-        for i in range(len(self.delivery_times["time"])):
-            print(f"Parcel {self.delivery_times['parcel_id'][i]} delivered at {self.delivery_times['time'][i]} with delay {self.delivery_times['delay'][i]} minutes.")
-        
+        for i in range(len(delivery_times["time"])):
+            print(f"Parcel {delivery_times['parcel_id'][i]} delivered at {delivery_times['time'][i]} with delay {delivery_times['delay'][i]} minutes.")
+
         print("\nBike Routes:")
         for route in self.bike_routes:
             print(route)
-
@@ -0,0 +1,117 @@
+import itertools
+import weakref
+from collections import OrderedDict
+
+import fast_tsp
+import numpy as np
+
+import instrumentation
+from knn import neighbour_tour
+
+# Time limit of every fast_tsp.find_tour call (its own default)
+TSP_SECONDS = 2.0
+# Tours with more stops use neighbour-list local search (if a NeighbourIndex is given)
+# instead of fast_tsp on the full stops x stops matrix
+NEIGHBOUR_SEARCH_STOPS = 200
+
+
+def local_distance_matrix(distance_matrix, matrix_idx) -> np.ndarray:
+    """
+    Integer TSP input for the given matrix indices, read with one np.ix_ gather.
+    Distances are truncated to whole metres like int() did; unreachable pairs get a
+    value larger than any real tour.
+    """
+    block = np.asarray(distance_matrix[np.ix_(matrix_idx, matrix_idx)], dtype=np.float64)
+    finite = np.isfinite(block)
+    if not finite.all():
+        block = np.where(finite, block, block[finite].sum() + 1)
+    local = block.astype(np.int64)
+    np.fill_diagonal(local, 0)
+    return local
+
+
+class RouteCache:
+    """
+    LRU cache of TSP tours keyed by the set of stops, so identical bulks (repeated seeds,
+    sweep scenarios sharing random numbers) only solve their TSP once per process.
+    Each distance matrix gets a token for as long as it is alive; its tours are dropped
+    when it is garbage collected, so a new matrix at a reused id() never hits them.
+    hits / misses count how much TSP work the cache saved.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._tours = OrderedDict()
+        self._matrices = {} # id(distance matrix) -> (weakref to it, token)
+        self._tokens = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._tours)
+
+    def _matrix_token(self, distance_matrix) -> int:
+        entry = self._matrices.get(id(distance_matrix))
+        if entry is not None and entry[0]() is distance_matrix:
+            return entry[1]
+        token = next(self._tokens)
+        key = id(distance_matrix)
+
+        def collected(ref):
+            if self._matrices.get(key, (None,))[0] is ref:
+                del self._matrices[key]
+            for tour_key in [k for k in self._tours if k[0] == token]:
+                del self._tours[tour_key]
+
+        self._matrices[key] = (weakref.ref(distance_matrix, collected), token)
+        return token
+
+    def tour(self, distance_matrix, stops: np.ndarray, source_idx: int, neighbours=None) -> np.ndarray:
+        """
+        Returns the closed tour (matrix indices) from source_idx over the unique stops and
+        back, e.g. [source, s3, s1, s2, source].
+        neighbours: knn.NeighbourIndex of distance_matrix, used for tours over more than
+        NEIGHBOUR_SEARCH_STOPS stops.
+        """
+        key = (self._matrix_token(distance_matrix), source_idx, frozenset(stops.tolist()))
+        route = self._tours.get(key)
+        if route is not None:
+            self.hits += 1
+            self._tours.move_to_end(key)
+            return route
+
+        self.misses += 1
+        matrix_idx = np.append(stops, source_idx)
+        source_pos = len(matrix_idx) - 1
+        instrumentation.record("tsp size", len(matrix_idx))
+        if len(matrix_idx) <= 2:
+            tour = list(range(len(matrix_idx))) # A single stop needs no TSP
+        elif neighbours is not None and len(matrix_idx) > NEIGHBOUR_SEARCH_STOPS:
+            with instrumentation.phase("neighbour search"):
+                tour = neighbour_tour(distance_matrix, matrix_idx, neighbours, source_pos)
+        else:
+            with instrumentation.phase("tsp"):
+                tour = fast_tsp.find_tour(local_distance_matrix(distance_matrix, matrix_idx).tolist(), TSP_SECONDS)
+        start = tour.index(source_pos)
+        tour = tour[start:] + tour[:start] + [source_pos] # Start and end at the source
+        route = matrix_idx[tour]
+        route.flags.writeable = False # Shared between bikes
+
+        self._tours[key] = route
+        if len(self._tours) > self.maxsize:
+            self._tours.popitem(last=False)
+        return route
+
+    def info(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._tours),
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def clear(self):
+        self._tours.clear()
+        self._matrices.clear()
+        self.hits = self.misses = 0
+
+
+# Shared by every bike of this process (each pool worker has its own)
+ROUTE_CACHE = RouteCache()
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import simpy
+
+import routecache
+from cargobike import CargoBike
+from hub import LogisticsHub
+from parcel import ParcelBatch, parcel_ids
+from res import Results
+from slotqueue import SlotQueue
+from streams import RandomStreams
+
+MAX_BATCH = 256 # Messages handled per batch
+BATCH_SECONDS = 0.005 # Longest wait for more messages before a batch is handled
+
+_planner = None # (LogisticsHub, HubArea) of this pool worker
+
+
+def _init_planner(name, area, seed, tsp_seconds, hub_params):
+    global _planner
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C stops the service, which then shuts the pool down
+    if tsp_seconds is not None:
+        routecache.TSP_SECONDS = tsp_seconds
+    # The environment never runs: the hub is only used for its clustering
+    hub = LogisticsHub(simpy.Environment(), name, area.location, None, area.nodes, area.distance_matrix, Results(),
+                       node_index=area.node_index, neighbours=area.neighbours, streams=RandomStreams(seed), **hub_params)
+    _planner = (hub, area)
+
+
+def _plan_round(task):
+    """
+    Pool worker: bulks and tours of one slot's parcels. Returns (bulks, worker seconds).
+    """
+    start_time = time.perf_counter()
+    columns, bikes = task
+    hub, area = _planner
+    parcels = ParcelBatch(*columns).parcels()
+    bulks = []
+    for bulk in hub.bulk_parcels(parcels, min(bikes, hub.available_bikes)):
+        if not bulk:
+            continue
+        bike = CargoBike(hub.env, hub.location, bulk, None, area.nodes, area.distance_matrix, Results(),
+                         node_index=area.node_index, route_cache=routecache.ROUTE_CACHE, neighbours=area.neighbours)
+        bulks.append({"parcels": [parcel.id for parcel in bulk], "route": bike.construct_route()})
+    return bulks, time.perf_counter() - start_time
+
+
+def _message_time(message) -> float:
+    """
+    Sort key of a message: its "time", or -1 if it has none that is a number (those are
+    rejected when handled).
+    """
+    try:
+        return float(message.get("time", -1.0))
+    except (TypeError, ValueError):
+        return -1.0
+
+
+def _batch_columns(parcels) -> tuple:
+    """
+    ParcelBatch columns of a list of Parcels, to send them to a worker in one piece.
+    """
+    return (
+        np.array([p.id for p in parcels], dtype=np.int64),
+        np.array([p.destination for p in parcels], dtype=np.int64),
+        np.array([p.dest_idx for p in parcels], dtype=np.intp),
+        np.array([p.window_minutes for p in parcels], dtype=np.float64),
+        np.array([p.weight for p in parcels], dtype=np.float64),
+        np.array([p.arrival_minutes for p in parcels], dtype=np.float64),
+    )
+
+
+class PlanningService:
+    """
+    Dispatch planning for one hub as a service: LogisticsHub's per-slot parcel queue, with
+    bulk_parcels and construct_route run in a process pool for every slot once the clock
+    (the latest "time" received, minutes since the start of day 0) reaches its start.
+    Requests and replies are JSON lines:
+        {"type": "manifest", "time": 512.0, "parcels": [{"destination": 123, "window": 600, "id": 1, "weight": 4.2}]}
+            queues a truckload; only "destination" is required (random bookable slot, new id, U(1, 11) kg);
+            a given "window" must be the start of a slot that is bookable at "time" and not yet planned
+        {"type": "tick", "time": 600.0, "bikes": 5}    only advances the clock ("bikes" defaults to all)
+        {"type": "stats"}                              latency percentiles of the rounds planned so far
+    Every due slot gets one reply:
+        {"type": "plan", "slot_start": 600.0, "bulks": [{"parcels": [ids], "route": [node IDs]}], "latency_ms": ...}
+    Messages are micro-batched (MAX_BATCH, BATCH_SECONDS), so the event loop keeps reading
+    while rounds are planned.
+    """
+
+    def __init__(self, name, area, available_bikes=7, processes=None, seed=0, tsp_seconds=None, **hub_params):
+        self.name = name
+        self.area = area
+        self.available_bikes = available_bikes
+        self.parcel_queue = SlotQueue(9 * 60, 19 * 60, slot_minutes=30)
+        self.rng = np.random.default_rng(seed)
+        self.clock = 0.0
+        self.next_slot = 0
+        self.latencies = [] # Seconds from receiving the message that made a slot due to its plan
+        self.inbox = None
+        self._rounds = set()
+        self.executor = ProcessPoolExecutor(processes, initializer=_init_planner,
+                                            initargs=(name, area, seed, tsp_seconds, dict(hub_params, available_bikes=available_bikes)))
+        # Start the (forked) workers now: forked later, they would inherit client sockets and keep them open
+        self.executor.submit(os.getpid).result()
+
+    def latency_stats(self) -> dict:
+        latencies = np.array(self.latencies) * 1000
+        if not len(latencies):
+            return {"type": "stats", "rounds": 0}
+        return {"type": "stats", "rounds": len(latencies), "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)), "max_ms": float(latencies.max())}
+
+    def add_manifest(self, message):
+        parcels = message.get("parcels", [])
+        if not parcels:
+            return
+        now = float(message["time"])
+        n = len(parcels)
+        destinations = np.array([p["destination"] for p in parcels], dtype=np.int64)
+        dest_idx = self.area.node_index.indices(destinations) # KeyError for nodes this hub does not serve
+        windows = np.array([p.get("window", np.nan) for p in parcels], dtype=np.float64)
+        missing = np.isnan(windows)
+        slots = self.parcel_queue.available_slots(now)
+        choices = self.parcel_queue.slot_start(slots[slots >= self.next_slot])
+        unbookable = ~missing & ~np.isin(windows, choices)
+        if unbookable.any():
+            raise ValueError(f"Windows {windows[unbookable].tolist()} are not bookable slot starts at time {now}")
+        if missing.any():
+            windows[missing] = choices[self.rng.integers(len(choices), size=int(missing.sum()))]
+        first_id = parcel_ids.take(n)
+        ids = np.array([p.get("id", first_id + i) for i, p in enumerate(parcels)], dtype=np.int64)
+        weights = np.array([p.get("weight", np.nan) for p in parcels], dtype=np.float64)
+        weights[np.isnan(weights)] = self.rng.uniform(1, 11, size=int(np.isnan(weights).sum()))
+        batch = ParcelBatch(ids, destinations, dest_idx, windows, weights, np.full(n, now))
+        self.parcel_queue.push_batch(self.parcel_queue.slot_of(windows), batch)
+
+    def due_rounds(self, bikes):
+        """
+        Pops every slot that started by the clock: [(slot start, columns, bikes)].
+        """
+        rounds = []
+        while self.parcel_queue.slot_start(self.next_slot) <= self.clock:
+            parcels = self.parcel_queue.pop(self.next_slot)
+            if parcels:
+                rounds.append((float(self.parcel_queue.slot_start(self.next_slot)), _batch_columns(parcels), bikes))
+            self.next_slot += 1
+        return rounds
+
+    async def handle_batch(self, batch):
+        """
+        Applies a batch of (message, received, reply) in time order, then submits the
+        rounds that became due to the pool; replies are written when each round is done.
+        """
+        loop = asyncio.get_running_loop()
+        for message, received, reply in sorted(batch, key=lambda item: _message_time(item[0])):
+            try:
+                kind = message.get("type")
+                if kind == "stats":
+                    reply(self.latency_stats())
+                    continue
+                if kind not in ("manifest", "tick"):
+                    raise ValueError(f"Unknown message type: {kind}")
+                now = float(message["time"])
+                if not np.isfinite(now):
+                    raise ValueError(f"Time must be finite, got {now}")
+                bikes = int(message.get("bikes", self.available_bikes))
+                if kind == "manifest":
+                    self.add_manifest(message)
+                self.clock = max(self.clock, now)
+            except (AttributeError, KeyError, TypeError, ValueError) as error:
+                reply({"type": "error", "error": str(error), "message": message})
+                continue
+            for slot_start, columns, round_bikes in self.due_rounds(bikes):
+                future = loop.run_in_executor(self.executor, _plan_round, (columns, round_bikes))
+                task = asyncio.create_task(self._finish_round(future, slot_start, received, reply))
+                self._rounds.add(task)
+                task.add_done_callback(self._rounds.discard)
+
+    async def _finish_round(self, future, slot_start, received, reply):
+        try:
+            bulks, worker_seconds = await future
+        except Exception as error: # e.g. a broken pool; the slot's parcels are not planned
+            reply({"type": "error", "error": f"Planning the slot at {slot_start} failed: {error!r}", "slot_start": slot_start})
+            return
+        latency = time.perf_counter() - received
+        self.latencies.append(latency)
+        reply({"type": "plan", "hub": self.name, "slot_start": slot_start, "bulks": bulks,
+               "latency_ms": latency * 1000, "planning_ms": worker_seconds * 1000})
+
+    async def run_batches(self):
+        """
+        Micro-batching loop: waits for a message, then collects more for at most
+        BATCH_SECONDS (or MAX_BATCH messages) and handles them together.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.inbox.get()]
+            deadline = loop.time() + BATCH_SECONDS
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(await asyncio.wait_for(self.inbox.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            await self.handle_batch(batch)
+            for _ in batch:
+                self.inbox.task_done()
+
+    async def read_lines(self, reader: asyncio.StreamReader, reply):
+        """
+        Queues every JSON line from reader until EOF.
+        """
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError as error:
+                reply({"type": "error", "error": str(error)})
+                continue
+            if not isinstance(message, dict):
+                reply({"type": "error", "error": "Messages must be JSON objects", "message": message})
+                continue
+            await self.inbox.put((message, time.perf_counter(), reply))
+
+    async def drain(self):
+        """
+        Waits until every queued message is handled and every round is planned.
+        """
+        await self.inbox.join()
+        await asyncio.gather(*self._rounds)
+
+    async def serve_stdin(self):
+        self.inbox = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        def reply(response):
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+
+        batcher = asyncio.create_task(self.run_batches())
+        await self.read_lines(reader, reply)
+        await self.drain()
+        batcher.cancel()
+        print(json.dumps(self.latency_stats()), file=sys.stderr)
+
+    async def serve_socket(self, path):
+        self.inbox = asyncio.Queue()
+
+        async def client(reader, writer):
+            def reply(response):
+                if not writer.is_closing():
+                    writer.write((json.dumps(response) + "\n").encode())
+            await self.read_lines(reader, reply)
+            await self.drain()
+            await writer.drain()
+            writer.close()
+
+        batcher = asyncio.create_task(self.run_batches())
+        server = await asyncio.start_unix_server(client, path)
+        print(f"Planning service for hub {self.name} listening on {path}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def load_area(name, synthetic=None):
+    """
+    The HubArea to plan for: hub `name` of the Eindhoven data (see main.load_hub_areas),
+    or hub A of a synthetic street grid with that many nodes.
+    """
+    if synthetic:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+        from synthetic import StreetGrid
+        return StreetGrid(synthetic).city().hub_areas["A"]
+    import main # Loads the hubs of main.HUBS on import
+    if name in main.CITY.hub_areas:
+        return main.CITY.hub_areas[name]
+    return main.load_hub_areas([name])[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dispatch-planning service (JSON lines)")
+    parser.add_argument("--hub", default="A")
+    parser.add_argument("--socket", default=None, help="listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--synthetic", type=int, default=None, help="plan on a synthetic grid with this many nodes")
+    parser.add_argument("--bikes", type=int, default=7)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--clustering", default="alternate", help="k-medoids method, see kmedoids.kmedoids")
+    parser.add_argument("--tsp-seconds", type=float, default=None, help="fast_tsp time limit per tour (routecache.TSP_SECONDS)")
+    args = parser.parse_args()
+
+    service = PlanningService(args.hub, load_area(args.hub, args.synthetic), available_bikes=args.bikes,
+                              processes=args.processes, tsp_seconds=args.tsp_seconds,
+                              clustering_method=args.clustering)
+    try:
+        asyncio.run(service.serve_socket(args.socket) if args.socket else service.serve_stdin())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
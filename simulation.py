@@ -0,0 +1,232 @@
+import random
+import time
+
+import numpy as np
+import simpy
+
+import instrumentation
+import kernel
+from arrivals import ArrivalSchedule, PiecewiseRate
+from checkpoint import Checkpoint, capture_hub, restore_global_state, restore_hub
+from experiment import as_int_seed, mser
+from hub import LogisticsHub
+from knn import NeighbourIndex
+from nodeindex import NodeIndex
+from res import Results
+from routecache import ROUTE_CACHE
+from streams import RandomStreams
+
+# Event engines selectable with run_replication(kernel=...)
+KERNELS = {"simpy": simpy.Environment, "lite": kernel.Environment}
+# Hubs the city's truck arrivals are split over by default (see City)
+PLANNED_HUBS = 3
+
+
+class HubArea:
+    """
+    One hub and its service area: the hub node, the nodes it serves and their (compact)
+    distance matrix, as built per hub by utils/build_distance_matrices.py, and optionally
+    its knn.NeighbourIndex.
+    """
+
+    def __init__(self, location, nodes: np.ndarray, distance_matrix, node_index: NodeIndex = None, neighbours: NeighbourIndex = None):
+        self.location = location
+        self.nodes = nodes
+        self.distance_matrix = distance_matrix
+        self.node_index = node_index if node_index is not None else NodeIndex(nodes)
+        self.neighbours = neighbours
+
+
+class City:
+    """
+    Everything a replication needs to know about the city: the hubs with their service
+    areas (name -> HubArea) and the share of the city's trucks each hub receives.
+    main.py builds one from the Eindhoven files, benchmarks/synthetic.py from a synthetic
+    street grid.
+    split: name -> share of all truck arrivals; hubs that are not listed get an equal
+    share of what is left, i.e. 1/3 each for the three planned hubs if split is None.
+    """
+
+    def __init__(self, hub_areas: dict, city_network=None, split: dict = None):
+        self.hub_areas = hub_areas
+        self.city_network = city_network
+        split = dict(split or {})
+        unassigned = [name for name in hub_areas if name not in split]
+        remaining = max(0.0, 1.0 - sum(split.values()))
+        for name in unassigned:
+            split[name] = remaining / max(len(unassigned), PLANNED_HUBS - len(split))
+        self.split = split
+
+    @classmethod
+    def shared(cls, nodes: np.ndarray, distance_matrix, hub_nodes: dict, city_network=None, node_index: NodeIndex = None, split=None) -> "City":
+        """
+        Every hub serves the same nodes with the same distance matrix.
+        """
+        node_index = node_index if node_index is not None else NodeIndex(nodes)
+        areas = {name: HubArea(location, nodes, distance_matrix, node_index) for name, location in hub_nodes.items()}
+        return cls(areas, city_network=city_network, split=split)
+
+
+def start_hub(name, area: HubArea, schedule: ArrivalSchedule, streams: RandomStreams, environment_class=simpy.Environment,
+              city_network=None, trace=False, logging=False, **hub_params):
+    """
+    Builds one hub on its own environment with its own trucks (schedule.for_hub),
+    Results and random streams, so hubs can be run, stepped or analysed independently.
+    hub_params are passed to LogisticsHub (resources, dispatch_mode, horizon_days, ...).
+    Returns (environment, Results, LogisticsHub).
+    """
+    env = environment_class()
+    results = Results(trace=trace)
+    hub = LogisticsHub(env, name, area.location, city_network, area.nodes, area.distance_matrix, results,
+                       node_index=area.node_index, neighbours=area.neighbours, streams=streams, **hub_params)
+    env.process(schedule.replay(env, [hub], logging=logging))
+    return env, results, hub
+
+
+def run_hub(name, area: HubArea, schedule: ArrivalSchedule, streams: RandomStreams, end_time, environment_class=simpy.Environment,
+            city_network=None, trace=False, logging=False, **hub_params) -> tuple[Results, LogisticsHub]:
+    """
+    Simulates one hub until end_time, see start_hub.
+    """
+    env, results, hub = start_hub(name, area, schedule, streams, environment_class, city_network, trace, logging, **hub_params)
+    env.run(until=end_time)
+    # Parcels booked into later days (or waiting for a bike) when the horizon ends
+    results.summary.num_backlog = hub.backlog()
+    return results, hub
+
+
+def run_replication(seed, city: City, lambdas=(0.5, 1.5, 1.0, 0.5), mu=300, sigma=150, available_bikes=7, vehicle_pool_capacity=5,
+                    charging_stations=2, antithetic=None, days=1, hubs=None, arrival_method="inversion", dispatch_mode="polling",
+                    fast_forward=False, clustering_method="alternate", kernel="simpy", trace=False, logging=False, profile_dir=None, verbose=True,
+                    checkpoint_at=None):
+    """
+    Runs one replication. seed is an int or a numpy SeedSequence.
+    lambdas: truck arrival rates (per hour) for 0-6h, 6-12h, 12-18h and 18-24h over the whole
+             city; any number of equal blocks works. Each simulated hub gets its city.split share.
+    mu, sigma: mean and standard deviation of the number of packages per truck (truncated at 0).
+    available_bikes, vehicle_pool_capacity, charging_stations: resource capacities per hub.
+    days: simulated horizon; the truck arrival rates repeat every day and parcels booked
+          for a later day stay queued across midnight.
+    hubs: names of the hubs to simulate, all hubs of the city if None.
+    arrival_method: "inversion" or "thinning", see arrivals.py.
+    dispatch_mode: "polling" or "event", see LogisticsHub.
+    fast_forward: compute every bike trip at dispatch (one event per trip), see validation.py.
+    clustering_method: k-medoids method of the hubs, see kmedoids.kmedoids ("knn" needs HubArea.neighbours).
+    kernel: "simpy", "lite" (kernel.Environment) or an Environment class.
+    antithetic: None for plain streams, False/True for the two halves of an antithetic pair.
+    trace, logging: keep every delivery in the Results / print every event.
+    profile_dir: write this worker's cumulative cProfile dump there.
+    checkpoint_at: stop every hub at this minute and return a checkpoint.Checkpoint instead,
+                   to continue (with other parameters) with resume_replication.
+    Every source of randomness has its own stream per hub (see streams.py), so runs with
+    the same seed but different parameters or hubs use common random numbers.
+    Returns the combined Results; results.per_hub has the Results of every hub and
+    results.warmup_days the warm-up detected by MSER-5 on the daily mean delay.
+    """
+    random.seed(as_int_seed(seed))
+    np.random.seed(as_int_seed(seed))
+    streams = RandomStreams(seed, antithetic)
+
+    names = list(city.hub_areas) if hubs is None else list(hubs)
+    shares = np.array([city.split[name] for name in names])
+    # Trucks per hour over the whole city, thinned to the trucks of the simulated hubs
+    arrival_rate = PiecewiseRate.daily_blocks(lambdas, scale=shares.sum())
+    end_time = days * 24 * 60
+    if checkpoint_at is not None and not 0 < checkpoint_at < end_time:
+        raise ValueError(f"checkpoint_at ({checkpoint_at}) must be within the horizon (0, {end_time})")
+
+    environment_class = KERNELS.get(kernel, kernel)
+    if instrumentation.ENABLED:
+        instrumentation.reset() # One report per replication
+        if environment_class is simpy.Environment:
+            environment_class = instrumentation.CountingSimpyEnvironment
+    # Every truck of the horizon is drawn up front, each hub's process only replays its own
+    schedule = ArrivalSchedule.generate(arrival_rate, end_time, mu, sigma, len(names), streams, method=arrival_method,
+                                        hub_weights=shares)
+
+    start_time = time.time()
+    per_hub = {}
+    hub_states = {}
+    events_processed = 0
+    hub_params = dict(horizon_days=days, dispatch_mode=dispatch_mode, fast_forward=fast_forward, clustering_method=clustering_method,
+                      available_bikes=available_bikes, vehicle_pool_capacity=vehicle_pool_capacity, charging_stations=charging_stations)
+    with instrumentation.phase("event loop"), instrumentation.worker_profiler(profile_dir):
+        for h, name in enumerate(names):
+            trucks = schedule.for_hub(h)
+            if checkpoint_at is None:
+                per_hub[name], hub = run_hub(name, city.hub_areas[name], trucks, streams.for_hub(name), end_time, environment_class,
+                                             city_network=city.city_network, trace=trace, logging=logging, **hub_params)
+            else:
+                env, _, hub = start_hub(name, city.hub_areas[name], trucks, streams.for_hub(name), environment_class,
+                                        city_network=city.city_network, trace=trace, logging=logging, **hub_params)
+                env.run(until=checkpoint_at)
+                hub_states[name] = capture_hub(hub, trucks.after(checkpoint_at), hub_params)
+            events_processed += getattr(hub.env, "events_processed", 0)
+    if verbose:
+        print(f"Simulation ran in {time.time() - start_time:.2f} seconds")
+    if checkpoint_at is not None:
+        params = dict(days=days, lambdas=lambdas, mu=mu, sigma=sigma, shares=dict(zip(names, shares.tolist())),
+                      arrival_method=arrival_method, kernel=kernel)
+        return Checkpoint(checkpoint_at, hub_states, params)
+
+    results = Results.combine(per_hub.values())
+    results.per_hub = per_hub
+    results.warmup_days = mser(results.summary.daily_delay.means[:days])
+
+    # Print results
+    if logging:
+        results.print()
+        print(f"Route cache: {ROUTE_CACHE.info()}")
+
+    if instrumentation.ENABLED:
+        instrumentation.record("events processed", events_processed)
+        instrumentation.record("trucks", len(schedule))
+        results.summary.instrumentation = instrumentation.report()
+    return results
+
+
+def resume_replication(checkpoint: Checkpoint, city: City, logging=False, verbose=False, **overrides) -> Results:
+    """
+    Continues a checkpoint (run_replication(checkpoint_at=...)) until the end of its
+    horizon, e.g. with two more bikes from the checkpoint on. The checkpoint itself is not
+    changed, so any number of branches can start from it.
+    overrides: LogisticsHub parameters (available_bikes, vehicle_pool_capacity, dispatch_mode,
+               fast_forward, clustering_method, ...; available_bikes must cover the bikes still
+               out at the checkpoint, else ValueError), and lambdas, mu and sigma for the trucks
+               after the checkpoint; these are then drawn again from every hub's own streams,
+               so branches with the same arrival parameters get the same trucks.
+    Returns the combined Results, as run_replication.
+    """
+    params = checkpoint.params
+    if "available_bikes" in overrides:
+        out = max(len(state.trips) for state in checkpoint.hubs.values())
+        if overrides["available_bikes"] < out:
+            raise ValueError(f"available_bikes ({overrides['available_bikes']}) is less than the {out} bikes "
+                             f"still out at minute {checkpoint.time}")
+    arrivals = {name: overrides.pop(name) for name in ("lambdas", "mu", "sigma") if name in overrides}
+    restore_global_state(checkpoint.global_state)
+    environment_class = KERNELS.get(params["kernel"], params["kernel"])
+    end_time = params["days"] * 24 * 60
+
+    start_time = time.time()
+    per_hub = {}
+    for name, saved in checkpoint.hubs.items():
+        state = saved.copy()
+        if arrivals:
+            lambdas, mu, sigma = (arrivals.get(key, params[key]) for key in ("lambdas", "mu", "sigma"))
+            rate = PiecewiseRate.daily_blocks(lambdas, scale=params["shares"][name])
+            # An NHPP restricted to [checkpoint, end) is the NHPP of that interval
+            state.trucks = ArrivalSchedule.generate(rate, end_time, mu, sigma, 1, state.streams,
+                                                    method=params["arrival_method"]).after(checkpoint.time)
+        env, results, hub = restore_hub(state, city.hub_areas[name], checkpoint.time, environment_class,
+                                        city_network=city.city_network, logging=logging, **overrides)
+        env.run(until=end_time)
+        results.summary.num_backlog = hub.backlog()
+        per_hub[name] = results
+    if verbose:
+        print(f"Branch from minute {checkpoint.time} ran in {time.time() - start_time:.2f} seconds")
+
+    results = Results.combine(per_hub.values())
+    results.per_hub = per_hub
+    results.warmup_days = mser(results.summary.daily_delay.means[:params["days"]])
+    return results
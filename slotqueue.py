@@ -0,0 +1,143 @@
+import numpy as np
+
+from parcel import Parcel, ParcelBatch
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class SlotQueue:
+    """
+    Parcel queue indexed by integer delivery slots.
+    Slot s is slot (s % slots_per_day) of day (s // slots_per_day); its window starts at
+    day * 24h + opening + (s % slots_per_day) * slot_minutes. Slots live in a ring buffer
+    that grows when parcels are booked further ahead than it can hold, so any number of
+    days can be simulated. Each slot holds chunks of (ParcelBatch, row indices) or lists
+    of Parcels; Parcel views are only created when a slot is popped for dispatch.
+    """
+
+    def __init__(self, opening_minute=9 * 60, closing_minute=19 * 60, slot_minutes=30, booking_days=2):
+        self.opening_minute = opening_minute
+        self.closing_minute = closing_minute
+        self.slot_minutes = slot_minutes
+        self.slots_per_day = (closing_minute - opening_minute) // slot_minutes
+        self.booking_days = booking_days # Customers can book until the end of the day after today
+
+        self.head = 0 # Oldest slot that has not been popped yet
+        self._ring = [[] for _ in range(self.slots_per_day * (booking_days + 1))]
+
+    def slot_start(self, slot):
+        """
+        Returns the start of the given slot(s) in minutes since the start of the simulation.
+        """
+        day, k = np.divmod(slot, self.slots_per_day)
+        return day * MINUTES_PER_DAY + self.opening_minute + k * self.slot_minutes
+
+    def slot_of(self, window_minutes):
+        """
+        Returns the slot(s) whose window starts at the given minute(s).
+        """
+        day, minute = np.divmod(np.asarray(window_minutes, dtype=np.int64), MINUTES_PER_DAY)
+        return day * self.slots_per_day + (minute - self.opening_minute) // self.slot_minutes
+
+    def slot_starting_at(self, now):
+        """
+        Returns the slot starting exactly at `now`, or None if no slot starts then.
+        """
+        day, minute = divmod(now, MINUTES_PER_DAY)
+        offset = minute - self.opening_minute
+        if offset < 0 or offset % self.slot_minutes != 0 or offset // self.slot_minutes >= self.slots_per_day:
+            return None
+        return int(day) * self.slots_per_day + int(offset // self.slot_minutes)
+
+    def first_open_slot(self, now) -> int:
+        """
+        Returns the first slot starting strictly after `now`.
+        """
+        day, minute = divmod(now, MINUTES_PER_DAY)
+        day = int(day)
+        if minute < self.opening_minute:
+            return day * self.slots_per_day
+        k = int((minute - self.opening_minute) // self.slot_minutes) + 1
+        return day * self.slots_per_day + min(k, self.slots_per_day)
+
+    def available_slots(self, now) -> np.ndarray:
+        """
+        Returns all slots a parcel arriving at `now` can be booked into:
+        from the first open slot until the end of the booking horizon.
+        """
+        day = int(now // MINUTES_PER_DAY)
+        return np.arange(self.first_open_slot(now), (day + self.booking_days) * self.slots_per_day)
+
+    def _ensure_capacity(self, slot):
+        if slot < self.head:
+            raise ValueError(f"Slot {slot} has already been dispatched (head is {self.head})")
+        if slot - self.head < len(self._ring):
+            return
+        # Grow the ring and lay the pending slots out again from the head
+        size = len(self._ring)
+        new_size = size
+        while slot - self.head >= new_size:
+            new_size *= 2
+        ring = [[] for _ in range(new_size)]
+        for s in range(self.head, self.head + size):
+            ring[s % new_size] = self._ring[s % size]
+        self._ring = ring
+
+    def push(self, slot, parcels: list[Parcel]):
+        """
+        Queues a list of parcels for one slot.
+        """
+        self._ensure_capacity(slot)
+        self._ring[slot % len(self._ring)].append(parcels)
+
+    def push_batch(self, slots: np.ndarray, batch: ParcelBatch):
+        """
+        Queues a whole batch, where row i goes into slots[i].
+        Rows are grouped per slot with one argsort instead of one append per parcel.
+        """
+        if len(batch) == 0:
+            return
+        order = np.argsort(slots, kind="stable")
+        unique_slots, starts = np.unique(slots[order], return_index=True)
+        self._ensure_capacity(int(unique_slots[-1]))
+        self._ensure_capacity(int(unique_slots[0]))
+        for slot, rows in zip(unique_slots.tolist(), np.split(order, starts[1:])):
+            self._ring[slot % len(self._ring)].append((batch, rows))
+
+    def count(self, slot) -> int:
+        """
+        Returns the number of parcels queued for a slot.
+        """
+        if slot < self.head or slot - self.head >= len(self._ring):
+            return 0
+        return sum(len(chunk[1]) if isinstance(chunk, tuple) else len(chunk) for chunk in self._ring[slot % len(self._ring)])
+
+    def pending(self) -> int:
+        """
+        Returns the number of parcels queued in all slots that have not been popped yet.
+        """
+        return sum(self.count(s) for s in range(self.head, self.head + len(self._ring)))
+
+    def pop(self, slot) -> list[Parcel]:
+        """
+        Removes and returns all parcels of a slot. Slots before it can no longer be booked,
+        parcels still queued in skipped slots are returned along with it.
+        """
+        if slot < self.head:
+            return []
+        self._ensure_capacity(slot)
+        chunks = []
+        for s in range(self.head, slot + 1):
+            pos = s % len(self._ring)
+            chunks.extend(self._ring[pos])
+            self._ring[pos] = []
+        self.head = slot + 1
+
+        parcels = []
+        for chunk in chunks:
+            if isinstance(chunk, tuple):
+                batch, rows = chunk
+                parcels.extend(batch.parcels(rows))
+            else:
+                parcels.extend(chunk)
+        return parcels
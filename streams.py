@@ -0,0 +1,111 @@
+import zlib
+
+import numpy as np
+from scipy.special import ndtri
+
+# One independent stream per source of randomness, so changing one part of the model
+# (e.g. the number of bikes) does not shift the draws of any other part
+STREAMS = ("arrivals", "thinning", "packages", "hub_choice", "destinations", "windows", "weights", "clustering", "travel")
+
+
+def _child(root: np.random.SeedSequence, name) -> np.random.SeedSequence:
+    return np.random.SeedSequence(root.entropy, spawn_key=tuple(root.spawn_key) + (zlib.crc32(name.encode()),))
+
+
+class InverseTransformGenerator:
+    """
+    Generator that produces every variate by inverse transform from one uniform each,
+    with the same method names as numpy's Generator. With antithetic=True the uniforms
+    are mirrored (u -> 1 - u), so a replication and its antithetic twin make negatively
+    correlated draws from the same stream.
+    """
+
+    def __init__(self, generator: np.random.Generator, antithetic=False):
+        self.generator = generator
+        self.antithetic = antithetic
+
+    def _uniform(self, size=None):
+        u = self.generator.random(size)
+        return 1.0 - u if self.antithetic else u
+
+    def random(self, size=None):
+        return self._uniform(size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        if size is None:
+            size = np.broadcast(low, high).shape or None
+        return low + (high - low) * self._uniform(size)
+
+    def integers(self, low, high=None, size=None):
+        if high is None:
+            low, high = 0, low
+        u = self._uniform(size)
+        return np.minimum(low + np.floor(u * (high - low)), high - 1).astype(np.int64)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        if size is None:
+            size = np.broadcast(loc, scale).shape or None
+        # Keep u away from 0 and 1, where the inverse CDF is infinite
+        u = np.clip(self._uniform(size), 1e-12, 1 - 1e-12)
+        return loc + scale * ndtri(u)
+
+    def exponential(self, scale=1.0, size=None):
+        u = np.clip(self._uniform(size), 1e-300, 1.0)
+        return -scale * np.log(u)
+
+    def choice(self, a, size=None, replace=True, p=None):
+        population = np.arange(a) if isinstance(a, (int, np.integer)) else np.asarray(a)
+        n = len(population)
+        if not replace:
+            # Rank of the uniforms gives a uniform sample, mirrored uniforms the opposite ranks
+            picks = np.argsort(self._uniform(n))[:size]
+        elif p is not None:
+            cdf = np.cumsum(p)
+            picks = np.minimum(np.searchsorted(cdf, self._uniform(size) * cdf[-1], side="right"), n - 1)
+        else:
+            picks = self.integers(n, size=size)
+        return population[picks]
+
+
+class RandomStreams:
+    """
+    Named random streams of one replication, see STREAMS.
+    Stream `name` is seeded from the replication seed plus a fixed key derived from the
+    name, so the same seed gives the same stream in every scenario (common random numbers).
+    antithetic: None uses plain numpy Generators; False/True use InverseTransformGenerators,
+    where True mirrors every uniform. Run a replication with False and True to get an
+    antithetic pair.
+    """
+
+    def __init__(self, seed=None, antithetic=None):
+        root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.antithetic = antithetic
+        self._root = root
+        self._streams = {}
+        for name in STREAMS:
+            child = _child(root, name)
+            generator = np.random.default_rng(child)
+            self._streams[name] = generator if antithetic is None else InverseTransformGenerator(generator, antithetic)
+
+    @classmethod
+    def single(cls, rng: np.random.Generator) -> "RandomStreams":
+        """
+        Every purpose draws from the same generator (the behaviour before per-purpose streams).
+        """
+        streams = cls.__new__(cls)
+        streams.antithetic = None
+        streams._root = None
+        streams._streams = {name: rng for name in STREAMS}
+        return streams
+
+    def for_hub(self, hub_name) -> "RandomStreams":
+        """
+        Streams of one hub, keyed by its name: adding or removing a hub does not change the
+        parcels, clustering or travel times of any other hub. Single streams are shared.
+        """
+        if self._root is None:
+            return self
+        return RandomStreams(_child(self._root, f"hub:{hub_name}"), self.antithetic)
+
+    def __getitem__(self, name):
+        return self._streams[name]
@@ -0,0 +1,142 @@
+import glob
+import hashlib
+import itertools
+import json
+import os
+import pickle
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+import numpy as np
+
+from res import ResultsSummary
+
+
+class ScenarioGrid:
+    """
+    Cartesian product of parameter ranges, e.g.
+    ScenarioGrid(available_bikes=[5, 7, 10], mu=[200, 300]) has 6 scenarios.
+    Each scenario is a dict of keyword arguments for simulation_run.
+    """
+
+    def __init__(self, **ranges):
+        self.names = sorted(ranges)
+        self.ranges = {name: list(ranges[name]) for name in self.names}
+
+    def __len__(self):
+        return int(np.prod([len(values) for values in self.ranges.values()]))
+
+    def __iter__(self):
+        for values in itertools.product(*(self.ranges[name] for name in self.names)):
+            yield dict(zip(self.names, values))
+
+
+def code_version(root=os.path.dirname(os.path.abspath(__file__))) -> str:
+    """
+    Hash of the simulation source files, so cached cells are recomputed after code changes.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(root, "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode())
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def cell_key(simulate, params: dict, seed: np.random.SeedSequence, version: str) -> str:
+    """
+    Content address of one (scenario, replication) cell.
+    """
+    description = {
+        "simulate": f"{simulate.__module__}.{simulate.__qualname__}",
+        "params": params,
+        "seed": [str(seed.entropy), list(seed.spawn_key)],
+        "code": version,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Directory of pickled cell summaries, one file per cell key. Files are written to a
+    temporary name and renamed, so an interrupted sweep never leaves a half-written cell.
+    """
+
+    def __init__(self, cache_dir=".cache/sweep"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return pickle.load(f)
+
+    def put(self, key, summary):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(summary, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+def _run_cell(cell):
+    key, simulate, params, seed = cell
+    summary = simulate(seed, **params)
+    return key, getattr(summary, "summary", summary)
+
+
+def run_sweep(simulate, grid: ScenarioGrid, replications=10, base_seed=0, cache_dir=".cache/sweep", processes=None, verbose=True,
+              pool=None):
+    """
+    Runs `replications` replications of every scenario of the grid over a process pool.
+    simulate(seed, **params) must be a picklable top-level function returning a
+    ResultsSummary (or Results), e.g. main.simulation_summary.
+    Replication r uses the same seed in every scenario. Every finished cell is stored in
+    the cache right away, keyed by parameters, seed and code version, so re-running a
+    sweep skips finished cells and an interrupted sweep resumes where it stopped.
+    pool: a running workerpool.WorkerPool (or multiprocessing Pool) to use instead of a new one.
+    Returns: list of (params, combined ResultsSummary, per-replication summaries).
+    """
+    cache = ResultCache(cache_dir)
+    version = code_version()
+    seeds = np.random.SeedSequence(base_seed).spawn(replications)
+    scenarios = list(grid)
+
+    keys = [[cell_key(simulate, params, seed, version) for seed in seeds] for params in scenarios]
+    pending = [
+        (keys[i][r], simulate, params, seeds[r])
+        for i, params in enumerate(scenarios) for r in range(replications)
+        if keys[i][r] not in cache
+    ]
+    if verbose:
+        print(f"{len(scenarios) * replications - len(pending)} of {len(scenarios) * replications} cells cached, running {len(pending)}")
+
+    if pending:
+        with nullcontext(pool) if pool is not None else Pool(processes) as pool:
+            for done, (key, summary) in enumerate(pool.imap_unordered(_run_cell, pending), start=1):
+                cache.put(key, summary)
+                if verbose:
+                    print(f"\r{done}/{len(pending)} cells", end="", flush=True)
+        if verbose:
+            print()
+
+    sweep_results = []
+    for i, params in enumerate(scenarios):
+        summaries = [cache.get(key) for key in keys[i]]
+        sweep_results.append((params, ResultsSummary.combine(summaries), summaries))
+    return sweep_results
+
+
+if __name__ == "__main__":
+    from main import simulation_summary
+
+    grid = ScenarioGrid(available_bikes=[5, 7, 10])
+    for params, summary, _ in run_sweep(simulation_summary, grid, replications=10):
+        low, high = summary.delay.stats.confint()
+        print(f"{params}: mean delay {summary.delay.stats.mean:.2f} minutes (95% CI {low:.2f} - {high:.2f}), "
+              f"mean parcels per dispatch {summary.parcels_per_dispatch.stats.mean:.2f}")
@@ -0,0 +1,35 @@
+import pytest
+
+import routecache
+from simulation import resume_replication, run_replication
+from synthetic import StreetGrid
+
+CHECKPOINT_AT = 13 * 60 + 1 # Just after a slot's bikes left, so trips are resumed mid-route
+
+
+@pytest.fixture(scope="module")
+def city():
+    return StreetGrid(2000).city()
+
+
+@pytest.fixture(autouse=True)
+def short_tsp(monkeypatch):
+    monkeypatch.setattr(routecache, "TSP_SECONDS", 0.05)
+
+
+@pytest.mark.parametrize("dispatch_mode", ["polling", "event"])
+def test_resume_matches_straight_run(city, dispatch_mode):
+    straight = run_replication(0, city, dispatch_mode=dispatch_mode, verbose=False).summary
+    checkpoint = run_replication(0, city, dispatch_mode=dispatch_mode, verbose=False, checkpoint_at=CHECKPOINT_AT)
+    resumed = resume_replication(checkpoint, city).summary
+    assert resumed.num_deliveries == straight.num_deliveries
+    assert resumed.delay.stats.mean == pytest.approx(straight.delay.stats.mean, rel=1e-12)
+
+
+def test_resume_rejects_fewer_bikes_than_are_out(city):
+    checkpoint = run_replication(0, city, verbose=False, checkpoint_at=CHECKPOINT_AT)
+    out = max(len(state.trips) for state in checkpoint.hubs.values())
+    assert out > 0
+    with pytest.raises(ValueError):
+        resume_replication(checkpoint, city, available_bikes=out - 1)
+    resume_replication(checkpoint, city, available_bikes=out)
@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+from experiment import run_adaptive
+from workerpool import WorkerPool
+
+
+def failing_replication(seed):
+    raise RuntimeError("replication failed")
+
+
+def run_in_thread(target, seconds=60):
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = target()
+        except Exception as error:
+            outcome["error"] = error
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "run_adaptive hung"
+    return outcome
+
+
+def test_failing_replication_raises():
+    outcome = run_in_thread(lambda: run_adaptive(failing_replication, base_seed=0, processes=2, verbose=False))
+    assert isinstance(outcome.get("error"), RuntimeError)
+
+
+def test_failing_replication_raises_with_worker_pool():
+    with WorkerPool(2) as pool:
+        outcome = run_in_thread(lambda: run_adaptive(failing_replication, base_seed=0, pool=pool, verbose=False))
+        assert isinstance(outcome.get("error"), RuntimeError)
+        assert pool.map(abs, [-1, -2]) == [1, 2] # The pool is still usable
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from knn import NeighbourIndex, neighbour_tour
+
+
+def tour_length(distance_matrix, matrix_idx, tour):
+    stops = matrix_idx[tour]
+    return float(distance_matrix[stops, np.roll(stops, -1)].sum())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_neighbour_tour_on_directed_distances(seed):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 1000, size=(50, 2))
+    distance_matrix = np.abs(points[:, None, :] - points[None, :, :]).sum(axis=2)
+    distance_matrix += np.triu(rng.uniform(0, 3000, size=distance_matrix.shape)) # Detours one way only
+    np.fill_diagonal(distance_matrix, 0)
+    neighbours = NeighbourIndex.build(distance_matrix, k=8)
+    matrix_idx = np.sort(rng.choice(len(distance_matrix), size=40, replace=False))
+
+    nearest_neighbour = neighbour_tour(distance_matrix, matrix_idx, neighbours, 0, max_passes=0)
+    tour = neighbour_tour(distance_matrix, matrix_idx, neighbours, 0)
+    assert sorted(tour) == list(range(len(matrix_idx)))
+    assert tour[0] == 0
+    assert tour_length(distance_matrix, matrix_idx, tour) <= tour_length(distance_matrix, matrix_idx, nearest_neighbour) + 1e-6
@@ -0,0 +1,21 @@
+import numpy as np
+
+from res import Histogram
+
+
+def test_histogram_counts_out_of_range_values_separately():
+    values = np.array([-1.0, 0.0, 4.99, 5.0, 599.999, 600.0, 2000.0, np.inf, -np.inf, np.nan])
+    one_by_one = Histogram(0, 600, 120)
+    for value in values:
+        one_by_one.add(value)
+    batched = Histogram(0, 600, 120)
+    batched.add_many(values)
+
+    for histogram in (one_by_one, batched):
+        assert histogram.counts[0] == 2 and histogram.counts[1] == 1 and histogram.counts[-1] == 1
+        assert histogram.counts.sum() == 4
+        assert (histogram.underflow, histogram.overflow) == (2, 3)
+        assert histogram.total == 9 # NaN is skipped
+
+    one_by_one.merge(batched)
+    assert (one_by_one.underflow, one_by_one.overflow, one_by_one.total) == (4, 6, 18)
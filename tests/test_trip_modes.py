@@ -0,0 +1,25 @@
+import pytest
+
+import routecache
+from simulation import run_replication
+from synthetic import StreetGrid
+from validation import compare_trip_modes
+
+
+@pytest.fixture(scope="module")
+def city():
+    return StreetGrid(2000).city()
+
+
+@pytest.fixture(autouse=True)
+def short_tsp(monkeypatch):
+    monkeypatch.setattr(routecache, "TSP_SECONDS", 0.05)
+
+
+@pytest.mark.parametrize("dispatch_mode", ["polling", "event"])
+def test_fast_forward_matches_per_leg(city, dispatch_mode):
+    def simulate(seed, **params):
+        return run_replication(seed, city, verbose=False, **params)
+
+    report = compare_trip_modes(simulate, seeds=range(2), rtol=1e-12, dispatch_mode=dispatch_mode)
+    assert report["matches"], report["max relative difference"]
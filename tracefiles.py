@@ -0,0 +1,110 @@
+import glob
+import os
+
+import numpy as np
+
+# Parquet if pyarrow is installed, compressed NPZ otherwise; both are read back by TraceReader
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DEFAULT_FORMAT = "parquet" if pq is not None else "npz"
+CHUNK_ROWS = 1_000_000 # Rows per file; a replication with more rows is split over several files
+TABLES = ("deliveries", "dispatches", "routes")
+
+
+def replication_number(seed) -> int:
+    """
+    Replication number of a seed from experiment.replication_seeds (its spawn key), or the int seed itself.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return int(seed.spawn_key[-1]) if seed.spawn_key else int(seed.generate_state(1)[0])
+    return int(seed)
+
+
+def trace_tables(replication, results) -> dict:
+    """
+    The trace of one replication (Results with trace=True) as columns per table, each
+    with a "replication" column. Routes are flattened to one row per stop.
+    """
+    deliveries = dict(results.delivery_times)
+    dispatches = dict(results.dispatches)
+    routes = results.bike_routes
+    lengths = np.array([len(route) for route in routes], dtype=np.int64)
+    route_columns = {
+        "route": np.repeat(np.arange(len(routes), dtype=np.int64), lengths),
+        "stop": np.concatenate([np.arange(n, dtype=np.int64) for n in lengths]) if len(routes) else np.zeros(0, dtype=np.int64),
+        "node": np.concatenate([np.asarray(route, dtype=np.int64) for route in routes]) if len(routes) else np.zeros(0, dtype=np.int64),
+    }
+    tables = {}
+    for name, columns in (("deliveries", deliveries), ("dispatches", dispatches), ("routes", route_columns)):
+        rows = len(next(iter(columns.values())))
+        tables[name] = dict(replication=np.full(rows, replication, dtype=np.int64), **columns)
+    return tables
+
+
+def _write_chunk(path, columns: dict, fmt):
+    tmp_path = path + ".tmp"
+    if fmt == "parquet":
+        pq.write_table(pa.table(columns), tmp_path)
+    else:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **columns)
+    os.replace(tmp_path, path) # Readers never see half-written files
+
+
+def write_replication(directory, replication, results, fmt=None, chunk_rows=CHUNK_ROWS):
+    """
+    Writes the deliveries, dispatches and bike routes of one replication into
+    <directory>/<table>/r<replication>-<chunk>.<parquet|npz>. Every replication gets
+    its own files, so pool workers can write their traces in parallel.
+    """
+    fmt = fmt or DEFAULT_FORMAT
+    if fmt == "parquet" and pq is None:
+        raise ImportError("Writing Parquet traces needs pyarrow, use fmt='npz'")
+    for table, columns in trace_tables(replication, results).items():
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+        rows = len(columns["replication"])
+        for chunk, start in enumerate(range(0, max(rows, 1), chunk_rows)):
+            _write_chunk(os.path.join(directory, table, f"r{replication:06d}-{chunk:04d}.{fmt}"),
+                         {name: values[start:start + chunk_rows] for name, values in columns.items()}, fmt)
+
+
+class TraceReader:
+    """
+    Scans the trace files of a directory written by write_replication chunk by chunk,
+    so only one chunk is in memory at a time. Parquet files are memory-mapped and read
+    in record batches; NPZ chunks are decompressed one at a time.
+    """
+
+    def __init__(self, directory, batch_rows=CHUNK_ROWS):
+        self.directory = directory
+        self.batch_rows = batch_rows
+
+    def files(self, table) -> list:
+        return sorted(glob.glob(os.path.join(self.directory, table, "r*.parquet"))
+                      + glob.glob(os.path.join(self.directory, table, "r*.npz")))
+
+    @property
+    def replications(self) -> np.ndarray:
+        """
+        Numbers of the replications with a delivery trace, from the file names only.
+        """
+        return np.unique([int(os.path.basename(path).split("-")[0][1:]) for path in self.files("deliveries")])
+
+    def chunks(self, table, columns=None):
+        """
+        Yields {column: numpy array} per chunk of a table, with only the given columns if any.
+        """
+        for path in self.files(table):
+            if path.endswith(".parquet"):
+                if pq is None:
+                    raise ImportError(f"Reading {path} needs pyarrow")
+                parquet = pq.ParquetFile(path, memory_map=True)
+                for batch in parquet.iter_batches(batch_size=self.batch_rows, columns=columns):
+                    yield {name: batch.column(name).to_numpy() for name in batch.schema.names}
+            else:
+                with np.load(path) as npz:
+                    yield {name: npz[name] for name in (columns or npz.files)}
@@ -0,0 +1,75 @@
+import numpy as np
+
+import instrumentation
+
+
+class ConstantSpeed:
+    """
+    Free-flow speed model: every leg is ridden at v_max (km/h).
+    """
+
+    def __init__(self, v_max):
+        self.v_max = v_max
+
+    def speeds(self, times: np.ndarray) -> np.ndarray:
+        """
+        Returns the mean speed (km/h) for legs departing at the given times (minutes).
+        """
+        return np.full(np.shape(times), float(self.v_max))
+
+
+class TimeOfDaySpeed:
+    """
+    Congestion speed model: v_max scaled by a factor looked up from a table of
+    equally long periods of the day (e.g. 24 hourly factors). Times past midnight
+    wrap around, so multi-day runs reuse the same table.
+    """
+
+    def __init__(self, v_max, factors, period_minutes=60):
+        self.v_max = v_max
+        self.factors = np.asarray(factors, dtype=np.float64)
+        self.period_minutes = period_minutes
+
+    def speeds(self, times: np.ndarray) -> np.ndarray:
+        """
+        Returns the mean speed (km/h) for legs departing at the given times (minutes).
+        """
+        period = (np.asarray(times) // self.period_minutes).astype(np.intp) % len(self.factors)
+        return self.v_max * self.factors[period]
+
+
+def sample_route_travel_times(dist_matrix, route_idx, rng: np.random.Generator, speed_model, depart_time=0.0, sigma_ratio=1 / 20):
+    """
+    Samples the travel time (minutes) of every leg of a route in one go.
+    All leg lengths are read with a single fancy-indexed gather and all times are drawn
+    with a single rng.normal call, using the same model as CargoBike.sampleLinkTravelTime:
+    mu = length / speed and sigma = mu * sigma_ratio, clipped at zero.
+    The speed of each leg is taken at its expected departure time, i.e. depart_time plus
+    the mean travel time of the legs before it under the same speed model.
+    route_idx: matrix indices of the visited nodes, including start and end.
+    """
+    with instrumentation.phase("travel sampling"):
+        return _sample_route_travel_times(dist_matrix, route_idx, rng, speed_model, depart_time, sigma_ratio)
+
+
+def _sample_route_travel_times(dist_matrix, route_idx, rng, speed_model, depart_time, sigma_ratio):
+    route_idx = np.asarray(route_idx, dtype=np.intp)
+    lengths_km = np.asarray(dist_matrix[route_idx[:-1], route_idx[1:]], dtype=np.float64) / 1000.0
+
+    if isinstance(speed_model, ConstantSpeed):
+        mu = lengths_km / speed_model.v_max * 60
+    else:
+        # Departures from the modelled mean times of the legs before, as a fixed point:
+        # start at free-flow speed, re-evaluate until no departure moves. Pass p gets at
+        # least the first p legs exact, so this ends after at most one pass per leg.
+        mu = lengths_km / speed_model.v_max * 60
+        for _ in range(len(mu)):
+            departures = depart_time + np.concatenate(([0.0], np.cumsum(mu)[:-1]))
+            updated = lengths_km / speed_model.speeds(departures) * 60
+            if np.array_equal(updated, mu):
+                break
+            mu = updated
+
+    times = rng.normal(mu, mu * sigma_ratio)
+    np.maximum(times, 0.0, out=times) # Negative travel times are not physical
+    return times
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from distmatrix import create_compact, encode, file_sha256
+from network import graph_to_csr
+
+# Builds the per-hub distance matrices (replaces generate_shortest_path_length_matrix.py).
+# The graph is converted to CSR once; shortest paths are only computed from nodes that are
+# reachable from some hub within the cutoff, each source once even if several hubs reach it,
+# in chunks spread over a process pool that write their rows straight into the output files.
+# A manifest remembers what every matrix was built from, so re-running only rebuilds hubs
+# whose id, cutoff, dtype or graphml changed, e.g.
+#   python utils/build_distance_matrices.py --hub A=309682746 --hub B=392674444 --hub C=5443883873
+
+HUBS = {"A": 309682746, "B": 392674444, "C": 5443883873}
+
+_worker = {}
+
+
+def reachable_nodes(time_csr, hub_pos, cutoff):
+    """
+    Graph positions of all nodes within `cutoff` seconds of travel time from the hub, sorted.
+    """
+    travel_times = dijkstra(time_csr, indices=hub_pos, limit=cutoff)
+    return np.flatnonzero(np.isfinite(travel_times))
+
+
+def _init_worker(length_csr, outputs):
+    _worker["length_csr"] = length_csr
+    # Every worker maps the output files itself, rows are only sent to disk, not through the pool
+    _worker["outputs"] = [
+        (np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=(len(positions), len(positions))), positions, dtype)
+        for path, offset, positions, dtype in outputs
+    ]
+
+
+def _build_rows(sources):
+    """
+    Runs Dijkstra from a chunk of sources and writes each source's row into every hub
+    matrix that contains it.
+    """
+    dist = dijkstra(_worker["length_csr"], indices=sources)
+    for raw, positions, dtype in _worker["outputs"]:
+        rows = np.searchsorted(positions, sources)
+        rows = np.minimum(rows, len(positions) - 1)
+        in_hub = positions[rows] == sources
+        if in_hub.any():
+            raw[rows[in_hub]] = encode(dist[in_hub][:, positions], dtype)
+    for raw, _, _ in _worker["outputs"]:
+        raw.flush()
+    return len(sources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build compact per-hub distance matrices")
+    parser.add_argument("--graphml", default="eindhoven_bike_scc_simplified.graphml")
+    parser.add_argument("--hub", action="append", default=None, help="NAME=NODE_ID, may be repeated (default: hubs A, B, C)")
+    parser.add_argument("--cutoff", type=float, default=900, help="reachability cutoff in seconds of travel time")
+    parser.add_argument("--out", default="utils", help="output directory")
+    parser.add_argument("--dtype", choices=["uint32", "float32"], default="uint32")
+    parser.add_argument("--chunk", type=int, default=128, help="sources per Dijkstra call")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild every hub, even if up to date")
+    args = parser.parse_args()
+
+    hubs = dict(h.split("=") for h in args.hub) if args.hub else HUBS
+    hubs = {name: int(node_id) for name, node_id in hubs.items()}
+    manifest_path = os.path.join(args.out, "matrices.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    graph_sha256 = file_sha256(args.graphml)
+    wanted = {
+        name: {"hub_id": node_id, "cutoff": args.cutoff, "dtype": args.dtype, "graph_sha256": graph_sha256,
+               "matrix": os.path.join(args.out, f"distance_matrix{name}.dmx"), "nodes": os.path.join(args.out, f"nodes{name}.npy")}
+        for name, node_id in hubs.items()
+    }
+    stale = [name for name, entry in wanted.items()
+             if args.force or manifest.get(name) != entry or not os.path.exists(entry["matrix"])]
+    if not stale:
+        print("All hub matrices are up to date")
+        return
+    print(f"Building matrices for hubs {stale}")
+
+    import osmnx as ox
+    start_time = time.time()
+    nodes, csr = graph_to_csr(ox.load_graphml(args.graphml))
+    print(f"Graph converted to CSR in {time.time() - start_time:.2f} seconds ({len(nodes)} nodes)")
+
+    outputs = []
+    sources = []
+    for name in stale:
+        entry = wanted[name]
+        hub_pos = int(np.searchsorted(nodes, entry["hub_id"]))
+        positions = reachable_nodes(csr["travel_time"], hub_pos, args.cutoff)
+        np.save(entry["nodes"], nodes[positions])
+        raw = create_compact(entry["matrix"], nodes[positions], hub_id=entry["hub_id"], graph_sha256=graph_sha256, dtype=args.dtype)
+        outputs.append((entry["matrix"], raw.offset, positions, args.dtype))
+        del raw
+        sources.append(positions)
+        print(f"Hub {name}: {len(positions)} reachable nodes")
+
+    # Hubs with overlapping service areas share the Dijkstra runs of their common nodes
+    sources = np.unique(np.concatenate(sources))
+    print(f"{len(sources)} distinct sources (instead of {sum(len(o[2]) for o in outputs)})")
+
+    start_time = time.time()
+    chunks = [sources[i:i + args.chunk] for i in range(0, len(sources), args.chunk)]
+    done = 0
+    with Pool(args.workers, initializer=_init_worker, initargs=(csr["length"], outputs)) as pool:
+        for n in pool.imap_unordered(_build_rows, chunks):
+            done += n
+            print(f"\r{done}/{len(sources)} rows ({time.time() - start_time:.0f} s)", end="", flush=True)
+    print()
+
+    for name in stale:
+        manifest[name] = wanted[name]
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from distmatrix import file_sha256, load_compact, save_compact
+
+# Converts the dense float64 .npy matrices made by generate_shortest_path_length_matrix.py
+# into the compact memory-mappable format read by distmatrix.load_compact, e.g.
+#   python utils/convert_distance_matrix.py utils/nodesA.npy utils/distance_matrixA.npy utils/distance_matrixA.dmx \
+#       --hub-id 12102009949 --graphml eindhoven_bike_scc_simplified.graphml
+
+parser = argparse.ArgumentParser(description="Convert a dense .npy distance matrix to the compact format")
+parser.add_argument("nodes", help="nodes .npy file")
+parser.add_argument("matrix", help="dense distance matrix .npy file (metres, inf = unreachable)")
+parser.add_argument("output", help="compact matrix file to write")
+parser.add_argument("--hub-id", type=int, default=None)
+parser.add_argument("--graphml", default=None, help="graphml the matrix was generated from, stored as checksum")
+parser.add_argument("--dtype", choices=["uint32", "float32"], default="uint32")
+args = parser.parse_args()
+
+nodes = np.load(args.nodes)
+dist_matrix = np.load(args.matrix, mmap_mode="r")
+graph_sha256 = file_sha256(args.graphml) if args.graphml else None
+save_compact(args.output, nodes, dist_matrix, hub_id=args.hub_id, graph_sha256=graph_sha256, dtype=args.dtype)
+
+compact = load_compact(args.output)
+finite = np.isfinite(dist_matrix[:1000])
+max_error = np.abs(compact[:1000][finite] - dist_matrix[:1000][finite]).max(initial=0)
+print(f"Wrote {args.output}: {len(nodes)} nodes, {os.path.getsize(args.output) / 2**20:.1f} MiB "
+      f"(was {os.path.getsize(args.matrix) / 2**20:.1f} MiB), max error {max_error:.3f} m in the first rows")
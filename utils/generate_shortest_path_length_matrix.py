@@ -1,3 +1,4 @@
+# Superseded by build_distance_matrices.py, which builds all hubs in parallel without all_pairs_dijkstra
 import networkx as nx
 import osmnx as ox
 
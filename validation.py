@@ -0,0 +1,65 @@
+import sys
+import time
+
+import numpy as np
+from scipy import stats
+
+
+def _kpis(summary):
+    return {
+        "num_deliveries": summary.num_deliveries,
+        "num_dispatches": summary.num_dispatches,
+        "mean delay": summary.delay.stats.mean,
+        "std delay": summary.delay.stats.std,
+        "mean time to delivery": summary.time_to_delivery.stats.mean,
+        "mean parcels per dispatch": summary.parcels_per_dispatch.stats.mean,
+    }
+
+
+def compare_trip_modes(simulate, seeds, rtol=1e-9, **params):
+    """
+    Runs simulate(seed, fast_forward=..., **params) for every seed in per-leg and in
+    fast-forward trip mode and compares the KPIs replication by replication.
+    Both modes draw the same random numbers, so the KPIs should match up to float
+    rounding; a Welch t-test on the per-replication mean delays is reported as well.
+    simulate must return a ResultsSummary or a Results, e.g. main.simulation_summary.
+    Returns: dict with the largest relative KPI difference, the t-test p-value, the
+             wall time of both modes and whether all replications matched.
+    """
+    kpis = {False: [], True: []}
+    seconds = {False: 0.0, True: 0.0}
+    for seed in seeds:
+        for fast_forward in (False, True):
+            start_time = time.perf_counter()
+            result = simulate(seed, fast_forward=fast_forward, **params)
+            seconds[fast_forward] += time.perf_counter() - start_time
+            kpis[fast_forward].append(_kpis(getattr(result, "summary", result)))
+
+    worst = {}
+    for name in kpis[False][0]:
+        per_leg = np.array([k[name] for k in kpis[False]], dtype=np.float64)
+        fast = np.array([k[name] for k in kpis[True]], dtype=np.float64)
+        worst[name] = float(np.nanmax(np.abs(fast - per_leg) / np.maximum(np.abs(per_leg), 1e-12)))
+
+    delays = {mode: [k["mean delay"] for k in kpis[mode]] for mode in kpis}
+    p_value = stats.ttest_ind(delays[False], delays[True], equal_var=False).pvalue if len(seeds) > 1 else np.nan
+    return {
+        "max relative difference": worst,
+        "matches": all(difference <= rtol for difference in worst.values()),
+        "delay t-test p-value": p_value,
+        "seconds per-leg": seconds[False],
+        "seconds fast-forward": seconds[True],
+    }
+
+
+if __name__ == "__main__":
+    from main import simulation_summary
+
+    all_match = True
+    for dispatch_mode in ("polling", "event"):
+        report = compare_trip_modes(simulation_summary, seeds=range(5), dispatch_mode=dispatch_mode)
+        all_match &= report["matches"]
+        print(f"Dispatch mode {dispatch_mode}: {'OK' if report['matches'] else 'MISMATCH'}")
+        for key, value in report.items():
+            print(f"  {key}: {value}")
+    sys.exit(0 if all_match else 1)
@@ -0,0 +1,213 @@
+import os
+import resource
+import tempfile
+import uuid
+from multiprocessing import Pool, Value
+
+import numpy as np
+
+# Backed by RAM on Linux, so "files" here never touch the disk
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# Set in every worker by _init_worker: 0, 1, ... in the order the workers started
+WORKER_ID = None
+
+
+class SharedArray:
+    """
+    numpy array in a memory-mapped file under SHARED_DIR. It pickles as its path, dtype
+    and shape, so pool workers (forked or spawned) map the same pages instead of
+    receiving or inheriting a private copy. The creating process removes the file with unlink().
+    """
+
+    def __init__(self, path, dtype, shape, mode="r+"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.mode = mode
+        self._array = None
+        self._owner = False
+
+    @classmethod
+    def create(cls, shape, dtype, directory=SHARED_DIR) -> "SharedArray":
+        path = os.path.join(directory, f"shared-{os.getpid()}-{uuid.uuid4().hex}.npy")
+        shared = cls(path, dtype, shape)
+        shared._array = np.lib.format.open_memmap(path, mode="w+", dtype=shared.dtype, shape=shared.shape)
+        shared._owner = True
+        return shared
+
+    @classmethod
+    def copy_of(cls, array: np.ndarray, directory=SHARED_DIR) -> "SharedArray":
+        shared = cls.create(array.shape, array.dtype, directory)
+        shared.array[...] = array
+        shared.array.flush()
+        shared.mode = "r" # Workers get a read-only view
+        return shared
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode=self.mode)
+        return self._array
+
+    def __getstate__(self):
+        return {"path": self.path, "dtype": self.dtype.str, "shape": self.shape, "mode": self.mode}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["dtype"], state["shape"], state["mode"])
+
+    def unlink(self):
+        self._array = None
+        if self._owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def share(array: np.ndarray) -> np.ndarray:
+    """
+    Read-only copy of array in shared memory, for data that workers inherit by fork
+    (memory-mapped arrays are already shared and returned as they are). The file is
+    removed right away: the mapping stays valid here and in the forked workers, and
+    nothing is left behind when they exit.
+    """
+    if isinstance(array, np.memmap):
+        return array
+    shared = SharedArray.copy_of(np.asarray(array))
+    view = shared.array
+    os.remove(shared.path)
+    view.flags.writeable = False
+    return view
+
+
+class TraceRef:
+    """
+    What a worker sends back instead of its trace: the summary and where its rows are in
+    a ColumnBuffer, or the columns themselves if its region was full.
+    """
+    __slots__ = ("summary", "worker", "start", "count", "columns")
+
+    def __init__(self, summary, worker, start, count, columns=None):
+        self.summary = summary
+        self.worker = worker
+        self.start = start
+        self.count = count
+        self.columns = columns
+
+
+class ColumnBuffer:
+    """
+    Preallocated shared columns (e.g. the delivery trace) that pool workers write into.
+    Worker WORKER_ID owns rows [WORKER_ID * capacity, (WORKER_ID + 1) * capacity) and
+    appends every replication after the previous one, so no locking is needed.
+    """
+
+    def __init__(self, columns: dict, workers, capacity=1_000_000):
+        self.capacity = capacity
+        self.workers = workers
+        self.columns = {name: SharedArray.create((workers * capacity,), dtype) for name, dtype in columns.items()}
+        self._cursor = 0 # Rows used in this worker's region (per process, never shared)
+
+    def store(self, summary, columns: dict) -> TraceRef:
+        """
+        Worker side: writes the columns of one replication into this worker's region.
+        """
+        count = len(next(iter(columns.values())))
+        worker = WORKER_ID if WORKER_ID is not None else 0
+        if worker >= self.workers or self._cursor + count > self.capacity:
+            return TraceRef(summary, worker, 0, count, columns) # Region full: fall back to pickling
+        start = worker * self.capacity + self._cursor
+        for name, values in columns.items():
+            self.columns[name].array[start:start + count] = values
+        self._cursor += count
+        return TraceRef(summary, worker, start, count)
+
+    def load(self, ref: TraceRef) -> dict:
+        """
+        Parent side: the columns of one replication (views into the shared buffer).
+        """
+        if ref.columns is not None:
+            return ref.columns
+        return {name: column.array[ref.start:ref.start + ref.count] for name, column in self.columns.items()}
+
+    def unlink(self):
+        for column in self.columns.values():
+            column.unlink()
+
+
+def process_memory() -> dict:
+    """
+    Resident memory of this process in MB. On Linux "private" (RssAnon) is what the
+    process does not share with the others; "shared" counts file and shared-memory
+    pages (memory-mapped matrices, SharedArrays) that every worker maps once.
+    """
+    memory = {"rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "private": float("nan"), "shared": float("nan")}
+    try:
+        with open("/proc/self/status") as f:
+            status = {line.split(":")[0]: line.split()[1] for line in f if line.startswith(("VmRSS", "RssAnon", "RssFile", "RssShmem"))}
+    except OSError:
+        return memory # Peak RSS only
+    memory["rss"] = int(status["VmRSS"]) / 1024
+    memory["private"] = int(status["RssAnon"]) / 1024
+    memory["shared"] = (int(status["RssFile"]) + int(status["RssShmem"])) / 1024
+    return memory
+
+
+def _init_worker(counter, setup, setup_args):
+    global WORKER_ID
+    with counter.get_lock():
+        WORKER_ID = counter.value
+        counter.value += 1
+    if setup is not None:
+        setup(*setup_args)
+
+
+def _call(task):
+    func, arg = task
+    return func(arg), os.getpid(), process_memory()
+
+
+class WorkerPool:
+    """
+    Persistent process pool: workers run setup(*setup_args) once and stay warm across
+    any number of run_adaptive / compare_scenarios / run_sweep calls (pass pool=...).
+    Every task reports the worker's memory afterwards, see memory_report.
+    Use as a context manager, or call close() to stop the workers.
+    """
+
+    def __init__(self, processes=None, setup=None, setup_args=()):
+        self.processes = processes or os.cpu_count()
+        self._counter = Value("i", 0)
+        self._pool = Pool(self.processes, initializer=_init_worker, initargs=(self._counter, setup, setup_args))
+        self.worker_memory = {} # pid -> process_memory() after its latest task
+
+    def _collect(self, outputs):
+        for result, pid, memory in outputs:
+            self.worker_memory[pid] = memory
+            yield result
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return self._collect(self._pool.imap_unordered(_call, ((func, arg) for arg in iterable), chunksize))
+
+    def map(self, func, iterable, chunksize=None):
+        return list(self._collect(self._pool.map(_call, [(func, arg) for arg in iterable], chunksize)))
+
+    def memory_report(self) -> str:
+        lines = [f"  worker {pid}: {m['rss']:.0f} MB resident, {m['private']:.0f} MB private, {m['shared']:.0f} MB shared"
+                 for pid, m in sorted(self.worker_memory.items())]
+        private = sum(m["private"] for m in self.worker_memory.values())
+        parent = process_memory()
+        lines.append(f"  parent: {parent['rss']:.0f} MB resident, {parent['private']:.0f} MB private")
+        lines.append(f"  total private over {len(self.worker_memory)} workers: {private:.0f} MB")
+        return "\n".join(lines)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()